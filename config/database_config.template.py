@@ -11,7 +11,7 @@ DATABASE_CONFIG = {
     "sslmode": "prefer"
 }
 
-# Connection Pool Settings
+# Connection Pool Settings (used by src/core/database.py)
 CONNECTION_POOL = {
     "min_connections": 2,
     "max_connections": 10,
@@ -20,6 +20,7 @@ CONNECTION_POOL = {
 }
 
 # Database Performance Settings
+# batch_size: rows per write batch, commit_interval: batches per commit in a sync phase
 PERFORMANCE = {
     "batch_size": 1000,
     "commit_interval": 100,
@@ -252,6 +252,30 @@ CREATE TABLE IF NOT EXISTS analytics.sync_status (
     metadata JSONB
 );
 
+-- Royalty ledger: one row per order line item, per vendor and month.
+-- Maintained incrementally by analytics.refresh_royalty_ledger() for the
+-- orders that are inserted or updated during sync.
+CREATE TABLE IF NOT EXISTS analytics.royalty_ledger (
+    order_id BIGINT NOT NULL,
+    line_item_id BIGINT NOT NULL,
+    line_position INTEGER,
+    vendor VARCHAR(255) NOT NULL DEFAULT '',
+    period_month DATE NOT NULL,
+    order_created_at TIMESTAMP WITH TIME ZONE,
+    product_id BIGINT,
+    product_name VARCHAR(500),
+    quantity INTEGER,
+    customer_name VARCHAR(500),
+    customer_email VARCHAR(255),
+    price_ex_vat DECIMAL(14,4) DEFAULT 0,
+    royalty_percent DECIMAL(5,2),
+    royalty_amount DECIMAL(14,4) DEFAULT 0,
+    shipping_ex_vat DECIMAL(14,4) DEFAULT 0,
+    shipping_share_ex_vat DECIMAL(14,4) DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id, line_item_id)
+);
+
 -- Daily sales summary
 CREATE TABLE IF NOT EXISTS analytics.daily_sales (
     date DATE PRIMARY KEY,
@@ -362,6 +386,8 @@ CREATE INDEX IF NOT EXISTS idx_line_items_variant_id ON shopify.order_line_items
 CREATE INDEX IF NOT EXISTS idx_line_items_sku ON shopify.order_line_items(sku);
 
 -- Analytics indexes
+CREATE INDEX IF NOT EXISTS idx_royalty_ledger_vendor_month ON analytics.royalty_ledger(lower(vendor), period_month);
+CREATE INDEX IF NOT EXISTS idx_royalty_ledger_month ON analytics.royalty_ledger(period_month);
 CREATE INDEX IF NOT EXISTS idx_sync_status_type ON analytics.sync_status(sync_type);
 CREATE INDEX IF NOT EXISTS idx_sync_status_started ON analytics.sync_status(started_at);
 CREATE INDEX IF NOT EXISTS idx_daily_sales_date ON analytics.daily_sales(date);
@@ -441,6 +467,161 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Columns the backup writes that the original table definitions lack
+ALTER TABLE shopify.products ADD COLUMN IF NOT EXISTS image_id BIGINT;
+ALTER TABLE shopify.orders ADD COLUMN IF NOT EXISTS customer_email VARCHAR(255);
+ALTER TABLE shopify.orders ADD COLUMN IF NOT EXISTS note TEXT;
+ALTER TABLE shopify.collections ADD COLUMN IF NOT EXISTS body_html TEXT;
+
+-- Royalty settings used by the ledger
+ALTER TABLE shopify.products ADD COLUMN IF NOT EXISTS royalty_percent DECIMAL(5,2);
+ALTER TABLE shopify.orders ADD COLUMN IF NOT EXISTS total_shipping_price DECIMAL(10,2);
+
+-- Content hash of raw_data, lets the sync skip rows Shopify returned unchanged
+ALTER TABLE shopify.products ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE shopify.orders ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE shopify.collections ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE shopify.customers ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+
+-- Orders per customer from the raw order (customers and orders sync in parallel,
+-- so orders.customer_id cannot be relied on); used to refresh buyer names in the ledger
+CREATE INDEX IF NOT EXISTS idx_orders_raw_customer_id ON shopify.orders (((raw_data->'customer'->>'id')::bigint));
+
+-- Line items are normalized during order ingestion (position in the order and refunds per line)
+ALTER TABLE shopify.order_line_items ADD COLUMN IF NOT EXISTS position INTEGER;
+ALTER TABLE shopify.order_line_items ADD COLUMN IF NOT EXISTS refunded_quantity INTEGER DEFAULT 0;
+ALTER TABLE shopify.order_line_items ADD COLUMN IF NOT EXISTS refunded_amount DECIMAL(10,2) DEFAULT 0;
+-- Line items keep pointing at products/variants that have since been deleted in Shopify
+ALTER TABLE shopify.order_line_items DROP CONSTRAINT IF EXISTS order_line_items_product_id_fkey;
+ALTER TABLE shopify.order_line_items DROP CONSTRAINT IF EXISTS order_line_items_variant_id_fkey;
+CREATE INDEX IF NOT EXISTS idx_line_items_vendor ON shopify.order_line_items(lower(vendor));
+
+-- Function to rebuild royalty ledger rows from shopify.order_line_items for the given orders (NULL = all orders)
+-- Prices are stored ex. VAT (25%), royalty_percent defaults to 20 when not set on the product.
+-- Quantity and amounts are net of refunded_quantity; fully refunded lines get no ledger row
+CREATE OR REPLACE FUNCTION analytics.refresh_royalty_ledger(order_ids BIGINT[])
+RETURNS INTEGER AS $$
+DECLARE
+    rows_written INTEGER;
+BEGIN
+    DELETE FROM analytics.royalty_ledger
+    WHERE order_ids IS NULL OR order_id = ANY(order_ids);
+
+    INSERT INTO analytics.royalty_ledger
+    (order_id, line_item_id, line_position, vendor, period_month, order_created_at,
+     product_id, product_name, quantity, customer_name, customer_email,
+     price_ex_vat, royalty_percent, royalty_amount, shipping_ex_vat, shipping_share_ex_vat, updated_at)
+    SELECT
+        l.order_id,
+        l.line_item_id,
+        l.line_position,
+        l.vendor,
+        DATE_TRUNC('month', l.created_at)::date,
+        l.created_at,
+        l.product_id,
+        l.product_name,
+        l.quantity,
+        l.customer_name,
+        l.customer_email,
+        l.price_ex_vat,
+        l.royalty_percent,
+        l.price_ex_vat * l.royalty_percent / 100.0,
+        l.shipping_ex_vat,
+        CASE WHEN SUM(l.price_ex_vat) OVER (PARTITION BY l.order_id) > 0
+             THEN l.shipping_ex_vat * l.price_ex_vat / SUM(l.price_ex_vat) OVER (PARTITION BY l.order_id)
+             ELSE 0 END,
+        CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            o.id AS order_id,
+            li.id AS line_item_id,
+            li.position AS line_position,
+            COALESCE(li.vendor, '') AS vendor,
+            o.created_at,
+            li.product_id,
+            li.title AS product_name,
+            COALESCE(li.quantity, 1) - COALESCE(li.refunded_quantity, 0) AS quantity,
+            COALESCE(
+                NULLIF(TRIM(CONCAT_WS(' ', c.first_name, c.last_name)), ''),
+                TRIM(CONCAT_WS(' ', o.raw_data->'customer'->>'first_name', o.raw_data->'customer'->>'last_name'))
+            ) AS customer_name,
+            COALESCE(c.email, o.email, o.raw_data->>'email') AS customer_email,
+            COALESCE(li.price, 0) * (COALESCE(li.quantity, 1) - COALESCE(li.refunded_quantity, 0)) / 1.25 AS price_ex_vat,
+            COALESCE(p.royalty_percent, 20) AS royalty_percent,
+            COALESCE(
+                o.total_shipping_price,
+                (o.raw_data->'total_shipping_price_set'->'shop_money'->>'amount')::numeric,
+                0
+            ) / 1.25 AS shipping_ex_vat
+        FROM shopify.orders o
+        JOIN shopify.order_line_items li ON li.order_id = o.id
+        LEFT JOIN shopify.products p ON p.id = li.product_id
+        LEFT JOIN shopify.customers c ON c.id = COALESCE(o.customer_id, (o.raw_data->'customer'->>'id')::bigint)
+        WHERE (order_ids IS NULL OR o.id = ANY(order_ids))
+          AND o.created_at IS NOT NULL
+          AND COALESCE(li.quantity, 1) > COALESCE(li.refunded_quantity, 0)
+    ) l;
+
+    GET DIAGNOSTICS rows_written = ROW_COUNT;
+    RETURN rows_written;
+END;
+$$ LANGUAGE plpgsql;
+
+-- royalty_percent is edited by hand on shopify.products and only read when an
+-- order's ledger rows are rebuilt, so rebuild every order with that product when
+-- it changes. The ledger's vendor is the line item's, so vendor edits change nothing.
+CREATE OR REPLACE FUNCTION analytics.refresh_royalty_ledger_for_products()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM analytics.refresh_royalty_ledger(ARRAY(
+        SELECT DISTINCT li.order_id
+        FROM new_products n
+        JOIN old_products o ON o.id = n.id
+        JOIN shopify.order_line_items li ON li.product_id = n.id
+        WHERE n.royalty_percent IS DISTINCT FROM o.royalty_percent
+    ));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_royalty_ledger_trigger ON shopify.products;
+CREATE TRIGGER products_royalty_ledger_trigger
+    AFTER UPDATE ON shopify.products
+    REFERENCING OLD TABLE AS old_products NEW TABLE AS new_products
+    FOR EACH STATEMENT EXECUTE FUNCTION analytics.refresh_royalty_ledger_for_products();
+
+-- Buyer names and emails in the ledger come from shopify.customers. Run once
+-- after the orders and customers syncs are done, as one set-based UPDATE that
+-- only touches rows whose name or email changed.
+CREATE OR REPLACE FUNCTION analytics.refresh_royalty_buyer_names()
+RETURNS INTEGER AS $$
+DECLARE
+    rows_updated INTEGER;
+BEGIN
+    UPDATE analytics.royalty_ledger l
+    SET customer_name = b.customer_name,
+        customer_email = b.customer_email,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            o.id AS order_id,
+            COALESCE(
+                NULLIF(TRIM(CONCAT_WS(' ', c.first_name, c.last_name)), ''),
+                TRIM(CONCAT_WS(' ', o.raw_data->'customer'->>'first_name', o.raw_data->'customer'->>'last_name'))
+            ) AS customer_name,
+            COALESCE(c.email, o.email, o.raw_data->>'email') AS customer_email
+        FROM shopify.orders o
+        LEFT JOIN shopify.customers c ON c.id = COALESCE(o.customer_id, (o.raw_data->'customer'->>'id')::bigint)
+    ) b
+    WHERE l.order_id = b.order_id
+      AND (l.customer_name IS DISTINCT FROM b.customer_name
+           OR l.customer_email IS DISTINCT FROM b.customer_email);
+
+    GET DIAGNOSTICS rows_updated = ROW_COUNT;
+    RETURN rows_updated;
+END;
+$$ LANGUAGE plpgsql;
+
 -- ========================================
 -- PERMISSIONS
 -- ========================================
@@ -527,5 +708,19 @@ LEFT JOIN shopify.orders o ON c.id = o.customer_id AND o.financial_status = 'pai
 GROUP BY c.id, c.first_name, c.last_name, c.email, c.created_at
 ORDER BY total_spent DESC NULLS LAST;
 
+-- Monthly royalty totals per vendor
+CREATE OR REPLACE VIEW analytics.royalty_monthly AS
+SELECT 
+    vendor,
+    period_month,
+    COUNT(*) as line_items,
+    COUNT(DISTINCT order_id) as orders_count,
+    SUM(price_ex_vat) as price_ex_vat,
+    SUM(royalty_amount) as royalty_amount,
+    SUM(shipping_share_ex_vat) as shipping_share_ex_vat
+FROM analytics.royalty_ledger
+GROUP BY vendor, period_month
+ORDER BY period_month DESC, vendor;
+
 -- Completion message
 SELECT 'Shopify Royalties database schema created successfully!' as message;
\ No newline at end of file
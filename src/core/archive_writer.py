@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+ARKIVFORMAT FOR SHOPIFY BACKUP
+Skriver hver ressurs som komprimerte JSONL-shards (zstd, eller gzip hvis
+zstandard ikke er installert) i stedet for én JSON-fil per objekt og
+pekerfiler per vendor/type/collection/år/status. Hver post får en
+kompakt indekslinje (id, shard, linje, offset og oppslagsfelt) som
+erstatter pekerfilene.
+
+Layout:
+    archive/<ressurs>/<ressurs>-00000.jsonl.zst   data
+    archive/<ressurs>/<ressurs>-00000.idx.jsonl   indeks for ferdig shard
+    archive/<ressurs>/index.jsonl.gz              samlet indeks for alle ferdige shards
+    archive/manifest.json                         tellere per ressurs
+"""
+import os
+import io
+import gzip
+import json
+import threading
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_SUFFIXES = {'zstd': '.jsonl.zst', 'gzip': '.jsonl.gz'}
+
+def open_shard_for_read(path):
+    """Åpne en shard som tekststrøm, uansett komprimering"""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstandard må være installert for å lese .zst-shards")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, encoding='utf-8')
+    return gzip.open(path, 'rt', encoding='utf-8')
+
+def open_shard_binary(path):
+    """Åpne en shard som ukomprimert binærstrøm (offsets i indeksen gjelder denne)"""
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("zstandard må være installert for å lese .zst-shards")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return gzip.open(path, 'rb')
+
+def read_records(path, locations):
+    """
+    Les poster fra én shard gitt (offset, length)-par. Shards kan bare
+    spoles forover, så postene leses i offset-rekkefølge i én gjennomgang.
+    Gir (offset, post) i samme rekkefølge.
+    """
+    with open_shard_binary(path) as f:
+        position = 0
+        for offset, length in sorted(locations):
+            if offset > position:
+                f.seek(offset - position, os.SEEK_CUR)
+            data = b''
+            while len(data) < length:
+                chunk = f.read(length - len(data))
+                if not chunk:
+                    raise EOFError(f"Uventet slutt på {path} ved offset {offset}")
+                data += chunk
+            position = offset + length
+            yield offset, json.loads(data)
+
+class ResourceShards:
+    """Shards og indeks for én ressurs"""
+
+    def __init__(self, directory, resource, compression, shard_records):
+        self.directory = directory
+        self.resource = resource
+        self.compression = compression
+        self.shard_records = shard_records
+        self.records = 0
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+        self._stream = None
+        self._raw = None
+        self._shard_name = None
+        self._shard_entries = []
+        os.makedirs(directory, exist_ok=True)
+        self._discard_unfinished()
+        self._next_shard = len(self._finished_shards())
+
+    def _finished_shards(self):
+        """Shards med indeksfil er ferdigskrevet (overlever avbrutt backup)"""
+        return sorted(
+            name[:-len('.idx.jsonl')] for name in os.listdir(self.directory) if name.endswith('.idx.jsonl')
+        )
+
+    def _shard_files(self):
+        """Datafiler for ressursen, uansett komprimering"""
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(f"{self.resource}-") and name.endswith(tuple(SHARD_SUFFIXES.values()))
+        )
+
+    def _discard_unfinished(self):
+        """Fjern shards uten indeks (skrevet etter siste sjekkpunkt før et avbrudd)"""
+        finished = set(self._finished_shards())
+        for name in self._shard_files():
+            if name.split('.', 1)[0] not in finished:
+                os.remove(os.path.join(self.directory, name))
+
+    def reset(self):
+        """Start ressursen på nytt (henting fra første side)"""
+        with self._lock:
+            self._close_shard(finish=False)
+            for name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, name))
+            self._next_shard = 0
+            self.records = 0
+            self.bytes_written = 0
+
+    def _open_shard(self):
+        base = f"{self.resource}-{self._next_shard:05d}"
+        self._next_shard += 1
+        self._shard_name = base + SHARD_SUFFIXES[self.compression]
+        path = os.path.join(self.directory, self._shard_name)
+        if self.compression == 'zstd':
+            self._raw = open(path, 'wb')
+            writer = zstandard.ZstdCompressor(level=10).stream_writer(self._raw, closefd=False)
+            self._stream = io.TextIOWrapper(writer, encoding='utf-8')
+        else:
+            self._raw = None
+            self._stream = gzip.open(path, 'wt', encoding='utf-8', compresslevel=6)
+        self._shard_entries = []
+        self._offset = 0
+
+    def _close_shard(self, finish=True):
+        """Lukk åpen shard; med finish skrives indeksen som markerer den som ferdig"""
+        if self._stream is None:
+            return
+        self._stream.close()
+        if self._raw is not None:
+            self._raw.close()
+        path = os.path.join(self.directory, self._shard_name)
+        if finish:
+            self.bytes_written += os.path.getsize(path)
+            base = self._shard_name[:-len(SHARD_SUFFIXES[self.compression])]
+            idx_path = os.path.join(self.directory, f"{base}.idx.jsonl")
+            with open(f"{idx_path}.tmp", 'w', encoding='utf-8') as f:
+                for entry in self._shard_entries:
+                    f.write(json.dumps(entry, separators=(',', ':'), default=str) + '\n')
+            os.replace(f"{idx_path}.tmp", idx_path)
+        else:
+            os.remove(path)
+        self._stream = None
+        self._raw = None
+        self._shard_entries = []
+
+    def write(self, record, index_fields):
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            if self._stream is None:
+                self._open_shard()
+            self._stream.write(line)
+            length = len(line.encode('utf-8'))
+            entry = {
+                'id': record.get('id'),
+                'shard': self._shard_name,
+                'line': len(self._shard_entries),
+                'offset': self._offset,
+                'length': length
+            }
+            entry.update(index_fields)
+            self._shard_entries.append(entry)
+            self._offset += length
+            self.records += 1
+            if len(self._shard_entries) >= self.shard_records:
+                self._close_shard()
+            return entry
+
+    def checkpoint(self):
+        """Avslutt åpen shard, så alt som er skrevet overlever et avbrudd"""
+        with self._lock:
+            self._close_shard()
+
+    def close(self):
+        """
+        Avslutt siste shard og slå sammen shard-indeksene til index.jsonl.gz.
+        Shard-indeksene beholdes, så en senere inkrementell kjøring samme dag
+        kan legge til shards og bygge den samlede indeksen på nytt.
+        """
+        with self._lock:
+            self._close_shard()
+            shards = self._finished_shards()
+            index_path = os.path.join(self.directory, 'index.jsonl.gz')
+            entries = 0
+            with gzip.open(f"{index_path}.tmp", 'wt', encoding='utf-8') as index:
+                for base in shards:
+                    idx_path = os.path.join(self.directory, f"{base}.idx.jsonl")
+                    with open(idx_path, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            index.write(line)
+                            entries += 1
+            os.replace(f"{index_path}.tmp", index_path)
+            return {
+                'records': entries,
+                'shards': self._shard_files(),
+                'files': len(os.listdir(self.directory)),
+                'bytes': sum(
+                    os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+                ),
+                'index': 'index.jsonl.gz'
+            }
+
+class ArchiveWriter:
+    """Komprimert JSONL-arkiv for alle ressurser i en backup"""
+
+    def __init__(self, root, compression='zstd', shard_records=10000):
+        if compression == 'zstd' and zstandard is None:
+            print("⚠️  zstandard er ikke installert, bruker gzip for arkivet")
+            compression = 'gzip'
+        if compression not in SHARD_SUFFIXES:
+            raise ValueError(f"Ukjent komprimering: {compression}")
+        self.root = root
+        self.compression = compression
+        self.shard_records = shard_records
+        self._resources = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def resource(self, name):
+        with self._lock:
+            if name not in self._resources:
+                self._resources[name] = ResourceShards(
+                    os.path.join(self.root, name), name, self.compression, self.shard_records
+                )
+            return self._resources[name]
+
+    def write(self, resource, record, **index_fields):
+        """
+        Legg én post i ressursens arkiv, med oppslagsfelt for indeksen.
+        Returnerer indekslinjen (shard, linje, offset, length).
+        """
+        return self.resource(resource).write(record, index_fields)
+
+    def reset(self, resource):
+        self.resource(resource).reset()
+
+    def checkpoint(self, resource):
+        self.resource(resource).checkpoint()
+
+    def close(self):
+        """Avslutt alle ressurser og skriv manifest.json"""
+        with self._lock:
+            resources = dict(self._resources)
+        manifest = {
+            'format': 'jsonl',
+            'compression': self.compression,
+            'created_at': datetime.now().isoformat(),
+            'resources': {name: shards.close() for name, shards in resources.items()}
+        }
+        with open(os.path.join(self.root, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
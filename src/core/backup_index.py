@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+SØKBAR INDEKS FOR SHOPIFY BACKUP
+SQLite-indeks i _metadata/backup_index.sqlite som peker hvert objekt til
+filen (mappeformat) eller shard + offset (arkivformat) og kobler det til
+dimensjonene vendor, type, collection, status, år og måned. Erstatter
+oppslag via by_vendor-, by_type-, by_collection-, by_year- og
+by_status-mappene, og virker offline uten PostgreSQL.
+Indeksen noterer om hver ressurs kommer fra en full eller inkrementell
+henting. En inkrementell backup har bare objektene som er endret siden
+forrige synk, så query og values avviser den (med hint om siste fulle
+backup) med mindre --partial er gitt.
+
+Eksempler:
+    python3 backup_index.py query orders --vendor "Forlag X" --month 2025-03
+    python3 backup_index.py query products --type Bok --status active --full
+    python3 backup_index.py values orders vendor
+    python3 backup_index.py get orders 5123456789
+    python3 backup_index.py --partial query orders --month 2025-03
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from collections import defaultdict
+
+from archive_writer import read_records
+
+INDEX_FILENAME = 'backup_index.sqlite'
+DEFAULT_BACKUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shopify_organized_backup', 'latest')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    resource TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    offset INTEGER,
+    length INTEGER,
+    created_at TEXT,
+    title TEXT,
+    PRIMARY KEY (resource, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dimensions (
+    resource TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value TEXT NOT NULL COLLATE NOCASE,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (resource, dimension, value, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    resource TEXT PRIMARY KEY,
+    mode TEXT NOT NULL,
+    since TEXT,
+    updated_at TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_dimensions_object ON dimensions (resource, id);
+CREATE INDEX IF NOT EXISTS idx_objects_created ON objects (resource, created_at);
+"""
+
+class BackupIndex:
+    """Oppslag fra dimensjoner til objekter i én backup"""
+
+    def __init__(self, base_dir, readonly=False):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, '_metadata', INDEX_FILENAME)
+        self._lock = threading.Lock()
+        if readonly:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"Fant ingen backup-indeks: {self.path}")
+            self.conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+        self.conn.row_factory = sqlite3.Row
+
+    def add(self, resource, object_id, path, offset=None, length=None, created_at=None, title=None, **dimensions):
+        """
+        Indekser ett objekt. path er relativ til backup-mappen; offset og
+        length settes for objekter i en arkiv-shard. Dimensjonsverdier kan
+        være lister (f.eks. flere vendors på én ordre).
+        """
+        rows = []
+        for dimension, values in dimensions.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            rows.extend(
+                (resource, dimension, str(value), object_id) for value in values if value not in (None, '')
+            )
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO objects (resource, id, path, offset, length, created_at, title) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (resource, object_id, path, offset, length, created_at, title)
+            )
+            self.conn.execute("DELETE FROM dimensions WHERE resource = ? AND id = ?", (resource, object_id))
+            self.conn.executemany("INSERT OR IGNORE INTO dimensions VALUES (?, ?, ?, ?)", rows)
+
+    def reset(self, resource):
+        """Fjern alle objekter for en ressurs (full synk bygger dem på nytt)"""
+        with self._lock:
+            self.conn.execute("DELETE FROM objects WHERE resource = ?", (resource,))
+            self.conn.execute("DELETE FROM dimensions WHERE resource = ?", (resource,))
+
+    def set_coverage(self, resource, since=None):
+        """
+        Noter hva indeksen dekker for en ressurs: since=None er en full
+        henting, ellers kun objekter endret siden since. En full henting
+        tidligere samme dag beholdes når en inkrementell kjøring legger til,
+        og for flere inkrementelle kjøringer beholdes den tidligste since.
+        """
+        with self._lock:
+            current = self.conn.execute("SELECT mode FROM coverage WHERE resource = ?", (resource,)).fetchone()
+            if since is not None and current is not None:
+                return
+            self.conn.execute(
+                "INSERT OR REPLACE INTO coverage VALUES (?, ?, ?, ?)",
+                (resource, 'full' if since is None else 'incremental', since, datetime.now().isoformat())
+            )
+
+    def coverage(self, resource):
+        """
+        {'mode': 'full'|'incremental', 'since'} for ressursen, None hvis den
+        ikke er indeksert, eller mode 'unknown' for indekser uten dekning.
+        """
+        with self._lock:
+            try:
+                row = self.conn.execute(
+                    "SELECT mode, since FROM coverage WHERE resource = ?", (resource,)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                return {'mode': 'unknown', 'since': None}
+        return dict(row) if row else None
+
+    def commit(self):
+        with self._lock:
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.commit()
+            self.conn.close()
+
+    def counts(self):
+        """Antall indekserte objekter per ressurs"""
+        with self._lock:
+            rows = self.conn.execute("SELECT resource, COUNT(*) FROM objects GROUP BY resource").fetchall()
+        return {resource: count for resource, count in rows}
+
+    def query(self, resource, since=None, until=None, limit=None, **filters):
+        """
+        Finn objekter der alle filtre treffer, f.eks.
+        query('orders', vendor='Forlag X', month='2025-03').
+        since/until avgrenser created_at (ISO-dato, until er eksklusiv).
+        """
+        sql = "SELECT * FROM objects o WHERE o.resource = ?"
+        params = [resource]
+        for dimension, value in filters.items():
+            if value is None:
+                continue
+            sql += (
+                " AND EXISTS (SELECT 1 FROM dimensions d WHERE d.resource = o.resource"
+                " AND d.dimension = ? AND d.value = ? AND d.id = o.id)"
+            )
+            params.extend([dimension, str(value)])
+        if since:
+            sql += " AND o.created_at >= ?"
+            params.append(since)
+        if until:
+            sql += " AND o.created_at < ?"
+            params.append(until)
+        sql += " ORDER BY o.created_at, o.id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def get(self, resource, object_id):
+        """Indeksoppføringen for ett objekt, eller None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT * FROM objects WHERE resource = ? AND id = ?", (resource, int(object_id))
+            ).fetchone()
+        return dict(row) if row else None
+
+    def values(self, resource, dimension):
+        """Alle verdier for en dimensjon med antall objekter"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT value, COUNT(*) FROM dimensions WHERE resource = ? AND dimension = ? "
+                "GROUP BY value ORDER BY COUNT(*) DESC, value",
+                (resource, dimension)
+            ).fetchall()
+        return [(value, count) for value, count in rows]
+
+    def load(self, entries):
+        """
+        Les de fullstendige objektene for indeksoppføringer. Objekter i
+        samme shard leses i én gjennomgang. Gir (oppføring, objekt).
+        """
+        by_shard = defaultdict(list)
+        for entry in entries:
+            path = os.path.join(self.base_dir, entry['path'])
+            if entry.get('offset') is None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield entry, json.load(f)
+            else:
+                by_shard[path].append(entry)
+
+        for path, shard_entries in by_shard.items():
+            by_offset = {entry['offset']: entry for entry in shard_entries}
+            locations = [(entry['offset'], entry['length']) for entry in shard_entries]
+            for offset, record in read_records(path, locations):
+                yield by_offset[offset], record
+
+def find_full_backup(backup_dir, resource):
+    """Nyeste daterte backup ved siden av backup_dir med full indeks for ressursen"""
+    parent = os.path.dirname(os.path.realpath(backup_dir))
+    if not os.path.isdir(parent):
+        return None
+    for name in sorted(os.listdir(parent), reverse=True):
+        candidate = os.path.join(parent, name)
+        if name == 'latest' or not os.path.exists(os.path.join(candidate, '_metadata', INDEX_FILENAME)):
+            continue
+        try:
+            index = BackupIndex(candidate, readonly=True)
+            try:
+                coverage = index.coverage(resource)
+            finally:
+                index.close()
+        except sqlite3.Error:
+            continue
+        if coverage and coverage['mode'] == 'full':
+            return candidate
+    return None
+
+def check_coverage(index, resource, allow_partial=False):
+    """Avvis (eller advar ved allow_partial) søk i en ressurs som ikke er fullt indeksert"""
+    coverage = index.coverage(resource)
+    if coverage and coverage['mode'] == 'full':
+        return True
+    if coverage and coverage['mode'] == 'unknown':
+        print("⚠️  Indeksen er laget før full/inkrementell ble notert; svaret kan være ufullstendig", file=sys.stderr)
+        return True
+    if coverage is None:
+        reason = f"{resource} er ikke indeksert i denne backupen (inkrementell kjøring uten endringer?)"
+    else:
+        reason = f"{resource} i denne backupen er inkrementell: kun objekter endret siden {coverage['since']}"
+    if allow_partial:
+        print(f"⚠️  {reason}", file=sys.stderr)
+        return True
+    full_backup = find_full_backup(index.base_dir, resource)
+    hint = f" Siste fulle backup: --backup {full_backup}." if full_backup else ""
+    print(f"❌ {reason}.{hint} Bruk --partial for å søke likevel.", file=sys.stderr)
+    return False
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Søk i backup-indeksen uten database")
+    parser.add_argument('--backup', default=DEFAULT_BACKUP_DIR, help="Backup-mappe (standard: latest)")
+    parser.add_argument('--partial', action='store_true', help="Søk selv om backupen bare har endrede objekter")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    query = commands.add_parser('query', help="Finn objekter etter dimensjoner")
+    query.add_argument('resource', choices=['products', 'orders', 'customers', 'collections'])
+    query.add_argument('--vendor')
+    query.add_argument('--type')
+    query.add_argument('--collection', help="Collection-id eller tittel")
+    query.add_argument('--status', help="Produktstatus, finansiell ordrestatus eller kundestatus")
+    query.add_argument('--fulfillment', help="Leveringsstatus for ordrer")
+    query.add_argument('--year')
+    query.add_argument('--month', help="ÅÅÅÅ-MM")
+    query.add_argument('--since', help="created_at fra og med (ISO-dato)")
+    query.add_argument('--until', help="created_at før (ISO-dato)")
+    query.add_argument('--limit', type=int)
+    query.add_argument('--full', action='store_true', help="Skriv ut hele objektene som JSONL")
+
+    values = commands.add_parser('values', help="List verdier for en dimensjon")
+    values.add_argument('resource')
+    values.add_argument('dimension')
+
+    get = commands.add_parser('get', help="Hent ett objekt")
+    get.add_argument('resource')
+    get.add_argument('id', type=int)
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        index = BackupIndex(args.backup, readonly=True)
+    except (FileNotFoundError, sqlite3.Error) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    if args.command == 'values':
+        if not check_coverage(index, args.resource, args.partial):
+            return 2
+        for value, count in index.values(args.resource, args.dimension):
+            print(f"{count:8}  {value}")
+        return 0
+
+    if args.command == 'get':
+        entry = index.get(args.resource, args.id)
+        if entry is None:
+            print(f"❌ Fant ikke {args.resource} {args.id}", file=sys.stderr)
+            coverage = index.coverage(args.resource)
+            if not coverage or coverage['mode'] == 'incremental':
+                print("   Backupen er inkrementell; objektet kan ligge i en eldre backup (--backup).", file=sys.stderr)
+            return 1
+        for _, record in index.load([entry]):
+            print(json.dumps(record, indent=2, ensure_ascii=False, default=str))
+        return 0
+
+    if not check_coverage(index, args.resource, args.partial):
+        return 2
+
+    filters = {
+        'vendor': args.vendor,
+        'type': args.type,
+        'collection': args.collection,
+        'status': args.status,
+        'fulfillment': args.fulfillment,
+        'year': args.year,
+        'month': args.month
+    }
+    entries = index.query(args.resource, since=args.since, until=args.until, limit=args.limit, **filters)
+    if args.full:
+        for _, record in index.load(entries):
+            print(json.dumps(record, ensure_ascii=False, default=str))
+    else:
+        for entry in entries:
+            print(f"{entry['id']:>15}  {entry['created_at'] or '':25}  {entry['title'] or ''}")
+        print(f"📇 {len(entries)} treff", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
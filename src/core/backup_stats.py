@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+BACKUP-STATISTIKK UTEN NY GJENNOMGANG AV TREET
+Skriverne teller filer, mapper og bytes per kategori mens de skriver.
+Tellerne lagres i _metadata/backup_stats.json, så en ny kjøring samme
+dag fortsetter fra dem. verify_categories() teller på nytt med os.scandir
+parallelt per kategori når tallene skal kontrolleres.
+"""
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def existing_size(path):
+    """Størrelsen til en fil som skal overskrives, eller None hvis den er ny"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+class BackupStats:
+    """Løpende fil-, mappe- og bytetellere per kategori"""
+
+    def __init__(self, categories, manifest_path):
+        self.categories = {name: os.path.abspath(path) for name, path in categories.items()}
+        self.manifest_path = manifest_path
+        self.counters = {name: {'files': 0, 'folders': 0, 'bytes': 0} for name in self.categories}
+        self._known_dirs = set(self.categories.values())
+        self._lock = threading.Lock()
+        # Egen lås for save(): produkt-, ordre- og kundetrådene lagrer samtidig til samme .tmp-fil
+        self._save_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Fortsett fra tellerne til en tidligere kjøring i samme backup-mappe"""
+        if not os.path.exists(self.manifest_path):
+            return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Kunne ikke lese {self.manifest_path}: {e}")
+            return
+        for name, counters in saved.get('categories', {}).items():
+            if name in self.counters:
+                self.counters[name].update(counters)
+
+    def category_for(self, path):
+        path = os.path.abspath(path)
+        for name, root in self.categories.items():
+            if path == root or path.startswith(root + os.sep):
+                return name
+        return None
+
+    def make_dirs(self, path):
+        """os.makedirs som teller mappene som faktisk opprettes"""
+        path = os.path.abspath(path)
+        with self._lock:
+            if path in self._known_dirs:
+                return
+            created = []
+            current = path
+            while current not in self._known_dirs and not os.path.isdir(current):
+                created.append(current)
+                current = os.path.dirname(current)
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
+            for directory in created:
+                category = self.category_for(directory)
+                if category and directory != self.categories[category]:
+                    self.counters[category]['folders'] += 1
+
+    def record_file(self, path, size, previous_size=None):
+        """Tell en skrevet fil; previous_size er størrelsen til filen som ble overskrevet"""
+        category = self.category_for(path)
+        if category is None:
+            return
+        with self._lock:
+            counters = self.counters[category]
+            if previous_size is None:
+                counters['files'] += 1
+            counters['bytes'] += size - (previous_size or 0)
+
+    def set_category(self, category, files, folders, size):
+        """Erstatt tellerne for en kategori som er talt av en annen skriver (f.eks. arkivet)"""
+        with self._lock:
+            self.counters[category] = {'files': files, 'folders': folders, 'bytes': size}
+
+    def write_json(self, path, data, **dump_options):
+        """Skriv JSON og tell filen"""
+        previous_size = existing_size(path)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_options)
+            size = f.tell()
+        self.record_file(path, size, previous_size)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: dict(counters) for name, counters in self.counters.items()}
+
+    def save(self):
+        """Lagre tellerne atomisk (trådsikkert)"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with self._save_lock:
+            data = {'categories': self.snapshot()}
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+def scan_tree(path):
+    """Tell filer, mapper og bytes under path med os.scandir"""
+    counters = {'files': 0, 'folders': 0, 'bytes': 0}
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            counters['folders'] += 1
+                            stack.append(entry.path)
+                        else:
+                            counters['files'] += 1
+                            counters['bytes'] += entry.stat().st_size
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    return counters
+
+def verify_categories(categories, max_workers=8):
+    """Tell alle kategorier på nytt, parallelt med én os.scandir-gjennomgang per kategori"""
+    existing = {name: path for name, path in categories.items() if os.path.exists(path)}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='verify') as executor:
+        results = dict(zip(existing, executor.map(scan_tree, existing.values())))
+    return results
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+SJEKKPUNKTER FOR PAGINERT HENTING
+Lagrer page_info-cursoren og løpende tellere for en ressurs i en liten
+JSON-fil etter hver committet side. Avbrytes backupen (nettverk, OOM,
+omstart) fortsetter neste kjøring fra siste committede side i stedet for
+side 1.
+"""
+import os
+import json
+from datetime import datetime
+
+class SyncCheckpoint:
+    """Holdbart sjekkpunkt for én paginert ressurs"""
+
+    def __init__(self, path, resource, params):
+        self.path = path
+        self.resource = resource
+        self.params = dict(params or {})
+        self.cursor = None
+        self.page_count = 0
+        self.state = {}
+        self._pending = None
+        self._load()
+
+    def _load(self):
+        """Les sjekkpunktet hvis det gjelder samme ressurs og samme parametre"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Kunne ikke lese sjekkpunkt {self.path}: {e}")
+            return
+        if data.get('resource') != self.resource or data.get('params') != self.params:
+            print(f"⚠️  Sjekkpunkt for {self.resource} gjelder en annen henting, starter på nytt")
+            return
+        self.cursor = data.get('cursor')
+        self.page_count = data.get('page_count', 0)
+        self.state = data.get('state', {})
+
+    @property
+    def resuming(self):
+        return self.cursor is not None
+
+    def advance(self, page_count, next_cursor):
+        """Noter posisjonen etter en hentet side (lagres først ved save)"""
+        self._pending = (page_count, next_cursor)
+
+    def save(self, **state):
+        """Skriv sjekkpunktet atomisk etter at siden er committet"""
+        if self._pending is None:
+            return
+        self.page_count, self.cursor = self._pending
+        self.state.update(state)
+        if self.cursor is None:
+            # Siste side er ferdig, ingenting å fortsette fra
+            self.clear()
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'resource': self.resource,
+                'params': self.params,
+                'cursor': self.cursor,
+                'page_count': self.page_count,
+                'state': self.state,
+                'updated_at': datetime.now().isoformat()
+            }, f, indent=2, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        """Glem posisjonen og start fra side 1 (f.eks. når cursoren er utløpt)"""
+        self.cursor = None
+        self.page_count = 0
+        self.state = {}
+        self._pending = None
+        self.clear()
+
+    def clear(self):
+        """Fjern sjekkpunktet når hentingen er fullført"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+FELLES DATABASE-TILGANG
+Én pool av PostgreSQL-tilkoblinger for backup og rapporter, styrt av
+config/database_config.py (CONNECTION_POOL og PERFORMANCE) med
+POSTGRES_*- og DB_*-miljøvariabler som overstyring.
+"""
+import os
+import threading
+import time
+import importlib.util
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'config')
+
+DEFAULT_DATABASE_CONFIG = {
+    "host": "localhost",
+    "port": 5433,
+    "database": "shopifydata",
+    "user": "shopifyuser",
+    "password": "",
+    "sslmode": "prefer"
+}
+DEFAULT_CONNECTION_POOL = {
+    "min_connections": 2,
+    "max_connections": 10,
+    "connection_timeout": 30,
+    "idle_timeout": 300
+}
+DEFAULT_PERFORMANCE = {
+    "batch_size": 1000,
+    "commit_interval": 100
+}
+
+_pool = None
+_slots = None
+_unavailable = False
+_settings = None
+_last_used = {}
+_leased = set()
+_lock = threading.Lock()
+
+def load_config_module():
+    """Les config/database_config.py, eller malen hvis den ikke er kopiert ennå"""
+    for filename in ('database_config.py', 'database_config.template.py'):
+        path = os.path.join(CONFIG_DIR, filename)
+        if not os.path.exists(path):
+            continue
+        try:
+            spec = importlib.util.spec_from_file_location('database_config', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+        except Exception as e:
+            print(f"⚠️  Kunne ikke lese {path}: {e}")
+    return None
+
+def database_settings():
+    """
+    Samle tilkoblings-, pool- og ytelsesinnstillinger.
+    Leses ved første bruk, slik at skriptene rekker å laste sin .env først.
+    """
+    global _settings
+    if _settings is not None:
+        return _settings
+
+    module = load_config_module()
+    database = dict(DEFAULT_DATABASE_CONFIG, **getattr(module, 'DATABASE_CONFIG', {}))
+    pool = dict(DEFAULT_CONNECTION_POOL, **getattr(module, 'CONNECTION_POOL', {}))
+    performance = dict(DEFAULT_PERFORMANCE, **getattr(module, 'PERFORMANCE', {}))
+
+    # Miljøvariabler (.env) vinner over config-filen
+    connection = {
+        'host': os.getenv('POSTGRES_HOST', database['host']),
+        'port': os.getenv('POSTGRES_PORT', str(database['port'])),
+        'dbname': os.getenv('POSTGRES_DB', database['database']),
+        'user': os.getenv('POSTGRES_USER', database['user']),
+        'password': os.getenv('POSTGRES_PASSWORD', database['password']),
+        'sslmode': os.getenv('POSTGRES_SSLMODE', database.get('sslmode', 'prefer')),
+        'connect_timeout': int(pool['connection_timeout'])
+    }
+    pool['min_connections'] = int(os.getenv('DB_POOL_MIN', pool['min_connections']))
+    pool['max_connections'] = int(os.getenv('DB_POOL_MAX', pool['max_connections']))
+    performance['batch_size'] = int(os.getenv('DB_BATCH_SIZE', performance['batch_size']))
+    performance['commit_interval'] = int(os.getenv('DB_COMMIT_INTERVAL', performance['commit_interval']))
+
+    _settings = {
+        'connection': connection,
+        'pool': pool,
+        'performance': performance
+    }
+    return _settings
+
+def batch_size():
+    """Antall rader per batch ved skriving (PERFORMANCE.batch_size)"""
+    return database_settings()['performance']['batch_size']
+
+def commit_interval():
+    """Antall batcher mellom hver commit i en fase (PERFORMANCE.commit_interval)"""
+    return database_settings()['performance']['commit_interval']
+
+def get_pool():
+    """
+    Opprett connection pool ved første bruk.
+    Returnerer None hvis databasen ikke kan nås; det huskes til close_pool(),
+    så hele kjøringen går uten database i stedet for bare noen av fasene.
+    """
+    global _pool, _slots, _unavailable
+    with _lock:
+        if _pool is None and not _unavailable:
+            settings = database_settings()
+            try:
+                _pool = ThreadedConnectionPool(
+                    settings['pool']['min_connections'],
+                    settings['pool']['max_connections'],
+                    **settings['connection']
+                )
+            except psycopg2.OperationalError as e:
+                print(f"❌ Database-tilkoblingsfeil, fortsetter uten database: {e}")
+                _unavailable = True
+                return None
+            _slots = threading.BoundedSemaphore(settings['pool']['max_connections'])
+        return _pool
+
+def get_db_connection():
+    """
+    Hent en tilkobling fra poolen.
+    None betyr at databasen ikke er tilgjengelig for denne kjøringen. Når poolen
+    finnes, ventes det inntil connection_timeout sekunder på en ledig tilkobling
+    (PoolError ellers), og andre tilkoblingsfeil kastes videre.
+    """
+    pool = get_pool()
+    if pool is None:
+        return None
+
+    settings = database_settings()['pool']
+    slots = _slots
+    if not slots.acquire(timeout=settings['connection_timeout']):
+        raise PoolError(
+            f"Ingen ledig database-tilkobling etter {settings['connection_timeout']}s "
+            f"(alle {settings['max_connections']} er i bruk)"
+        )
+    try:
+        conn = pool.getconn()
+
+        # Bytt ut tilkoblinger som har ligget ubrukt lenger enn idle_timeout
+        with _lock:
+            last_used = _last_used.pop(id(conn), None)
+        if conn.closed or (last_used and time.monotonic() - last_used > settings['idle_timeout']):
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+
+    with _lock:
+        _leased.add(id(conn))
+    return conn
+
+def release_db_connection(conn):
+    """Lever tilkoblingen tilbake til poolen (åpen transaksjon rulles tilbake)"""
+    if conn is None or _pool is None:
+        return
+    with _lock:
+        _last_used[id(conn)] = time.monotonic()
+        leased = id(conn) in _leased
+        _leased.discard(id(conn))
+    _pool.putconn(conn, close=bool(conn.closed))
+    if leased:
+        _slots.release()
+
+def close_pool():
+    """Lukk alle tilkoblinger i poolen"""
+    global _pool, _slots, _unavailable
+    with _lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool = None
+        _slots = None
+        _unavailable = False
+        _last_used.clear()
+        _leased.clear()
+
+@contextmanager
+def pooled_connection():
+    """Lån en tilkobling fra poolen for en blokk"""
+    conn = get_db_connection()
+    if conn is None:
+        raise psycopg2.OperationalError("Ingen database-tilkobling tilgjengelig")
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+@contextmanager
+def transaction(conn=None):
+    """
+    Gi en cursor for én skriveoperasjon.
+    Uten conn: egen tilkobling fra poolen med commit/rollback.
+    Med conn (fase-transaksjon): savepoint, så en feil kun ruller tilbake
+    denne operasjonen og fasen selv bestemmer når det committes.
+    """
+    if conn is not None:
+        cursor = conn.cursor()
+        cursor.execute("SAVEPOINT write_batch")
+        try:
+            yield cursor
+            cursor.execute("RELEASE SAVEPOINT write_batch")
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT write_batch")
+            raise
+        finally:
+            cursor.close()
+        return
+
+    with pooled_connection() as own_conn:
+        cursor = own_conn.cursor()
+        try:
+            yield cursor
+            own_conn.commit()
+        except Exception:
+            own_conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+class PhaseTransaction:
+    """
+    Én tilkobling og transaksjon per synk-fase.
+    Kalles step() etter hver batch; det committes hver commit_interval batch
+    og ved slutten av fasen. on_commit kalles etter hver commit (f.eks. for
+    å lagre et sjekkpunkt som kun skal peke på committede data).
+    Uten database (conn None) kalles on_commit etter hver batch. Feiler
+    tilkoblingen, kastes feilen fra __enter__ og on_commit kalles aldri.
+    """
+
+    def __init__(self, interval=None, on_commit=None):
+        self.interval = interval or commit_interval()
+        self.on_commit = on_commit
+        self.conn = None
+        self.pending = 0
+
+    def __enter__(self):
+        self.conn = get_db_connection()
+        return self
+
+    def step(self):
+        if self.conn is None:
+            # Uten database er batchen ferdig når den er skrevet til disk
+            if self.on_commit:
+                self.on_commit()
+            return
+        self.pending += 1
+        if self.pending >= self.interval:
+            self.commit()
+
+    def commit(self):
+        if self.conn is None:
+            return
+        self.conn.commit()
+        committed_batches, self.pending = self.pending, 0
+        if self.on_commit and committed_batches:
+            self.on_commit()
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.conn is None:
+            return False
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            release_db_connection(self.conn)
+            self.conn = None
+        return False
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+MEDIA-NEDLASTING FOR SHOPIFY BACKUP
+Laster ned bilder parallelt med en begrenset trådpool over en delt
+requests-session, slik at TCP/TLS-tilkoblinger gjenbrukes mellom bilder.
+Med et MediaStore lagres hvert bilde én gang (nøklet på sha256) og deles
+mellom daterte backuper via hardlenker eller manifest-referanser.
+"""
+import os
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+class MediaStore:
+    """Innholdsadressert bildelager delt mellom daterte backuper"""
+
+    def __init__(self, root, link_mode='hardlink'):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.index_path = os.path.join(root, 'url_index.json')
+        self.link_mode = link_mode
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.index = self._load_index()
+
+    def _load_index(self):
+        """Les URL-indeksen (CDN-sti -> sha256, ETag og full URL)"""
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Kunne ikke lese media-indeks {self.index_path}: {e}")
+            return {}
+
+    @staticmethod
+    def url_key(url):
+        """CDN-sti uten query (Shopify versjonerer bilder med ?v=...)"""
+        parsed = urllib.parse.urlparse(url)
+        return f"{parsed.netloc}{parsed.path}"
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def lookup(self, url):
+        """Finn kjent blob for bildet, hvis blob-filen fortsatt finnes"""
+        with self._lock:
+            entry = self.index.get(self.url_key(url))
+        if entry and os.path.exists(self.blob_path(entry['sha256'])):
+            return entry
+        return None
+
+    def write_blob(self, chunks):
+        """Skriv innhold til lageret mens det hashes; returnerer (sha256, bytes)"""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.tmp_dir, f"{threading.get_ident()}_{time.monotonic_ns()}.part")
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+        sha256 = digest.hexdigest()
+        blob_path = self.blob_path(sha256)
+        if os.path.exists(blob_path):
+            # Samme innhold finnes allerede (f.eks. ny ?v= på uendret bilde)
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        return sha256, size
+
+    def remember(self, url, sha256, size, etag=None, last_modified=None):
+        with self._lock:
+            self.index[self.url_key(url)] = {
+                'url': url,
+                'sha256': sha256,
+                'size': size,
+                'etag': etag,
+                'last_modified': last_modified
+            }
+
+    def link(self, sha256, filepath):
+        """Legg bildet inn i den daterte backupen som hardlenke (ingen kopi)"""
+        if self.link_mode == 'manifest':
+            return
+        blob_path = self.blob_path(sha256)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if os.path.lexists(filepath):
+            os.remove(filepath)
+        try:
+            os.link(blob_path, filepath)
+        except OSError:
+            # Filsystemet støtter ikke hardlenker hit (f.eks. annen disk)
+            os.symlink(os.path.abspath(blob_path), filepath)
+
+    def save(self):
+        """Lagre URL-indeksen atomisk"""
+        with self._lock:
+            data = json.dumps(self.index, indent=2)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+class MediaDownloader:
+    """Parallell bildenedlaster med grense per vert og fremdriftstellere"""
+
+    def __init__(self, max_workers=8, per_host_limit=6, timeout=30, progress_interval=100, store=None, on_file=None):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.timeout = timeout
+        self.progress_interval = progress_interval
+        self.store = store
+        # Kalles med (filsti, bytes, størrelse på overskrevet fil) for hver fil i backupen
+        self.on_file = on_file
+
+        # Delt session med connection pool stor nok for alle arbeidere
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='media')
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self._futures = []
+        self.manifest = []
+        self.stats = {
+            'queued': 0,
+            'downloaded': 0,
+            'reused': 0,
+            'failed': 0,
+            'bytes': 0
+        }
+        self._started = time.monotonic()
+
+    def _host_slot(self, url):
+        """Semafor som begrenser samtidige nedlastinger mot samme vert"""
+        host = urllib.parse.urlparse(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+            done = self.stats['downloaded'] + self.stats['reused'] + self.stats['failed']
+        if key in ('downloaded', 'reused', 'failed') and done % self.progress_interval == 0:
+            self.print_progress()
+
+    def _download(self, url, filepath):
+        """Last ned ett bilde (kjøres i en arbeidstråd)"""
+        if self.store:
+            return self._download_to_store(url, filepath)
+        try:
+            with self._host_slot(url):
+                response = self.session.get(url, timeout=self.timeout, stream=True)
+                if response.status_code != 200:
+                    response.close()
+                    print(f"⚠️  Kunne ikke laste ned bilde {url}: HTTP {response.status_code}")
+                    self._count('failed')
+                    return None
+
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                tmp_path = f"{filepath}.part"
+                size = 0
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        size += len(chunk)
+                previous_size = self._existing_size(filepath)
+                os.replace(tmp_path, filepath)
+                self._file_written(filepath, size, previous_size)
+
+            self._count('bytes', size)
+            self._count('downloaded')
+            return filepath
+        except Exception as e:
+            print(f"⚠️  Kunne ikke laste ned bilde {url}: {e}")
+            self._count('failed')
+            return None
+
+    def _download_to_store(self, url, filepath):
+        """Hent bildet via det innholdsadresserte lageret"""
+        try:
+            entry = self.store.lookup(url)
+
+            # Samme CDN-URL som før: ingen nedlasting
+            if entry and entry['url'] == url:
+                return self._link_existing(url, filepath, entry)
+
+            headers = {}
+            if entry and entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry and entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+            with self._host_slot(url):
+                response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+                if response.status_code == 304 and entry:
+                    # Ny URL, men ETag uendret
+                    response.close()
+                    self.store.remember(url, entry['sha256'], entry['size'], entry.get('etag'), entry.get('last_modified'))
+                    return self._link_existing(url, filepath, entry)
+                if response.status_code != 200:
+                    response.close()
+                    print(f"⚠️  Kunne ikke laste ned bilde {url}: HTTP {response.status_code}")
+                    self._count('failed')
+                    return None
+
+                sha256, size = self.store.write_blob(response.iter_content(chunk_size=64 * 1024))
+
+            self.store.remember(
+                url, sha256, size,
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified')
+            )
+            self._link(sha256, filepath, size)
+            self._add_to_manifest(url, filepath, sha256, size)
+            self._count('bytes', size)
+            self._count('downloaded')
+            return filepath
+        except Exception as e:
+            print(f"⚠️  Kunne ikke laste ned bilde {url}: {e}")
+            self._count('failed')
+            return None
+
+    def _existing_size(self, filepath):
+        if self.on_file is None:
+            return None
+        try:
+            return os.path.getsize(filepath)
+        except OSError:
+            return None
+
+    def _file_written(self, filepath, size, previous_size):
+        if self.on_file is not None:
+            self.on_file(filepath, size, previous_size)
+
+    def _link(self, sha256, filepath, size):
+        """Lenk bildet inn fra lageret og tell filen (ingen fil i manifest-modus)"""
+        previous_size = self._existing_size(filepath)
+        self.store.link(sha256, filepath)
+        if self.store.link_mode != 'manifest':
+            self._file_written(filepath, size, previous_size)
+
+    def _link_existing(self, url, filepath, entry):
+        self._link(entry['sha256'], filepath, entry['size'])
+        self._add_to_manifest(url, filepath, entry['sha256'], entry['size'])
+        self._count('reused')
+        return filepath
+
+    def _add_to_manifest(self, url, filepath, sha256, size):
+        with self._lock:
+            self.manifest.append({
+                'path': filepath,
+                'url': url,
+                'sha256': sha256,
+                'size': size
+            })
+
+    def write_manifest(self, manifest_path):
+        """Skriv manifest over hvilke blobs den daterte backupen refererer til"""
+        with self._lock:
+            entries = sorted(self.manifest, key=lambda entry: entry['path'])
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'store': os.path.abspath(self.store.root) if self.store else None,
+                'link_mode': self.store.link_mode if self.store else None,
+                'images': entries
+            }, f, indent=2)
+
+    def submit(self, url, filepath):
+        """Legg et bilde i nedlastingskøen og returner en Future"""
+        with self._lock:
+            self.stats['queued'] += 1
+        future = self.executor.submit(self._download, url, filepath)
+        self._futures.append(future)
+        return future
+
+    def print_progress(self):
+        """Skriv ut fremdrift for media-nedlastingen"""
+        with self._lock:
+            stats = dict(self.stats)
+        done = stats['downloaded'] + stats['reused'] + stats['failed']
+        elapsed = time.monotonic() - self._started
+        print(f"   🖼️  Media: {done}/{stats['queued']} ferdig, {stats['reused']} gjenbrukt, {stats['failed']} feilet, "
+              f"{stats['bytes'] / (1024*1024):.1f} MB på {elapsed:.0f}s")
+
+    def wait(self):
+        """Vent til alle køede nedlastinger er ferdige og returner statistikk"""
+        for future in self._futures:
+            future.result()
+        self._futures = []
+        if self.store:
+            self.store.save()
+        self.print_progress()
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self):
+        """Avslutt trådpoolen og lukk sessionen"""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -5,17 +5,31 @@ Lager en mappestruktur som gjenspeiler kategorier og produkter i Shopify.
 Organiserer alt i logiske mapper før database-lagring.
 """
 import os
+import argparse
 import requests
-import psycopg2
-from psycopg2.extras import execute_batch, Json
+from psycopg2.extras import execute_batch, execute_values, Json
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import time
 import urllib.parse
 from pathlib import Path
 import re
 import shutil
+import csv
+import io
+import hashlib
+import threading
+
+from media_downloader import MediaDownloader, MediaStore
+from rate_limiter import ShopifyRateLimiter
+from bulk_export import BulkExporter, BulkExportError, iter_bulk_pages
+from sync_scheduler import SyncScheduler
+from checkpoints import SyncCheckpoint
+from archive_writer import ArchiveWriter
+from backup_index import BackupIndex, INDEX_FILENAME
+from backup_stats import BackupStats, verify_categories, existing_size
+from database import get_db_connection, release_db_connection, transaction, batch_size, PhaseTransaction, close_pool
 
 # Last inn miljøvariabler
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
@@ -23,22 +37,44 @@ SHOPIFY_API_KEY = os.getenv('SHOPIFY_API_KEY')
 SHOPIFY_API_VERSION = '2023-10'
 SHOPIFY_STORE_URL = os.getenv('SHOPIFY_STORE_URL')
 
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5432')
+# Tabeller som lastes med COPY via staging-tabell i stedet for execute_values
+# (kommaseparert, f.eks. "orders,products", eller "all")
+DB_COPY_TABLES = {t.strip() for t in os.getenv('DB_COPY_TABLES', '').split(',') if t.strip()}
+
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', '8'))
+MEDIA_DOWNLOAD_PER_HOST = int(os.getenv('MEDIA_DOWNLOAD_PER_HOST', '6'))
+MEDIA_LINK_MODE = os.getenv('MEDIA_LINK_MODE', 'hardlink')  # hardlink eller manifest
+
+# Lagringsformat: folders (én JSON-fil per objekt + pekermapper) eller
+# archive (komprimerte JSONL-shards per ressurs med kompakt indeks)
+BACKUP_FORMAT = os.getenv('BACKUP_FORMAT', 'folders')
+ARCHIVE_COMPRESSION = os.getenv('ARCHIVE_COMPRESSION', 'zstd')  # zstd eller gzip
+ARCHIVE_SHARD_RECORDS = int(os.getenv('ARCHIVE_SHARD_RECORDS', '10000'))
+
+# Watermarken settes aldri senere enn starten på synken minus dette vinduet
+# (sekunder), så endringer underveis og klokkeavvik mot Shopify hentes neste gang
+SYNC_WATERMARK_OVERLAP_SECONDS = int(os.getenv('SYNC_WATERMARK_OVERLAP_SECONDS', '60'))
+
+# Antall synk-jobber (collections, produkter, ordrer ...) som kjører samtidig
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '5'))
 
 SHOPIFY_BASE_URL = f"https://{SHOPIFY_STORE_URL}/admin/api/{SHOPIFY_API_VERSION}"
+SHOPIFY_GRAPHQL_URL = f"{SHOPIFY_BASE_URL}/graphql.json"
 SHOPIFY_HEADERS = {
     'Content-Type': 'application/json',
     'X-Shopify-Access-Token': SHOPIFY_API_KEY
 }
 
+# Alle Shopify-kall deler samme API-budsjett
+RATE_LIMITER = ShopifyRateLimiter()
+
 # Opprett organisert mappestruktur
 BACKUP_DATE = datetime.now().strftime('%Y-%m-%d')
 BACKUP_BASE_DIR = os.path.join(os.path.dirname(__file__), 'shopify_organized_backup', BACKUP_DATE)
 
+# Felles bildelager for alle daterte backuper (innholdsadressert)
+MEDIA_STORE_DIR = os.getenv('MEDIA_STORE_DIR', os.path.join(os.path.dirname(BACKUP_BASE_DIR), '_media_store'))
+
 # Hovedmapper
 STRUCTURE = {
     'collections': os.path.join(BACKUP_BASE_DIR, 'collections'),
@@ -52,9 +88,17 @@ STRUCTURE = {
     'metadata': os.path.join(BACKUP_BASE_DIR, '_metadata')
 }
 
-# Opprett alle mapper
-for path in STRUCTURE.values():
-    os.makedirs(path, exist_ok=True)
+# Arkivformatet (--format archive) skriver hit
+ARCHIVE_DIR = os.path.join(BACKUP_BASE_DIR, 'archive')
+
+def ensure_backup_dirs():
+    """
+    Opprett hovedmappene for dagens backup. Gjøres av main() og ikke ved
+    import, så rapportskript som kun bruker synk-funksjonene ikke lager
+    tomme daterte backup-mapper.
+    """
+    for path in STRUCTURE.values():
+        os.makedirs(path, exist_ok=True)
 
 def safe_filename(name):
     """Lager sikre filnavn fra Shopify-titler"""
@@ -66,14 +110,16 @@ def safe_filename(name):
     return safe_name[:100]  # Begrens lengde
 
 def safe_request(url, params=None, max_retries=3):
-    """Sikker API-forespørsel med retry og rate limiting"""
+    """Sikker API-forespørsel med retry og rate limiting (via RATE_LIMITER)"""
     for attempt in range(max_retries):
         try:
+            RATE_LIMITER.acquire()
             response = requests.get(url, headers=SHOPIFY_HEADERS, params=params)
+            RATE_LIMITER.update_from_response(response)
             
             if response.status_code == 429:
-                print("⏱️  Rate limit, venter 2 sekunder...")
-                time.sleep(2)
+                delay = RATE_LIMITER.backoff(response)
+                print(f"⏱️  Rate limit, venter {delay:.1f} sekunder (Retry-After)...")
                 continue
             elif response.status_code == 200:
                 return response
@@ -87,267 +133,951 @@ def safe_request(url, params=None, max_retries=3):
     
     return None
 
-def download_image(url, filepath):
-    """Last ned bilde til spesifisert sti"""
-    try:
-        response = requests.get(url, timeout=30)
-        if response.status_code == 200:
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, 'wb') as f:
-                f.write(response.content)
-            return filepath
-    except Exception as e:
-        print(f"⚠️  Kunne ikke laste ned bilde {url}: {e}")
+def get_next_page_info(response):
+    """Finn page_info-cursor for neste side fra Link-headeren"""
+    link_header = response.headers.get('Link')
+    if not link_header or 'rel="next"' not in link_header:
+        return None
+    
+    for link in link_header.split(','):
+        if 'rel="next"' in link:
+            url_part = link.split(';')[0].strip('<> ')
+            parsed = urllib.parse.urlparse(url_part)
+            query = urllib.parse.parse_qs(parsed.query)
+            if "page_info" in query:
+                return query["page_info"][0]
+            break
     return None
 
-def get_db_connection():
-    """Opprett database-tilkobling"""
-    try:
-        conn = psycopg2.connect(
-            host=POSTGRES_HOST,
-            port=POSTGRES_PORT,
-            database=POSTGRES_DB,
-            user=POSTGRES_USER,
-            password=POSTGRES_PASSWORD
+class ShopifyFetchError(Exception):
+    """Paginert henting stoppet før siste side var hentet"""
+
+def iter_shopify_pages(endpoint, resource_key, params=None, checkpoint=None):
+    """
+    Hent en ressurs side for side ved å følge Link-cursoren.
+    Gir (sidenummer, elementer) for hver side, slik at kalleren kan skrive
+    siden til disk/database før neste side hentes.
+    Kaster ShopifyFetchError hvis en side ikke kan hentes, slik at en
+    avbrutt henting ikke blir registrert som fullført.
+    Med checkpoint (SyncCheckpoint) startes det fra lagret cursor, og
+    posisjonen etter hver side noteres før siden gis til kalleren.
+    """
+    params = dict(params or {})
+    limit = params.get('limit', 250)
+    url = f"{SHOPIFY_BASE_URL}/{endpoint}"
+    page_count = 0
+    next_page_info = None
+    
+    resuming = bool(checkpoint and checkpoint.resuming)
+    if resuming:
+        page_count = checkpoint.page_count
+        next_page_info = checkpoint.cursor
+        print(f"↪️  Fortsetter {endpoint} fra side {page_count + 1} (sjekkpunkt)")
+    
+    while True:
+        page_count += 1
+        
+        # Shopify tillater kun limit og fields sammen med page_info
+        if next_page_info:
+            query = {'limit': limit, 'page_info': next_page_info}
+            if 'fields' in params:
+                query['fields'] = params['fields']
+        else:
+            query = params
+        
+        response = safe_request(url, params=query)
+        if not response and resuming:
+            # Lagret cursor er ugyldig eller utløpt: start fra første side
+            print(f"⚠️  Kunne ikke fortsette {endpoint} fra sjekkpunkt, starter på nytt")
+            checkpoint.reset()
+            page_count = 1
+            response = safe_request(url, params=params)
+        resuming = False
+        if not response:
+            raise ShopifyFetchError(f"Kunne ikke hente side {page_count} av {endpoint}")
+        
+        items = response.json().get(resource_key, [])
+        next_page_info = get_next_page_info(response) if items else None
+        if checkpoint:
+            checkpoint.advance(page_count, next_page_info)
+        if not items:
+            break
+        
+        yield page_count, items
+        
+        if not next_page_info:
+            break
+
+_backup_stats = None
+_backup_stats_lock = threading.Lock()
+
+def get_backup_stats():
+    """Fil- og bytetellere for backup-rapporten (_metadata/backup_stats.json)"""
+    global _backup_stats
+    with _backup_stats_lock:
+        if _backup_stats is None:
+            categories = dict(STRUCTURE)
+            categories['archive'] = ARCHIVE_DIR
+            _backup_stats = BackupStats(categories, os.path.join(STRUCTURE['metadata'], 'backup_stats.json'))
+        return _backup_stats
+
+def make_dirs(path):
+    """Opprett mappe og tell den i backup-statistikken"""
+    get_backup_stats().make_dirs(path)
+
+def write_json(path, data, **dump_options):
+    """Skriv JSON-fil og tell den i backup-statistikken"""
+    get_backup_stats().write_json(path, data, **dump_options)
+
+def get_checkpoint(resource, params):
+    """Sjekkpunkt for paginert henting av en ressurs i dagens backup"""
+    checkpoint_dir = os.path.join(STRUCTURE['metadata'], 'checkpoints')
+    make_dirs(checkpoint_dir)
+    return SyncCheckpoint(os.path.join(checkpoint_dir, f"{resource}.json"), resource, params)
+
+_media_downloader = None
+_media_downloader_lock = threading.Lock()
+
+def get_media_downloader():
+    """Delt media-nedlaster for hele backupen (opprettes ved første bruk)"""
+    global _media_downloader
+    # Flere synk-jobber kan be om nedlasteren samtidig
+    with _media_downloader_lock:
+        if _media_downloader is None:
+            _media_downloader = MediaDownloader(
+                max_workers=MEDIA_DOWNLOAD_WORKERS,
+                per_host_limit=MEDIA_DOWNLOAD_PER_HOST,
+                store=MediaStore(MEDIA_STORE_DIR, link_mode=MEDIA_LINK_MODE),
+                on_file=get_backup_stats().record_file
+            )
+        return _media_downloader
+
+_archive_writer = None
+
+def configure_archive(backup_format):
+    """Slå på arkivformatet for denne kjøringen (archive/ i backup-mappen)"""
+    global _archive_writer
+    if backup_format == 'archive':
+        _archive_writer = ArchiveWriter(
+            ARCHIVE_DIR,
+            compression=ARCHIVE_COMPRESSION,
+            shard_records=ARCHIVE_SHARD_RECORDS
         )
-        return conn
-    except Exception as e:
-        print(f"❌ Database-tilkoblingsfeil: {e}")
+        print(f"🗜️  Modus: arkiv ({_archive_writer.compression}-komprimerte JSONL-shards)")
+    return _archive_writer
+
+def get_archive_writer():
+    """Arkivskriveren, eller None når backupen skrives som mapper"""
+    return _archive_writer
+
+_backup_index = None
+_backup_index_previous_size = None
+_backup_index_lock = threading.Lock()
+
+def get_backup_index():
+    """Søkbar indeks for denne backupen (_metadata/backup_index.sqlite)"""
+    global _backup_index, _backup_index_previous_size
+    with _backup_index_lock:
+        if _backup_index is None:
+            _backup_index_previous_size = existing_size(os.path.join(STRUCTURE['metadata'], INDEX_FILENAME))
+            _backup_index = BackupIndex(BACKUP_BASE_DIR)
+        return _backup_index
+
+def index_backup_object(resource, record, path, offset=None, length=None, **dimensions):
+    """Legg objektet i backup-indeksen; path er JSON-filen eller arkiv-sharden"""
+    get_backup_index().add(
+        resource,
+        record['id'],
+        os.path.relpath(path, BACKUP_BASE_DIR),
+        offset,
+        length,
+        created_at=record.get('created_at'),
+        title=record.get('title') or record.get('name') or record.get('email'),
+        **dimensions
+    )
+
+def archive_backup_object(resource, record, **dimensions):
+    """Skriv objektet som én arkivlinje og indekser linjen"""
+    archive = get_archive_writer()
+    entry = archive.write(resource, record, **dimensions)
+    index_backup_object(
+        resource,
+        record,
+        os.path.join(archive.root, resource, entry['shard']),
+        entry['offset'],
+        entry['length'],
+        **dimensions
+    )
+
+def start_resource_output(resource, incremental, since=None):
+    """
+    Full henting fra første side erstatter ressursens shards og indeks;
+    inkrementell henting legger til (siste linje per id gjelder).
+    since er watermarken hentingen starter fra (None: alle objekter), og
+    noteres i indeksen så oppslag vet om backupen er ufullstendig.
+    """
+    index = get_backup_index()
+    if not incremental:
+        if _archive_writer is not None:
+            _archive_writer.reset(resource)
+        index.reset(resource)
+    index.set_coverage(resource, since)
+
+def checkpoint_resource_output(resource):
+    """Avslutt åpen shard, commit indeksen og lagre tellerne før sjekkpunktet lagres"""
+    if _archive_writer is not None:
+        _archive_writer.checkpoint(resource)
+    get_backup_index().commit()
+    get_backup_stats().save()
+
+def finish_archive():
+    """Avslutt arkivet og skriv indekser og manifest"""
+    global _archive_writer
+    if _archive_writer is None:
         return None
+    manifest = _archive_writer.close()
+    for resource, info in manifest['resources'].items():
+        print(f"🗜️  {resource:12}: {info['records']} poster i {len(info['shards'])} shards, {info['bytes'] / (1024*1024):.1f} MB")
+    # Arkivet har få filer, så tellerne settes fra manifestet i stedet for per skriving
+    get_backup_stats().set_category(
+        'archive',
+        1 + sum(info['files'] for info in manifest['resources'].values()),
+        len(manifest['resources']),
+        os.path.getsize(os.path.join(ARCHIVE_DIR, 'manifest.json')) + sum(info['bytes'] for info in manifest['resources'].values())
+    )
+    _archive_writer = None
+    return manifest
+
+def finish_backup_index():
+    """Commit og lukk backup-indeksen"""
+    global _backup_index
+    with _backup_index_lock:
+        if _backup_index is None:
+            return None
+        counts = _backup_index.counts()
+        _backup_index.close()
+        get_backup_stats().record_file(
+            _backup_index.path, os.path.getsize(_backup_index.path), _backup_index_previous_size
+        )
+        _backup_index = None
+    print(f"📇 Backup-indeks: {', '.join(f'{resource} {count}' for resource, count in sorted(counts.items()))}")
+    return counts
+
+def image_extension(url):
+    return url.split('.')[-1].split('?')[0] or 'jpg'
+
+def get_bulk_exporter():
+    """GraphQL bulk-eksport som deler API-budsjett med REST-kallene"""
+    return BulkExporter(SHOPIFY_GRAPHQL_URL, SHOPIFY_HEADERS, rate_limiter=RATE_LIMITER)
+
+def download_image(url, filepath):
+    """Legg bilde i nedlastingskøen; lastes ned parallelt i media-steget"""
+    if MEDIA_LINK_MODE != 'manifest':
+        make_dirs(os.path.dirname(filepath))
+    return get_media_downloader().submit(url, filepath)
 
-def store_collections_to_db(collections_data):
+def finish_media_downloads():
+    """Media-steg: vent på alle køede bildenedlastinger og lukk nedlasteren"""
+    global _media_downloader
+    if _media_downloader is None:
+        return {}
+    
+    print("\n🖼️  === FULLFØRER MEDIA-NEDLASTING ===")
+    stats = _media_downloader.wait()
+    manifest_path = os.path.join(STRUCTURE['metadata'], 'media_manifest.json')
+    previous_size = existing_size(manifest_path)
+    _media_downloader.write_manifest(manifest_path)
+    get_backup_stats().record_file(manifest_path, os.path.getsize(manifest_path), previous_size)
+    _media_downloader.close()
+    _media_downloader = None
+    print(f"✅ Lastet ned {stats['downloaded']} bilder, gjenbrukte {stats['reused']} ({stats['failed']} feilet)")
+    return stats
+
+def content_hash(data):
+    """Stabil sha256 av et Shopify-objekt, brukes for å hoppe over uendrede rader"""
+    payload = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def upsert_conflict_clause(table, update_columns, columns):
+    """
+    ON CONFLICT-del som kun skriver raden når innholdet faktisk er endret.
+    Uendrede rader gir ingen ny tuppel, WAL eller TOAST-skriving.
+    """
+    updates = ',\n                '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    clause = f"""ON CONFLICT (id) DO UPDATE SET 
+                {updates}"""
+    if 'content_hash' in columns:
+        clause += f"""
+            WHERE {table}.content_hash IS DISTINCT FROM EXCLUDED.content_hash"""
+    return clause + """
+            RETURNING id, (xmax = 0) AS inserted"""
+
+def upsert_summary(records, returned_rows):
+    """Tell nye, oppdaterte og uendrede rader ut fra RETURNING-resultatet"""
+    inserted = sum(1 for _, is_new in returned_rows if is_new)
+    updated = len(returned_rows) - inserted
+    unique_ids = {record[0] for record in records}
+    return {
+        'inserted': inserted,
+        'updated': updated,
+        'unchanged': len(unique_ids) - inserted - updated,
+        'changed_ids': [row_id for row_id, _ in returned_rows]
+    }
+
+def format_upsert_summary(summary):
+    return f"{summary['inserted']} nye, {summary['updated']} oppdatert, {summary['unchanged']} uendret"
+
+def use_copy_loader(table):
+    """Skal tabellen lastes med COPY? Styres per tabell med DB_COPY_TABLES"""
+    return 'all' in DB_COPY_TABLES or table in DB_COPY_TABLES
+
+def copy_value(value):
+    """Gjør en verdi om til tekst for COPY (CSV, NULL skrives som \\N)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, Json):
+        return json.dumps(value.adapted, default=str)
+    return value
+
+def copy_upsert(cursor, table, columns, records, update_columns):
+    """
+    Strøm postene inn i en midlertidig staging-tabell med COPY FROM STDIN
+    og flett dem inn i måltabellen med én INSERT ... ON CONFLICT.
+    Staging-tabellen er midlertidig (ikke WAL-logget) og slettes ved commit.
+    """
+    staging = f"staging_{table}"
+    column_list = ', '.join(columns)
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+    cursor.execute(f"TRUNCATE {staging}")
+    
+    # Send postene i biter på PERFORMANCE.batch_size, så minnebruken holder seg lav
+    chunk_rows = batch_size()
+    for start in range(0, len(records), chunk_rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in records[start:start + chunk_rows]:
+            writer.writerow([copy_value(value) for value in record])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    
+    cursor.execute(f"""
+        INSERT INTO {table} ({column_list})
+        SELECT DISTINCT ON (id) {column_list} FROM {staging}
+        ORDER BY id
+        {upsert_conflict_clause(table, update_columns, columns)}
+    """)
+    return upsert_summary(records, cursor.fetchall())
+
+def upsert_records(cursor, table, columns, records, update_columns):
+    """
+    Upsert poster med COPY/staging eller execute_values, avhengig av tabellen.
+    Returnerer antall nye, oppdaterte og uendrede rader, og id-ene som ble skrevet.
+    """
+    # Samme id to ganger i én INSERT ... ON CONFLICT gir feil; behold siste versjon
+    records = list({record[0]: record for record in records}.values())
+
+    if use_copy_loader(table):
+        return copy_upsert(cursor, table, columns, records, update_columns)
+    
+    returned_rows = execute_values(cursor, f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        VALUES %s
+        {upsert_conflict_clause(table, update_columns, columns)}
+    """, records, page_size=batch_size(), fetch=True)
+    return upsert_summary(records, returned_rows)
+
+def store_collections_to_db(collections_data, conn=None):
     """Lagre collections til database"""
     if not collections_data:
         return
     
-    conn = get_db_connection()
-    if not conn:
-        return
-        
     try:
-        cursor = conn.cursor()
+        with transaction(conn) as cursor:
+            # Forbered data for batch insert
+            collection_records = []
+            for collection in collections_data:
+                collection_records.append((
+                    collection['id'],
+                    collection.get('handle', ''),
+                    collection.get('title', ''),
+                    collection.get('updated_at'),
+                    collection.get('body_html', ''),
+                    collection.get('published_at'),
+                    collection.get('sort_order', ''),
+                    collection.get('template_suffix', ''),
+                    collection.get('published_scope', ''),
+                    collection.get('admin_graphql_api_id', ''),
+                    Json(collection),  # Hele objektet som JSON
+                    content_hash(collection)
+                ))
         
-        # Forbered data for batch insert
-        collection_records = []
-        for collection in collections_data:
-            collection_records.append((
-                collection['id'],
-                collection.get('handle', ''),
-                collection.get('title', ''),
-                collection.get('updated_at'),
-                collection.get('body_html', ''),
-                collection.get('published_at'),
-                collection.get('sort_order', ''),
-                collection.get('template_suffix', ''),
-                collection.get('published_scope', ''),
-                collection.get('admin_graphql_api_id', ''),
-                Json(collection)  # Hele objektet som JSON
-            ))
-        
-        # Batch insert
-        execute_batch(cursor, """
-            INSERT INTO collections (id, handle, title, updated_at, body_html, published_at, sort_order, template_suffix, published_scope, admin_graphql_api_id, raw_data)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET 
-                handle = EXCLUDED.handle,
-                title = EXCLUDED.title,
-                updated_at = EXCLUDED.updated_at,
-                body_html = EXCLUDED.body_html,
-                published_at = EXCLUDED.published_at,
-                sort_order = EXCLUDED.sort_order,
-                template_suffix = EXCLUDED.template_suffix,
-                published_scope = EXCLUDED.published_scope,
-                admin_graphql_api_id = EXCLUDED.admin_graphql_api_id,
-                raw_data = EXCLUDED.raw_data
-        """, collection_records)
+            # Batch insert, uendrede collections hoppes over
+            summary = upsert_records(
+                cursor,
+                'collections',
+                ['id', 'handle', 'title', 'updated_at', 'body_html', 'published_at', 'sort_order',
+                 'template_suffix', 'published_scope', 'admin_graphql_api_id', 'raw_data', 'content_hash'],
+                collection_records,
+                ['handle', 'title', 'updated_at', 'body_html', 'published_at', 'sort_order',
+                 'template_suffix', 'published_scope', 'admin_graphql_api_id', 'raw_data', 'content_hash']
+            )
         
-        conn.commit()
-        print(f"✅ Lagret {len(collection_records)} collections til database")
+        print(f"✅ Lagret {len(collection_records)} collections til database ({format_upsert_summary(summary)})")
+        return summary
         
     except Exception as e:
         print(f"❌ Feil ved lagring av collections: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
 
-def store_products_to_db(products_data):
+def store_products_to_db(products_data, conn=None):
     """Lagre produkter til database"""
     if not products_data:
         return
     
-    conn = get_db_connection()
-    if not conn:
-        return
-        
     try:
-        cursor = conn.cursor()
+        with transaction(conn) as cursor:
+            # Forbered data for batch insert
+            product_records = []
+            for product in products_data:
+                product_records.append((
+                    product['id'],
+                    product.get('title', ''),
+                    product.get('handle', ''),
+                    product.get('product_type', ''),
+                    product.get('vendor', ''),
+                    product.get('status', 'active'),
+                    product.get('created_at'),
+                    product.get('updated_at'),
+                    product.get('published_at'),
+                    product.get('published_scope', ''),
+                    product.get('tags', ''),
+                    Json(product.get('options', [])),
+                    Json(product.get('images', [])),
+                    product.get('image', {}).get('id') if product.get('image') else None,
+                    Json(product.get('variants', [])),
+                    Json(product),  # Hele objektet som JSON
+                    content_hash(product)
+                ))
         
-        # Forbered data for batch insert
-        product_records = []
-        for product in products_data:
-            product_records.append((
-                product['id'],
-                product.get('title', ''),
-                product.get('handle', ''),
-                product.get('product_type', ''),
-                product.get('vendor', ''),
-                product.get('status', 'active'),
-                product.get('created_at'),
-                product.get('updated_at'),
-                product.get('published_at'),
-                product.get('published_scope', ''),
-                product.get('tags', ''),
-                Json(product.get('options', [])),
-                Json(product.get('images', [])),
-                product.get('image', {}).get('id') if product.get('image') else None,
-                Json(product.get('variants', [])),
-                Json(product)  # Hele objektet som JSON
-            ))
-        
-        # Batch insert
-        execute_batch(cursor, """
-            INSERT INTO products (id, title, handle, product_type, vendor, status, created_at, updated_at, published_at, published_scope, tags, options, images, image_id, variants, raw_data)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET 
-                title = EXCLUDED.title,
-                handle = EXCLUDED.handle,
-                product_type = EXCLUDED.product_type,
-                vendor = EXCLUDED.vendor,
-                status = EXCLUDED.status,
-                updated_at = EXCLUDED.updated_at,
-                published_at = EXCLUDED.published_at,
-                published_scope = EXCLUDED.published_scope,
-                tags = EXCLUDED.tags,
-                options = EXCLUDED.options,
-                images = EXCLUDED.images,
-                image_id = EXCLUDED.image_id,
-                variants = EXCLUDED.variants,
-                raw_data = EXCLUDED.raw_data
-        """, product_records)
+            # Batch insert, uendrede produkter hoppes over
+            summary = upsert_records(
+                cursor,
+                'products',
+                ['id', 'title', 'handle', 'product_type', 'vendor', 'status', 'created_at', 'updated_at',
+                 'published_at', 'published_scope', 'tags', 'options', 'images', 'image_id', 'variants', 'raw_data',
+                 'content_hash'],
+                product_records,
+                ['title', 'handle', 'product_type', 'vendor', 'status', 'updated_at', 'published_at',
+                 'published_scope', 'tags', 'options', 'images', 'image_id', 'variants', 'raw_data', 'content_hash']
+            )
         
-        conn.commit()
-        print(f"✅ Lagret {len(product_records)} produkter til database")
+        print(f"✅ Lagret {len(product_records)} produkter til database ({format_upsert_summary(summary)})")
+        return summary
         
     except Exception as e:
         print(f"❌ Feil ved lagring av produkter: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-        conn.close()
 
-def store_orders_to_db(orders_data):
+# undefined_function og undefined_table: databasen har ikke fått ledgeren ennå
+LEDGER_MISSING_PGCODES = {'42883', '42P01'}
+
+def refresh_royalty_ledger(cursor, order_ids):
+    """
+    Bygg analytics.royalty_ledger på nytt for de gitte ordrene.
+    Kjøres i en savepoint, så ordrene lagres selv om ledgeren mangler i
+    databasen. Alle andre feil (f.eks. deadlock) kastes videre, så siden
+    feiler og ordrene ikke blir stående med ny content_hash og gammel ledger.
+    """
+    cursor.execute("SAVEPOINT royalty_ledger")
+    try:
+        cursor.execute("SELECT analytics.refresh_royalty_ledger(%s::bigint[])", (order_ids,))
+        rows_written = cursor.fetchone()[0]
+        cursor.execute("RELEASE SAVEPOINT royalty_ledger")
+        return rows_written
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT royalty_ledger")
+        if getattr(e, 'pgcode', None) not in LEDGER_MISSING_PGCODES:
+            raise
+        print(f"⚠️  Royalty-ledgeren finnes ikke i databasen, hopper over: {e}")
+        return 0
+
+LINE_ITEM_COLUMNS = [
+    'id', 'order_id', 'position', 'product_id', 'variant_id', 'title', 'quantity', 'sku', 'variant_title',
+    'vendor', 'fulfillment_service', 'fulfillment_status', 'requires_shipping', 'taxable', 'gift_card',
+    'name', 'properties', 'product_exists', 'fulfillable_quantity', 'grams', 'price', 'total_discount',
+    'tax_lines', 'discount_allocations', 'admin_graphql_api_id', 'refunded_quantity', 'refunded_amount',
+    'raw_data'
+]
+
+def refunded_by_line_item(order):
+    """Summer refunderte antall og beløp per ordrelinje fra order['refunds']"""
+    refunded = {}
+    for refund in order.get('refunds') or []:
+        for refund_line in refund.get('refund_line_items') or []:
+            quantity, amount = refunded.get(refund_line.get('line_item_id'), (0, 0.0))
+            refunded[refund_line.get('line_item_id')] = (
+                quantity + int(refund_line.get('quantity') or 0),
+                amount + float(refund_line.get('subtotal') or 0)
+            )
+    return refunded
+
+def line_item_records(order):
+    """Gjør ordrens line_items (med refusjoner) om til rader for order_line_items"""
+    refunded = refunded_by_line_item(order)
+    records = []
+    for position, item in enumerate(order.get('line_items') or [], start=1):
+        if not item.get('id'):
+            continue
+        refunded_quantity, refunded_amount = refunded.get(item['id'], (0, 0.0))
+        records.append((
+            item['id'],
+            order['id'],
+            position,
+            item.get('product_id'),
+            item.get('variant_id'),
+            item.get('title'),
+            item.get('quantity') or 0,
+            item.get('sku'),
+            item.get('variant_title'),
+            item.get('vendor'),
+            item.get('fulfillment_service'),
+            item.get('fulfillment_status'),
+            item.get('requires_shipping'),
+            item.get('taxable'),
+            item.get('gift_card'),
+            item.get('name'),
+            Json(item.get('properties', [])),
+            item.get('product_exists'),
+            item.get('fulfillable_quantity'),
+            item.get('grams'),
+            float(item['price']) if item.get('price') else 0,
+            float(item['total_discount']) if item.get('total_discount') else 0,
+            Json(item.get('tax_lines', [])),
+            Json(item.get('discount_allocations', [])),
+            item.get('admin_graphql_api_id'),
+            refunded_quantity,
+            round(refunded_amount, 2),
+            Json(item)
+        ))
+    return records
+
+def orders_missing_line_items(cursor, order_ids):
+    """Ordrer uten normaliserte linjer ennå (f.eks. lagret før order_line_items ble fylt)"""
+    cursor.execute("""
+        SELECT o.id FROM unnest(%s::bigint[]) AS o(id)
+        WHERE NOT EXISTS (SELECT 1 FROM order_line_items li WHERE li.order_id = o.id)
+    """, (order_ids,))
+    return [row[0] for row in cursor.fetchall()]
+
+def store_order_line_items(cursor, orders):
+    """
+    Skriv ordrelinjene til order_line_items i samme transaksjon som ordrene.
+    Linjer som er fjernet fra en ordre slettes.
+    """
+    records = [record for order in orders for record in line_item_records(order)]
+    cursor.execute("""
+        DELETE FROM order_line_items
+        WHERE order_id = ANY(%s::bigint[]) AND NOT (id = ANY(%s::bigint[]))
+    """, ([order['id'] for order in orders], [record[0] for record in records]))
+    if not records:
+        return 0
+    upsert_records(cursor, 'order_line_items', LINE_ITEM_COLUMNS, records, LINE_ITEM_COLUMNS[1:])
+    return len(records)
+
+def store_orders_to_db(orders_data, conn=None):
     """Lagre ordrer til database"""
     if not orders_data:
         return
     
-    conn = get_db_connection()
-    if not conn:
-        return
-        
     try:
-        cursor = conn.cursor()
+        with transaction(conn) as cursor:
+            # Forbered data for batch insert
+            order_records = []
+            for order in orders_data:
+                order_records.append((
+                    order['id'],
+                    order.get('order_number'),
+                    order.get('created_at'),
+                    order.get('updated_at'),
+                    order.get('processed_at'),
+                    order.get('closed_at'),
+                    order.get('financial_status'),
+                    order.get('fulfillment_status'),
+                    float(order.get('total_price', 0)) if order.get('total_price') else 0,
+                    float(order.get('subtotal_price', 0)) if order.get('subtotal_price') else 0,
+                    float(order.get('total_tax', 0)) if order.get('total_tax') else 0,
+                    order.get('currency', 'NOK'),
+                    order.get('email', ''),
+                    order.get('phone'),
+                    order.get('note'),
+                    Json(order),  # Hele objektet som JSON
+                    content_hash(order)
+                ))
         
-        # Forbered data for batch insert
-        order_records = []
-        for order in orders_data:
-            order_records.append((
-                order['id'],
-                order.get('order_number'),
-                order.get('created_at'),
-                order.get('updated_at'),
-                order.get('processed_at'),
-                order.get('closed_at'),
-                order.get('financial_status'),
-                order.get('fulfillment_status'),
-                float(order.get('total_price', 0)) if order.get('total_price') else 0,
-                float(order.get('subtotal_price', 0)) if order.get('subtotal_price') else 0,
-                float(order.get('total_tax', 0)) if order.get('total_tax') else 0,
-                order.get('currency', 'NOK'),
-                order.get('email', ''),
-                order.get('phone'),
-                order.get('note'),
-                Json(order)  # Hele objektet som JSON
-            ))
-        
-        # Batch insert
-        execute_batch(cursor, """
-            INSERT INTO orders (id, order_number, created_at, updated_at, processed_at, closed_at, 
-                               financial_status, fulfillment_status, total_price, subtotal_price, 
-                               total_tax, currency, customer_email, phone, note, raw_data)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET 
-                updated_at = EXCLUDED.updated_at,
-                processed_at = EXCLUDED.processed_at,
-                closed_at = EXCLUDED.closed_at,
-                financial_status = EXCLUDED.financial_status,
-                fulfillment_status = EXCLUDED.fulfillment_status,
-                total_price = EXCLUDED.total_price,
-                subtotal_price = EXCLUDED.subtotal_price,
-                total_tax = EXCLUDED.total_tax,
-                currency = EXCLUDED.currency,
-                customer_email = EXCLUDED.customer_email,
-                phone = EXCLUDED.phone,
-                note = EXCLUDED.note,
-                raw_data = EXCLUDED.raw_data
-        """, order_records)
+            # Batch insert, uendrede ordrer hoppes over
+            summary = upsert_records(
+                cursor,
+                'orders',
+                ['id', 'order_number', 'created_at', 'updated_at', 'processed_at', 'closed_at',
+                 'financial_status', 'fulfillment_status', 'total_price', 'subtotal_price',
+                 'total_tax', 'currency', 'customer_email', 'phone', 'note', 'raw_data', 'content_hash'],
+                order_records,
+                ['updated_at', 'processed_at', 'closed_at', 'financial_status', 'fulfillment_status',
+                 'total_price', 'subtotal_price', 'total_tax', 'currency', 'customer_email',
+                 'phone', 'note', 'raw_data', 'content_hash']
+            )
         
-        conn.commit()
-        print(f"✅ Lagret {len(order_records)} ordrer til database")
+            # Normaliser ordrelinjer for nye og endrede ordrer (og ordrer som mangler linjer)
+            changed_ids = set(summary['changed_ids'])
+            changed_ids.update(orders_missing_line_items(cursor, [record[0] for record in order_records]))
+            line_item_count = store_order_line_items(
+                cursor, [order for order in orders_data if order['id'] in changed_ids]
+            )
+            
+            # Oppdater royalty-ledgeren for de samme ordrene i samme transaksjon
+            if changed_ids:
+                refresh_royalty_ledger(cursor, sorted(changed_ids))
+        
+        print(f"✅ Lagret {len(order_records)} ordrer til database ({format_upsert_summary(summary)}, {line_item_count} ordrelinjer)")
+        return summary
         
     except Exception as e:
         print(f"❌ Feil ved lagring av ordrer: {e}")
+
+def refresh_royalty_buyer_names():
+    """
+    Oppdater kjøpernavn og e-post i royalty-ledgeren fra customers.
+    Kjøres som egen jobb etter at ordrer og kunder er synket, i én kort
+    transaksjon, så kunde- og ordrefasen ikke skriver de samme ledger-radene
+    i hver sin lange transaksjon samtidig.
+    """
+    with transaction() as cursor:
+        cursor.execute("SELECT analytics.refresh_royalty_buyer_names()")
+        rows_updated = cursor.fetchone()[0]
+    print(f"✅ Oppdaterte kjøpernavn på {rows_updated} royalty-linjer")
+    return rows_updated
+
+def store_customers_to_db(customers_data, conn=None):
+    """Lagre kunder til database"""
+    if not customers_data:
+        return
+    
+    try:
+        with transaction(conn) as cursor:
+            # Forbered data for batch insert
+            customer_records = []
+            for customer in customers_data:
+                customer_records.append((
+                    customer['id'],
+                    customer.get('email'),
+                    customer.get('first_name'),
+                    customer.get('last_name'),
+                    customer.get('phone'),
+                    customer.get('created_at'),
+                    customer.get('updated_at'),
+                    customer.get('orders_count') or 0,
+                    customer.get('state'),
+                    float(customer['total_spent']) if customer.get('total_spent') else 0,
+                    customer.get('last_order_id'),
+                    customer.get('note'),
+                    customer.get('verified_email'),
+                    customer.get('tax_exempt'),
+                    customer.get('tags', ''),
+                    customer.get('last_order_name'),
+                    customer.get('currency'),
+                    customer.get('admin_graphql_api_id'),
+                    Json(customer.get('default_address')),
+                    Json(customer.get('addresses', [])),
+                    Json(customer),  # Hele objektet som JSON
+                    content_hash(customer)
+                ))
+            
+            # Batch insert, uendrede kunder hoppes over
+            summary = upsert_records(
+                cursor,
+                'customers',
+                ['id', 'email', 'first_name', 'last_name', 'phone', 'created_at', 'updated_at',
+                 'orders_count', 'state', 'total_spent', 'last_order_id', 'note', 'verified_email',
+                 'tax_exempt', 'tags', 'last_order_name', 'currency', 'admin_graphql_api_id',
+                 'default_address', 'addresses', 'raw_data', 'content_hash'],
+                customer_records,
+                ['email', 'first_name', 'last_name', 'phone', 'updated_at', 'orders_count', 'state',
+                 'total_spent', 'last_order_id', 'note', 'verified_email', 'tax_exempt', 'tags',
+                 'last_order_name', 'currency', 'admin_graphql_api_id', 'default_address', 'addresses',
+                 'raw_data', 'content_hash']
+            )
+        
+        print(f"✅ Lagret {len(customer_records)} kunder til database ({format_upsert_summary(summary)})")
+        return summary
+        
+    except Exception as e:
+        print(f"❌ Feil ved lagring av kunder: {e}")
+
+def parse_shopify_timestamp(value):
+    """Gjør om Shopify ISO-tidsstempel til datetime med tidssone"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def newest_updated_at(items, current=None):
+    """Finn nyeste updated_at blant elementene (high-water mark)"""
+    newest = current
+    for item in items:
+        if not item.get('updated_at'):
+            continue
+        updated_at = parse_shopify_timestamp(item['updated_at'])
+        if newest is None or updated_at > newest:
+            newest = updated_at
+    return newest
+
+def get_sync_watermark(resource):
+    """Hent high-water mark fra siste fullførte synk av en ressurs"""
+    try:
+        conn = get_db_connection()
+    except Exception as e:
+        # Uten high-water mark blir det en full synk, som alltid er trygt
+        print(f"⚠️  Kunne ikke lese synk-status for {resource}: {e}")
+        return None
+    if not conn:
+        return None
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT metadata->>'updated_at_max'
+            FROM analytics.sync_status
+            WHERE sync_type = %s AND status = 'completed' AND metadata ? 'updated_at_max'
+            ORDER BY completed_at DESC
+            LIMIT 1
+        """, (resource,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"⚠️  Kunne ikke lese synk-status for {resource}: {e}")
+        return None
+    finally:
+        release_db_connection(conn)
+
+def capped_watermark(watermark, started_at):
+    """
+    Begrens high-water mark til synkens start minus SYNC_WATERMARK_OVERLAP_SECONDS.
+    Sidene kommer i id-rekkefølge, ikke updated_at-rekkefølge: et objekt som
+    endres etter at det er hentet kan ha eldre updated_at enn et objekt på en
+    senere side. Objekter på grensen hentes på nytt, men hoppes over av content_hash.
+    """
+    if not watermark:
+        return watermark
+    limit = started_at - timedelta(seconds=SYNC_WATERMARK_OVERLAP_SECONDS)
+    return min(parse_shopify_timestamp(watermark), limit).isoformat()
+
+def record_sync_status(resource, status, started_at, records_processed, watermark=None, error=None):
+    """Registrer en synk-kjøring med high-water mark i analytics.sync_status"""
+    try:
+        conn = get_db_connection()
+    except Exception as e:
+        # Neste kjøring finner ikke denne high-water marken og synker fra forrige
+        print(f"⚠️  Kunne ikke lagre synk-status for {resource}: {e}")
+        return
+    if not conn:
+        return
+    
+    metadata = {'backup_date': BACKUP_DATE}
+    watermark = capped_watermark(watermark, started_at)
+    if watermark:
+        metadata['updated_at_max'] = watermark
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO analytics.sync_status (sync_type, status, started_at, completed_at,
+                                               records_processed, errors_count, error_details, metadata)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP, %s, %s, %s, %s)
+        """, (resource, status, started_at, records_processed, 1 if error else 0, error, Json(metadata)))
+        conn.commit()
+        cursor.close()
+    except Exception as e:
+        print(f"⚠️  Kunne ikke lagre synk-status for {resource}: {e}")
         conn.rollback()
     finally:
+        release_db_connection(conn)
+
+def load_collections_from_db():
+    """
+    Hent lagrede collections fra databasen i samme form som collections_data
+    (brukes når inkrementell synk kun henter endrede collections)
+    """
+    collections_data = {'custom': [], 'smart': []}
+    conn = get_db_connection()
+    if not conn:
+        return collections_data
+    
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT raw_data FROM collections WHERE raw_data IS NOT NULL")
+        for (raw,) in cursor.fetchall():
+            collection = raw if isinstance(raw, dict) else json.loads(raw)
+            # Smart collections har regler, custom collections har det ikke
+            collections_data['smart' if 'rules' in collection else 'custom'].append(collection)
         cursor.close()
-        conn.close()
+    except Exception as e:
+        print(f"⚠️  Kunne ikke hente collections fra database: {e}")
+    finally:
+        release_db_connection(conn)
+    return collections_data
+
+def merge_collections_data(base, updates):
+    """Slå sammen collections_data, der oppdaterte collections vinner"""
+    merged = {}
+    for collection_type in ('custom', 'smart'):
+        by_id = {c['id']: c for c in base.get(collection_type, [])}
+        by_id.update({c['id']: c for c in updates.get(collection_type, [])})
+        merged[collection_type] = list(by_id.values())
+    return merged
 
-def fetch_and_organize_collections():
-    """Hent og organiser alle collections i mappestruktur"""
+def build_collection_membership(collections_data):
+    """
+    Bygg produkt -> collection-indeks med O(collections) API-kall:
+    custom collections via én gjennomgang av collects.json, smart collections
+    via produktlisten til hver smart collection.
+    Returnerer {product_id: [(collection_id, position), ...]} og om indeksen er komplett.
+    """
+    membership = {}
+    complete = True
+    
+    print("🔄 Henter collection-medlemskap (collects)...")
+    try:
+        for page_count, collects in iter_shopify_pages('collects.json', 'collects', {'limit': 250}):
+            for collect in collects:
+                membership.setdefault(collect['product_id'], []).append(
+                    (collect['collection_id'], collect.get('position'))
+                )
+    except ShopifyFetchError as e:
+        print(f"⚠️  {e}")
+        complete = False
+    
+    smart_collections = collections_data.get('smart', [])
+    print(f"🔄 Henter produkter i {len(smart_collections)} smart collections...")
+    for collection in smart_collections:
+        collection_id = collection['id']
+        position = 0
+        try:
+            for page_count, products in iter_shopify_pages(
+                f"collections/{collection_id}/products.json", 'products', {'limit': 250, 'fields': 'id'}
+            ):
+                for product in products:
+                    position += 1
+                    membership.setdefault(product['id'], []).append((collection_id, position))
+        except ShopifyFetchError as e:
+            print(f"⚠️  {e}")
+            complete = False
+    
+    print(f"   Medlemskap for {len(membership)} produkter")
+    return membership, complete
+
+def store_collection_products_to_db(membership, replace=True, conn=None):
+    """
+    Lagre collection-medlemskap i collection_products.
+    Med replace=True fjernes også medlemskap som ikke lenger finnes i Shopify.
+    """
+    if not membership:
+        return
+    
+    try:
+        with transaction(conn) as cursor:
+            cursor.execute("""
+                CREATE TEMP TABLE tmp_collection_products (
+                    collection_id BIGINT,
+                    product_id BIGINT,
+                    position INTEGER
+                ) ON COMMIT DROP
+            """)
+        
+            membership_records = [
+                (collection_id, product_id, position)
+                for product_id, collections in membership.items()
+                for collection_id, position in collections
+            ]
+            execute_batch(cursor, """
+                INSERT INTO tmp_collection_products (collection_id, product_id, position)
+                VALUES (%s, %s, %s)
+            """, membership_records, page_size=batch_size())
+        
+            if replace:
+                cursor.execute("""
+                    DELETE FROM collection_products cp
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM tmp_collection_products t
+                        WHERE t.collection_id = cp.collection_id AND t.product_id = cp.product_id
+                    )
+                """)
+        
+            # Kun rader der både collection og produkt finnes (fremmednøkler)
+            cursor.execute("""
+                INSERT INTO collection_products (collection_id, product_id, position)
+                SELECT DISTINCT ON (t.collection_id, t.product_id) t.collection_id, t.product_id, t.position
+                FROM tmp_collection_products t
+                JOIN collections c ON c.id = t.collection_id
+                JOIN products p ON p.id = t.product_id
+                ON CONFLICT (collection_id, product_id) DO UPDATE SET
+                    position = EXCLUDED.position
+            """)
+        
+        print(f"✅ Lagret {len(membership_records)} collection-medlemskap til database")
+        
+    except Exception as e:
+        print(f"❌ Feil ved lagring av collection-medlemskap: {e}")
+
+def fetch_and_organize_collections(incremental=False):
+    """
+    Hent og organiser alle collections i mappestruktur.
+    Med incremental=True hentes kun collections endret siden forrige synk.
+    """
     print("\n📁 === ORGANISERER COLLECTIONS ===")
     
     collections_data = {}
+    started_at = datetime.now().astimezone()
+    previous_watermark = get_sync_watermark('collections') if incremental else None
+    watermark = None
+    complete = True
     
-    # Custom collections
-    print("🔄 Henter custom collections...")
-    response = safe_request(f"{SHOPIFY_BASE_URL}/custom_collections.json?limit=250")
-    if response:
-        custom_collections = response.json().get('custom_collections', [])
-        collections_data['custom'] = custom_collections
+    params = {'limit': 250}
+    if previous_watermark:
+        params['updated_at_min'] = previous_watermark
+        print(f"🔄 Inkrementell synk: collections endret siden {previous_watermark}")
+    
+    archive = get_archive_writer()
+    start_resource_output('collections', incremental, previous_watermark)
+    
+    for collection_type, endpoint in (('custom', 'custom_collections'), ('smart', 'smart_collections')):
+        print(f"🔄 Henter {collection_type} collections...")
+        collections = []
+        try:
+            for page_count, page in iter_shopify_pages(f"{endpoint}.json", endpoint, params):
+                collections.extend(page)
+        except ShopifyFetchError as e:
+            print(f"⚠️  {e}")
+            complete = False
+        collections_data[collection_type] = collections
+        watermark = newest_updated_at(collections, watermark)
         
-        for collection in custom_collections:
+        for collection in collections:
             collection_name = safe_filename(collection.get('title', 'unknown'))
-            collection_dir = os.path.join(STRUCTURE['collections'], 'custom', collection_name)
-            os.makedirs(collection_dir, exist_ok=True)
             
-            # Lagre collection info
-            with open(os.path.join(collection_dir, 'collection_info.json'), 'w', encoding='utf-8') as f:
-                json.dump(collection, f, indent=2, default=str)
-            
-            # Last ned collection-bilde hvis det finnes
-            if collection.get('image') and collection['image'].get('src'):
-                img_url = collection['image']['src']
-                img_ext = img_url.split('.')[-1].split('?')[0] or 'jpg'
-                img_path = os.path.join(collection_dir, f'collection_image.{img_ext}')
-                download_image(img_url, img_path)
+            if archive:
+                archive_backup_object('collections', collection, type=collection_type)
+                if collection.get('image') and collection['image'].get('src'):
+                    img_url = collection['image']['src']
+                    img_path = os.path.join(STRUCTURE['media'], 'collections', str(collection['id']), f'collection_image.{image_extension(img_url)}')
+                    download_image(img_url, img_path)
+                continue
             
-            print(f"   📁 Lagret: {collection_name}")
-    
-    # Smart collections
-    print("🔄 Henter smart collections...")
-    response = safe_request(f"{SHOPIFY_BASE_URL}/smart_collections.json?limit=250")
-    if response:
-        smart_collections = response.json().get('smart_collections', [])
-        collections_data['smart'] = smart_collections
-        
-        for collection in smart_collections:
-            collection_name = safe_filename(collection.get('title', 'unknown'))
-            collection_dir = os.path.join(STRUCTURE['collections'], 'smart', collection_name)
-            os.makedirs(collection_dir, exist_ok=True)
+            collection_dir = os.path.join(STRUCTURE['collections'], collection_type, collection_name)
+            make_dirs(collection_dir)
             
             # Lagre collection info
-            with open(os.path.join(collection_dir, 'collection_info.json'), 'w', encoding='utf-8') as f:
-                json.dump(collection, f, indent=2, default=str)
+            collection_file = os.path.join(collection_dir, 'collection_info.json')
+            write_json(collection_file, collection, indent=2, default=str)
+            index_backup_object('collections', collection, collection_file, type=collection_type)
             
             # Last ned collection-bilde hvis det finnes
             if collection.get('image') and collection['image'].get('src'):
@@ -358,20 +1088,127 @@ def fetch_and_organize_collections():
             
             print(f"   📁 Lagret: {collection_name}")
     
+    checkpoint_resource_output('collections')
+    
     # Lagre oversikt
-    with open(os.path.join(STRUCTURE['collections'], '_collections_overview.json'), 'w', encoding='utf-8') as f:
-        json.dump(collections_data, f, indent=2, default=str)
+    write_json(os.path.join(STRUCTURE['collections'], '_collections_overview.json'), collections_data, indent=2, default=str)
     
     # Lagre til database
     all_collections = collections_data.get('custom', []) + collections_data.get('smart', [])
-    if all_collections:
-        store_collections_to_db(all_collections)
+    if all_collections and store_collections_to_db(all_collections) is None:
+        complete = False
+    
+    record_sync_status(
+        'collections',
+        'completed' if complete else 'failed',
+        started_at,
+        len(all_collections),
+        watermark.isoformat() if watermark else previous_watermark
+    )
     
     print(f"✅ Organisert {len(collections_data.get('custom', []))} custom + {len(collections_data.get('smart', []))} smart collections")
     return collections_data
 
-def fetch_and_organize_products(collections_data):
-    """Hent og organiser alle produkter etter kategorier"""
+def organize_product(product, product_dirs, membership, collection_map):
+    """Skriv ett produkt til all_products, by_vendor, by_type og by_collection"""
+    product_id = product['id']
+    product_title = safe_filename(product.get('title', 'untitled'))
+    vendor = safe_filename(product.get('vendor', 'no_vendor'))
+    product_type = safe_filename(product.get('product_type', 'no_type'))
+    
+    # Dimensjoner for backup-indeksen; collections kan slås opp på id og tittel
+    product_collections = [collection_id for collection_id, position in membership.get(product_id, [])]
+    dimensions = {
+        'vendor': product.get('vendor'),
+        'type': product.get('product_type'),
+        'status': product.get('status'),
+        'collection': product_collections + [
+            collection_map[collection_id]['title'] for collection_id in product_collections
+            if collection_map.get(collection_id, {}).get('title')
+        ]
+    }
+    
+    # Arkivformat: én JSONL-linje i stedet for produktmappe og pekerfiler
+    if get_archive_writer():
+        archive_backup_object('products', product, **dimensions)
+        for j, image in enumerate(product.get('images') or []):
+            if image.get('src'):
+                img_path = os.path.join(STRUCTURE['media'], 'products', str(product_id), f"image_{j+1}.{image_extension(image['src'])}")
+                download_image(image['src'], img_path)
+        return
+    
+    # 1. Lagre i "alle produkter"
+    product_main_dir = os.path.join(product_dirs['all_products'], f"{product_id}_{product_title}")
+    make_dirs(product_main_dir)
+    
+    # Lagre produktinfo
+    product_file = os.path.join(product_main_dir, 'product_info.json')
+    write_json(product_file, product, indent=2, default=str)
+    index_backup_object('products', product, product_file, **dimensions)
+    
+    # Last ned produktbilder
+    images_dir = os.path.join(product_main_dir, 'images')
+    if product.get('images'):
+        make_dirs(images_dir)
+        for j, image in enumerate(product['images']):
+            if image.get('src'):
+                img_url = image['src']
+                img_ext = img_url.split('.')[-1].split('?')[0] or 'jpg'
+                img_path = os.path.join(images_dir, f'image_{j+1}.{img_ext}')
+                download_image(img_url, img_path)
+    
+    # 2. Organiser etter vendor
+    vendor_dir = os.path.join(product_dirs['by_vendor'], vendor)
+    make_dirs(vendor_dir)
+    vendor_product_link = os.path.join(vendor_dir, f"{product_id}_{product_title}.json")
+    write_json(vendor_product_link, {
+        "product_id": product_id,
+        "title": product['title'],
+        "main_directory": product_main_dir,
+        "summary": {
+            "vendor": product.get('vendor'),
+            "type": product.get('product_type'),
+            "status": product.get('status'),
+            "variants_count": len(product.get('variants', [])),
+            "images_count": len(product.get('images', []))
+        }
+    }, indent=2)
+    
+    # 3. Organiser etter type
+    if product_type != 'no_type':
+        type_dir = os.path.join(product_dirs['by_type'], product_type)
+        make_dirs(type_dir)
+        type_product_link = os.path.join(type_dir, f"{product_id}_{product_title}.json")
+        write_json(type_product_link, {
+            "product_id": product_id,
+            "title": product['title'],
+            "main_directory": product_main_dir
+        }, indent=2)
+    
+    # 4. Organiser etter collections (fra medlemskapsindeksen)
+    for collection_id, position in membership.get(product_id, []):
+        collection = collection_map.get(collection_id, {'id': collection_id})
+        coll_name = safe_filename(collection['title']) if collection.get('title') else f"collection_{collection_id}"
+        coll_dir = os.path.join(product_dirs['by_collection'], coll_name)
+        make_dirs(coll_dir)
+        coll_product_link = os.path.join(coll_dir, f"{product_id}_{product_title}.json")
+        write_json(coll_product_link, {
+            "product_id": product_id,
+            "title": product['title'],
+            "main_directory": product_main_dir,
+            "position": position,
+            "collection_info": collection
+        }, indent=2, default=str)
+
+def fetch_and_organize_products(collections_data, incremental=False, bulk=False):
+    """
+    Hent og organiser alle produkter etter kategorier.
+    Med incremental=True hentes kun produkter endret siden forrige synk.
+    Med bulk=True hentes produktene med én GraphQL bulk-operasjon.
+    Produktene strømmes side for side til disk og database, og REST-hentingen
+    sjekkpunktes slik at en avbrutt backup fortsetter fra siste committede side.
+    Returnerer antall produkter som ble behandlet.
+    """
     print("\n🏷️  === ORGANISERER PRODUKTER ===")
     
     # Opprett mapper for forskjellige kategoriseringer
@@ -384,175 +1221,201 @@ def fetch_and_organize_products(collections_data):
     }
     
     for dir_path in product_dirs.values():
-        os.makedirs(dir_path, exist_ok=True)
+        make_dirs(dir_path)
+    
+    # Inkrementell synk henter kun endrede collections, så resten hentes fra databasen
+    if incremental:
+        collections_data = merge_collections_data(load_collections_from_db(), collections_data)
     
     # Bygg collection-map for rask oppslag
     collection_map = {}
-    for collection in collections_data.get('custom', []):
-        collection_map[collection['id']] = safe_filename(collection.get('title', 'unknown'))
-    for collection in collections_data.get('smart', []):
-        collection_map[collection['id']] = safe_filename(collection.get('title', 'unknown'))
+    for collection in collections_data.get('custom', []) + collections_data.get('smart', []):
+        collection_map[collection['id']] = collection
     
-    print("🔄 Henter alle produkter...")
-    all_products = []
-    page_count = 0
-    next_page_info = None
+    started_at = datetime.now().astimezone()
+    previous_watermark = get_sync_watermark('products') if incremental else None
+    complete = True
+    db_ok = True
     
-    while page_count < 100:  # Sikkerhetsbremse
-        page_count += 1
-        
-        if next_page_info:
-            url = f"{SHOPIFY_BASE_URL}/products.json?limit=50&page_info={next_page_info}"
-        else:
-            url = f"{SHOPIFY_BASE_URL}/products.json?limit=50"
-        
-        response = safe_request(url)
-        if not response:
-            break
-            
-        data = response.json()
-        products = data.get('products', [])
-        
-        if not products:
-            break
-            
-        all_products.extend(products)
-        print(f"   Side {page_count}: hentet {len(products)} produkter, totalt {len(all_products)}")
-        
-        # Sjekk for neste side
-        link_header = response.headers.get('Link')
-        next_page_info = None
-        
-        if link_header and 'rel="next"' in link_header:
-            for link in link_header.split(','):
-                if 'rel="next"' in link:
-                    url_part = link.split(';')[0].strip('<> ')
-                    parsed = urllib.parse.urlparse(url_part)
-                    query = urllib.parse.parse_qs(parsed.query)
-                    if "page_info" in query:
-                        next_page_info = query["page_info"][0]
-                    break
-        
-        if not next_page_info:
-            break
-            
-        time.sleep(0.5)
-    
-    print(f"🔄 Organiserer {len(all_products)} produkter...")
-    
-    # Organiser hvert produkt
-    for i, product in enumerate(all_products):
-        if i % 50 == 0:
-            print(f"   Organisert {i}/{len(all_products)} produkter...")
-        
-        product_id = product['id']
-        product_title = safe_filename(product.get('title', 'untitled'))
-        vendor = safe_filename(product.get('vendor', 'no_vendor'))
-        product_type = safe_filename(product.get('product_type', 'no_type'))
-        
-        # 1. Lagre i "alle produkter"
-        product_main_dir = os.path.join(product_dirs['all_products'], f"{product_id}_{product_title}")
-        os.makedirs(product_main_dir, exist_ok=True)
-        
-        # Lagre produktinfo
-        with open(os.path.join(product_main_dir, 'product_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(product, f, indent=2, default=str)
-        
-        # Last ned produktbilder
-        images_dir = os.path.join(product_main_dir, 'images')
-        if product.get('images'):
-            os.makedirs(images_dir, exist_ok=True)
-            for j, image in enumerate(product['images']):
-                if image.get('src'):
-                    img_url = image['src']
-                    img_ext = img_url.split('.')[-1].split('?')[0] or 'jpg'
-                    img_path = os.path.join(images_dir, f'image_{j+1}.{img_ext}')
-                    download_image(img_url, img_path)
+    params = {'limit': 50}
+    if previous_watermark:
+        params['updated_at_min'] = previous_watermark
+        print(f"🔄 Inkrementell synk: produkter endret siden {previous_watermark}")
+    else:
+        print("🔄 Henter alle produkter...")
+    
+    # Medlemskap for alle produkter hentes samlet, ikke per produkt
+    membership, membership_complete = build_collection_membership(collections_data)
+    
+    checkpoint = None
+    if bulk:
+        pages = iter_bulk_pages(get_bulk_exporter(), 'products', previous_watermark)
+    else:
+        checkpoint = get_checkpoint('products', params)
+        pages = iter_shopify_pages('products.json', 'products', params, checkpoint=checkpoint)
+    
+    # Tellere fortsetter fra sjekkpunktet ved gjenopptatt henting
+    state = checkpoint.state if checkpoint else {}
+    if state.get('started_at'):
+        started_at = parse_shopify_timestamp(state['started_at'])
+    product_count = state.get('product_count', 0)
+    by_vendor = state.get('by_vendor', {})
+    by_type = state.get('by_type', {})
+    watermark = parse_shopify_timestamp(state['watermark']) if state.get('watermark') else None
+    
+    def save_checkpoint():
+        checkpoint_resource_output('products')
+        # Etter en databasefeil står sjekkpunktet fast, så neste kjøring lagrer sidene på nytt
+        if checkpoint and db_ok:
+            checkpoint.save(
+                product_count=product_count,
+                by_vendor=by_vendor,
+                by_type=by_type,
+                watermark=watermark.isoformat() if watermark else None,
+                started_at=started_at.isoformat()
+            )
+    
+    # Lagre produkter og medlemskap til database, sjekkpunkt ved hver commit
+    with PhaseTransaction(on_commit=save_checkpoint) as phase:
+        try:
+            for page_count, products in pages:
+                if page_count == 1:
+                    product_count, by_vendor, by_type, watermark = 0, {}, {}, None
+                    start_resource_output('products', incremental, previous_watermark)
+                
+                # Lagre siden til database før den skrives til disk. Feiler lagringen, fortsetter
+                # backupen kun til disk, og verken sjekkpunkt eller watermark flyttes forbi siden
+                if db_ok and phase.conn is not None and store_products_to_db(products, conn=phase.conn) is None:
+                    print(f"⚠️  Side {page_count} av produktene ble ikke lagret i databasen, fortsetter kun til disk")
+                    db_ok = complete = False
+                
+                # Organiser hvert produkt på denne siden
+                for product in products:
+                    organize_product(product, product_dirs, membership, collection_map)
+                    
+                    vendor = product.get('vendor', 'Unknown')
+                    product_type = product.get('product_type', 'Unknown')
+                    by_vendor[vendor] = by_vendor.get(vendor, 0) + 1
+                    by_type[product_type] = by_type.get(product_type, 0) + 1
+                
+                product_count += len(products)
+                watermark = newest_updated_at(products, watermark)
+                phase.step()
+                print(f"   Side {page_count}: organisert {len(products)} produkter, totalt {product_count}")
+        except (ShopifyFetchError, BulkExportError) as e:
+            print(f"⚠️  {e}")
+            complete = False
         
-        # 2. Organiser etter vendor
-        vendor_dir = os.path.join(product_dirs['by_vendor'], vendor)
-        os.makedirs(vendor_dir, exist_ok=True)
-        vendor_product_link = os.path.join(vendor_dir, f"{product_id}_{product_title}.json")
-        with open(vendor_product_link, 'w', encoding='utf-8') as f:
-            json.dump({
-                "product_id": product_id,
-                "title": product['title'],
-                "main_directory": product_main_dir,
-                "summary": {
-                    "vendor": product.get('vendor'),
-                    "type": product.get('product_type'),
-                    "status": product.get('status'),
-                    "variants_count": len(product.get('variants', [])),
-                    "images_count": len(product.get('images', []))
-                }
-            }, f, indent=2)
-        
-        # 3. Organiser etter type
-        if product_type != 'no_type':
-            type_dir = os.path.join(product_dirs['by_type'], product_type)
-            os.makedirs(type_dir, exist_ok=True)
-            type_product_link = os.path.join(type_dir, f"{product_id}_{product_title}.json")
-            with open(type_product_link, 'w', encoding='utf-8') as f:
-                json.dump({
-                    "product_id": product_id,
-                    "title": product['title'],
-                    "main_directory": product_main_dir
-                }, f, indent=2)
-        
-        # 4. Organiser etter collections (må hente collection-medlemskap)
-        # Dette krever ekstra API-kall, så vi gjør det for utvalgte produkter
-        if i < 100:  # Kun for første 100 produkter for å ikke overbelaste API
-            try:
-                coll_response = safe_request(f"{SHOPIFY_BASE_URL}/products/{product_id}/collections.json")
-                if coll_response:
-                    product_collections = coll_response.json().get('collections', [])
-                    for collection in product_collections:
-                        coll_name = collection_map.get(collection['id'], f"collection_{collection['id']}")
-                        coll_dir = os.path.join(product_dirs['by_collection'], coll_name)
-                        os.makedirs(coll_dir, exist_ok=True)
-                        coll_product_link = os.path.join(coll_dir, f"{product_id}_{product_title}.json")
-                        with open(coll_product_link, 'w', encoding='utf-8') as f:
-                            json.dump({
-                                "product_id": product_id,
-                                "title": product['title'],
-                                "main_directory": product_main_dir,
-                                "collection_info": collection
-                            }, f, indent=2)
-                time.sleep(0.2)  # Rate limiting for collection-kall
-            except:
-                pass  # Ignorer feil ved collection-oppslag
+        # Lagre medlemskap etter produktene (fremmednøkkel); fjern kun gamle rader når indeksen er komplett
+        store_collection_products_to_db(membership, replace=membership_complete and complete, conn=phase.conn)
     
     # Lagre produktoversikt
     product_summary = {
-        "total_products": len(all_products),
-        "by_vendor": {},
-        "by_type": {},
+        "total_products": product_count,
+        "by_vendor": by_vendor,
+        "by_type": by_type,
         "backup_date": BACKUP_DATE
     }
     
-    # Tell produkter per vendor og type
-    for product in all_products:
-        vendor = product.get('vendor', 'Unknown')
-        product_type = product.get('product_type', 'Unknown')
-        
-        product_summary["by_vendor"][vendor] = product_summary["by_vendor"].get(vendor, 0) + 1
-        product_summary["by_type"][product_type] = product_summary["by_type"].get(product_type, 0) + 1
-    
-    with open(os.path.join(STRUCTURE['products'], '_products_summary.json'), 'w', encoding='utf-8') as f:
-        json.dump(product_summary, f, indent=2)
+    write_json(os.path.join(STRUCTURE['products'], '_products_summary.json'), product_summary, indent=2)
     
-    # Lagre produkter til database
-    if all_products:
-        store_products_to_db(all_products)
+    record_sync_status(
+        'products',
+        'completed' if complete else 'failed',
+        started_at,
+        product_count,
+        watermark.isoformat() if watermark else previous_watermark
+    )
     
-    print(f"✅ Organisert {len(all_products)} produkter:")
+    print(f"✅ Organisert {product_count} produkter:")
     print(f"   📁 Vendors: {len(product_summary['by_vendor'])}")
     print(f"   📁 Typer: {len(product_summary['by_type'])}")
     
-    return all_products
+    return product_count
 
-def fetch_and_organize_orders():
-    """Hent og organiser ordrer etter dato og status"""
+def organize_order(order, order_dirs):
+    """Skriv én ordre til all_orders, by_year og by_status"""
+    order_id = order['id']
+    order_number = order.get('order_number', order_id)
+    created_at = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
+    year = created_at.year
+    month = created_at.month
+    status = order.get('financial_status', 'unknown')
+    
+    # Dimensjoner for backup-indeksen
+    dimensions = {
+        'vendor': sorted({item.get('vendor') for item in order.get('line_items', []) if item.get('vendor')}),
+        'status': status,
+        'fulfillment': order.get('fulfillment_status') or 'unfulfilled',
+        'year': str(year),
+        'month': f"{year}-{month:02d}"
+    }
+    
+    # Arkivformat: én JSONL-linje i stedet for tre filer per ordre
+    if get_archive_writer():
+        archive_backup_object('orders', order, **dimensions)
+        return
+    
+    # Lagre i alle ordrer
+    order_file = os.path.join(order_dirs['all_orders'], f"order_{order_number}_{order_id}.json")
+    write_json(order_file, order, indent=2, default=str)
+    index_backup_object('orders', order, order_file, **dimensions)
+    
+    # Organiser etter år og måned
+    year_dir = os.path.join(order_dirs['by_year'], str(year), f"{month:02d}")
+    make_dirs(year_dir)
+    year_order_link = os.path.join(year_dir, f"order_{order_number}.json")
+    write_json(year_order_link, {
+        "order_id": order_id,
+        "order_number": order_number,
+        "created_at": order['created_at'],
+        "total_price": order.get('total_price'),
+        "financial_status": status,
+        "full_order_file": order_file
+    }, indent=2)
+    
+    # Organiser etter status
+    status_dir = os.path.join(order_dirs['by_status'], status)
+    make_dirs(status_dir)
+    status_order_link = os.path.join(status_dir, f"order_{order_number}.json")
+    write_json(status_order_link, {
+        "order_id": order_id,
+        "order_number": order_number,
+        "created_at": order['created_at'],
+        "total_price": order.get('total_price'),
+        "full_order_file": order_file
+    }, indent=2)
+
+REFUNDED_FINANCIAL_STATUSES = ('refunded', 'partially_refunded')
+
+def with_bulk_refunds(pages):
+    """
+    Bulk-eksporten av ordrer har ikke refusjoner. For ordrer med refusjon
+    hentes de fra REST (orders/<id>/refunds.json) før siden lagres. Uten dem
+    får ordrelinjene refunded_quantity 0, og royalty-ledgeren (som kun
+    betaler royalty av antall som ikke er refundert) betaler for hele linjen.
+    """
+    for page_count, orders in pages:
+        for order in orders:
+            if order.get('financial_status') not in REFUNDED_FINANCIAL_STATUSES:
+                continue
+            response = safe_request(f"{SHOPIFY_BASE_URL}/orders/{order['id']}/refunds.json")
+            if not response:
+                raise ShopifyFetchError(f"Kunne ikke hente refusjoner for ordre {order['id']}")
+            order['refunds'] = response.json().get('refunds', [])
+        yield page_count, orders
+
+def fetch_and_organize_orders(incremental=False, bulk=False):
+    """
+    Hent og organiser ordrer etter dato og status.
+    Ordrene strømmes side for side: hver side skrives til disk og database
+    før neste side hentes, så minnebruken er uavhengig av antall ordrer.
+    Med incremental=True hentes kun ordrer endret siden forrige synk.
+    Med bulk=True hentes ordrene med én GraphQL bulk-operasjon og
+    JSONL-resultatet strømmes inn i samme løype. REST-hentingen sjekkpunktes,
+    så en avbrutt backup fortsetter fra siste committede side.
+    Returnerer antall ordrer som ble behandlet.
+    """
     print("\n🛒 === ORGANISERER ORDRER ===")
     
     # Opprett mapper for ordrer
@@ -564,63 +1427,236 @@ def fetch_and_organize_orders():
     }
     
     for dir_path in order_dirs.values():
-        os.makedirs(dir_path, exist_ok=True)
-    
-    print("🔄 Henter ordrer (de første 500)...")
-    response = safe_request(f"{SHOPIFY_BASE_URL}/orders.json?status=any&limit=250")
-    if not response:
-        return []
-    
-    orders = response.json().get('orders', [])
-    
-    # Organiser ordrer
-    for order in orders:
-        order_id = order['id']
-        order_number = order.get('order_number', order_id)
-        created_at = datetime.fromisoformat(order['created_at'].replace('Z', '+00:00'))
-        year = created_at.year
-        month = created_at.month
-        status = order.get('financial_status', 'unknown')
-        
-        # Lagre i alle ordrer
-        order_file = os.path.join(order_dirs['all_orders'], f"order_{order_number}_{order_id}.json")
-        with open(order_file, 'w', encoding='utf-8') as f:
-            json.dump(order, f, indent=2, default=str)
-        
-        # Organiser etter år og måned
-        year_dir = os.path.join(order_dirs['by_year'], str(year), f"{month:02d}")
-        os.makedirs(year_dir, exist_ok=True)
-        year_order_link = os.path.join(year_dir, f"order_{order_number}.json")
-        with open(year_order_link, 'w', encoding='utf-8') as f:
-            json.dump({
-                "order_id": order_id,
-                "order_number": order_number,
-                "created_at": order['created_at'],
-                "total_price": order.get('total_price'),
-                "financial_status": status,
-                "full_order_file": order_file
-            }, f, indent=2)
-        
-        # Organiser etter status
-        status_dir = os.path.join(order_dirs['by_status'], status)
-        os.makedirs(status_dir, exist_ok=True)
-        status_order_link = os.path.join(status_dir, f"order_{order_number}.json")
-        with open(status_order_link, 'w', encoding='utf-8') as f:
-            json.dump({
-                "order_id": order_id,
-                "order_number": order_number,
-                "created_at": order['created_at'],
-                "total_price": order.get('total_price'),
-                "full_order_file": order_file
-            }, f, indent=2)
-    
-    print(f"✅ Organisert {len(orders)} ordrer")
-    
-    # Lagre ordrer til database
-    if orders:
-        store_orders_to_db(orders)
-    
-    return orders
+        make_dirs(dir_path)
+    
+    started_at = datetime.now().astimezone()
+    previous_watermark = get_sync_watermark('orders') if incremental else None
+    watermark = None
+    complete = True
+    db_ok = True
+    
+    params = {'status': 'any', 'limit': 250}
+    if previous_watermark:
+        params['updated_at_min'] = previous_watermark
+        print(f"🔄 Inkrementell synk: ordrer endret siden {previous_watermark}")
+    else:
+        print("🔄 Henter alle ordrer...")
+    
+    checkpoint = None
+    if bulk:
+        pages = with_bulk_refunds(iter_bulk_pages(get_bulk_exporter(), 'orders', previous_watermark))
+    else:
+        checkpoint = get_checkpoint('orders', params)
+        pages = iter_shopify_pages('orders.json', 'orders', params, checkpoint=checkpoint)
+    
+    # Tellere fortsetter fra sjekkpunktet ved gjenopptatt henting
+    state = checkpoint.state if checkpoint else {}
+    if state.get('started_at'):
+        started_at = parse_shopify_timestamp(state['started_at'])
+    order_count = state.get('order_count', 0)
+    if state.get('watermark'):
+        watermark = parse_shopify_timestamp(state['watermark'])
+    
+    def save_checkpoint():
+        checkpoint_resource_output('orders')
+        # Etter en databasefeil står sjekkpunktet fast, så neste kjøring lagrer sidene på nytt
+        if checkpoint and db_ok:
+            checkpoint.save(
+                order_count=order_count,
+                watermark=watermark.isoformat() if watermark else None,
+                started_at=started_at.isoformat()
+            )
+    
+    # Én tilkobling for hele fasen, commit (og sjekkpunkt) hver PERFORMANCE.commit_interval side
+    with PhaseTransaction(on_commit=save_checkpoint) as phase:
+        try:
+            for page_count, orders in pages:
+                if page_count == 1:
+                    order_count, watermark = 0, None
+                    start_resource_output('orders', incremental, previous_watermark)
+                
+                # Lagre siden til database før den skrives til disk. Feiler lagringen, fortsetter
+                # backupen kun til disk, og verken sjekkpunkt eller watermark flyttes forbi siden
+                if db_ok and phase.conn is not None and store_orders_to_db(orders, conn=phase.conn) is None:
+                    print(f"⚠️  Side {page_count} av ordrene ble ikke lagret i databasen, fortsetter kun til disk")
+                    db_ok = complete = False
+                
+                # Organiser ordrer på denne siden
+                for order in orders:
+                    organize_order(order, order_dirs)
+                
+                order_count += len(orders)
+                watermark = newest_updated_at(orders, watermark)
+                phase.step()
+                print(f"   Side {page_count}: hentet {len(orders)} ordrer, totalt {order_count}")
+        except (ShopifyFetchError, BulkExportError) as e:
+            print(f"⚠️  {e}")
+            complete = False
+    
+    record_sync_status(
+        'orders',
+        'completed' if complete else 'failed',
+        started_at,
+        order_count,
+        watermark.isoformat() if watermark else previous_watermark
+    )
+    
+    print(f"✅ Organisert {order_count} ordrer")
+    
+    return order_count
+
+def newest_watermark(*watermarks):
+    """Nyeste av flere high-water marks (ISO-strenger), eller None"""
+    parsed = [parse_shopify_timestamp(w) for w in watermarks if w]
+    return max(parsed).isoformat() if parsed else None
+
+def sync_orders_for_period(start, end):
+    """
+    Synk ordrer opprettet i [start, end) som er endret siden forrige synk,
+    rett til databasen (med ordrelinjer og royalty-ledger), uten å skrive
+    backup-filer. Brukes av rapportene før de leser royalty-ledgeren.
+    Nedre grense er den nyeste av watermarken fra full backup ('orders')
+    og fra forrige synk av samme periode; perioden har egen sync_type så
+    backupens inkrementelle synk ikke hopper over ordrer utenfor perioden.
+    Returnerer {'orders', 'since', 'watermark', 'complete'}.
+    """
+    sync_type = f"orders_period:{start:%Y-%m-%d}:{end:%Y-%m-%d}"
+    started_at = datetime.now().astimezone()
+    previous_watermark = newest_watermark(get_sync_watermark('orders'), get_sync_watermark(sync_type))
+    watermark = None
+    order_count = 0
+    complete = True
+    
+    # En dag slingringsmonn i hver ende, så tidssonen til period_month ikke kutter ordrer
+    params = {
+        'status': 'any',
+        'limit': 250,
+        'created_at_min': (start - timedelta(days=1)).isoformat(),
+        'created_at_max': (end + timedelta(days=1)).isoformat()
+    }
+    if previous_watermark:
+        params['updated_at_min'] = previous_watermark
+        print(f"🔄 Synker ordrer fra {start} til {end} endret siden {previous_watermark}")
+    else:
+        print(f"🔄 Ingen tidligere synk funnet, henter alle ordrer fra {start} til {end}")
+    
+    with PhaseTransaction() as phase:
+        try:
+            for page_count, orders in iter_shopify_pages('orders.json', 'orders', params):
+                if store_orders_to_db(orders, conn=phase.conn) is None:
+                    complete = False
+                    break
+                order_count += len(orders)
+                watermark = newest_updated_at(orders, watermark)
+                phase.step()
+        except ShopifyFetchError as e:
+            print(f"⚠️  {e}")
+            complete = False
+    
+    watermark = watermark.isoformat() if watermark else previous_watermark
+    record_sync_status(sync_type, 'completed' if complete else 'failed', started_at, order_count, watermark)
+    print(f"{'✅' if complete else '⚠️ '} Synket {order_count} endrede ordrer for {start} til {end}")
+    return {'orders': order_count, 'since': previous_watermark, 'watermark': watermark, 'complete': complete}
+
+def fetch_and_organize_customers(incremental=False):
+    """
+    Hent og organiser kunder.
+    Kundene strømmes side for side til disk og database med samme
+    cursor-paginering, sjekkpunkter og bulk-skriving som ordrene.
+    Med incremental=True hentes kun kunder endret siden forrige synk.
+    Returnerer antall kunder som ble behandlet.
+    """
+    print("\n👥 === ORGANISERER KUNDER ===")
+    
+    all_customers_dir = os.path.join(STRUCTURE['customers'], 'all_customers')
+    make_dirs(all_customers_dir)
+    
+    started_at = datetime.now().astimezone()
+    previous_watermark = get_sync_watermark('customers') if incremental else None
+    watermark = None
+    complete = True
+    db_ok = True
+    
+    params = {'limit': 250}
+    if previous_watermark:
+        params['updated_at_min'] = previous_watermark
+        print(f"🔄 Inkrementell synk: kunder endret siden {previous_watermark}")
+    else:
+        print("🔄 Henter alle kunder...")
+    
+    checkpoint = get_checkpoint('customers', params)
+    pages = iter_shopify_pages('customers.json', 'customers', params, checkpoint=checkpoint)
+    
+    # Tellere fortsetter fra sjekkpunktet ved gjenopptatt henting
+    if checkpoint.state.get('started_at'):
+        started_at = parse_shopify_timestamp(checkpoint.state['started_at'])
+    customer_count = checkpoint.state.get('customer_count', 0)
+    if checkpoint.state.get('watermark'):
+        watermark = parse_shopify_timestamp(checkpoint.state['watermark'])
+    
+    archive = get_archive_writer()
+    
+    def save_checkpoint():
+        checkpoint_resource_output('customers')
+        # Etter en databasefeil står sjekkpunktet fast, så neste kjøring lagrer sidene på nytt
+        if not db_ok:
+            return
+        checkpoint.save(
+            customer_count=customer_count,
+            watermark=watermark.isoformat() if watermark else None,
+            started_at=started_at.isoformat()
+        )
+    
+    with PhaseTransaction(on_commit=save_checkpoint) as phase:
+        try:
+            for page_count, customers in pages:
+                if page_count == 1:
+                    customer_count, watermark = 0, None
+                    start_resource_output('customers', incremental, previous_watermark)
+                
+                # Lagre siden til database før den skrives til disk. Feiler lagringen, fortsetter
+                # backupen kun til disk, og verken sjekkpunkt eller watermark flyttes forbi siden
+                if db_ok and phase.conn is not None and store_customers_to_db(customers, conn=phase.conn) is None:
+                    print(f"⚠️  Side {page_count} av kundene ble ikke lagret i databasen, fortsetter kun til disk")
+                    db_ok = complete = False
+                
+                for customer in customers:
+                    dimensions = {
+                        'status': customer.get('state'),
+                        'month': (customer.get('created_at') or '')[:7]
+                    }
+                    if archive:
+                        archive_backup_object('customers', customer, **dimensions)
+                        continue
+                    customer_file = os.path.join(all_customers_dir, f"customer_{customer['id']}.json")
+                    write_json(customer_file, customer, indent=2, default=str)
+                    index_backup_object('customers', customer, customer_file, **dimensions)
+                
+                customer_count += len(customers)
+                watermark = newest_updated_at(customers, watermark)
+                phase.step()
+                print(f"   Side {page_count}: hentet {len(customers)} kunder, totalt {customer_count}")
+        except ShopifyFetchError as e:
+            print(f"⚠️  {e}")
+            complete = False
+    
+    write_json(os.path.join(STRUCTURE['customers'], '_customers_summary.json'), {
+        "total_customers": customer_count,
+        "incremental_since": previous_watermark,
+        "backup_date": BACKUP_DATE
+    }, indent=2)
+    
+    record_sync_status(
+        'customers',
+        'completed' if complete else 'failed',
+        started_at,
+        customer_count,
+        watermark.isoformat() if watermark else previous_watermark
+    )
+    
+    print(f"✅ Organisert {customer_count} kunder")
+    
+    return customer_count
 
 def fetch_shop_settings():
     """Hent og organiser butikkinnstillinger"""
@@ -634,8 +1670,7 @@ def fetch_shop_settings():
         shop_info = response.json().get('shop', {})
         settings_data['shop_info'] = shop_info
         
-        with open(os.path.join(STRUCTURE['shop_settings'], 'shop_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(shop_info, f, indent=2, default=str)
+        write_json(os.path.join(STRUCTURE['shop_settings'], 'shop_info.json'), shop_info, indent=2, default=str)
         
         # Last ned logo hvis det finnes
         if shop_info.get('logo'):
@@ -647,8 +1682,7 @@ def fetch_shop_settings():
         policies = response.json().get('policies', [])
         settings_data['policies'] = policies
         
-        with open(os.path.join(STRUCTURE['shop_settings'], 'policies.json'), 'w', encoding='utf-8') as f:
-            json.dump(policies, f, indent=2, default=str)
+        write_json(os.path.join(STRUCTURE['shop_settings'], 'policies.json'), policies, indent=2, default=str)
     
     # Shipping zones
     response = safe_request(f"{SHOPIFY_BASE_URL}/shipping_zones.json")
@@ -656,8 +1690,7 @@ def fetch_shop_settings():
         shipping_zones = response.json().get('shipping_zones', [])
         settings_data['shipping_zones'] = shipping_zones
         
-        with open(os.path.join(STRUCTURE['shop_settings'], 'shipping_zones.json'), 'w', encoding='utf-8') as f:
-            json.dump(shipping_zones, f, indent=2, default=str)
+        write_json(os.path.join(STRUCTURE['shop_settings'], 'shipping_zones.json'), shipping_zones, indent=2, default=str)
     
     # Locations
     response = safe_request(f"{SHOPIFY_BASE_URL}/locations.json")
@@ -665,14 +1698,17 @@ def fetch_shop_settings():
         locations = response.json().get('locations', [])
         settings_data['locations'] = locations
         
-        with open(os.path.join(STRUCTURE['shop_settings'], 'locations.json'), 'w', encoding='utf-8') as f:
-            json.dump(locations, f, indent=2, default=str)
+        write_json(os.path.join(STRUCTURE['shop_settings'], 'locations.json'), locations, indent=2, default=str)
     
     print("✅ Butikkinnstillinger organisert")
     return settings_data
 
-def generate_backup_report():
-    """Generer oversiktsrapport for backupen"""
+def generate_backup_report(sync_jobs=None, verify=False):
+    """
+    Generer oversiktsrapport for backupen fra skrivernes tellere.
+    Med verify=True telles alle kategorier på nytt med os.scandir (parallelt)
+    og avvik fra tellerne tas med i rapporten.
+    """
     print("\n📊 === GENERERER BACKUP-RAPPORT ===")
     
     report = {
@@ -683,39 +1719,46 @@ def generate_backup_report():
         },
         "structure": {},
         "file_counts": {},
+        "sync_jobs": sync_jobs or {},
+        "stats_source": "verified" if verify else "counters",
         "total_size_mb": 0
     }
     
-    # Tell filer og mapper i hver hovedkategori
-    for category, path in STRUCTURE.items():
-        if os.path.exists(path):
-            file_count = 0
-            folder_count = 0
-            total_size = 0
-            
-            for root, dirs, files in os.walk(path):
-                folder_count += len(dirs)
-                file_count += len(files)
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    try:
-                        total_size += os.path.getsize(file_path)
-                    except:
-                        pass
-            
-            report["structure"][category] = {
-                "path": path,
-                "files": file_count,
-                "folders": folder_count,
-                "size_mb": round(total_size / (1024*1024), 2)
-            }
-            
-            report["total_size_mb"] += report["structure"][category]["size_mb"]
+    stats = get_backup_stats()
+    counters = stats.snapshot()
+    if verify:
+        verified = verify_categories(stats.categories)
+        drift = {
+            category: {key: counts[key] - counters[category][key] for key in counts}
+            for category, counts in verified.items()
+            if counts != counters[category]
+        }
+        if drift:
+            report["counter_drift"] = drift
+            print(f"⚠️  Tellerne avviker fra disk for: {', '.join(drift)}")
+        counters = verified
+    
+    # Filer, mapper og størrelse per hovedkategori (og arkivet hvis det er brukt)
+    for category, path in stats.categories.items():
+        counts = counters.get(category)
+        if not counts or not os.path.exists(path):
+            continue
+        report["structure"][category] = {
+            "path": path,
+            "files": counts['files'],
+            "folders": counts['folders'],
+            "size_mb": round(counts['bytes'] / (1024*1024), 2)
+        }
+        report["total_size_mb"] += report["structure"][category]["size_mb"]
     
     # Lagre rapport
     report_file = os.path.join(STRUCTURE['metadata'], 'backup_report.json')
-    with open(report_file, 'w', encoding='utf-8') as f:
-        json.dump(report, f, indent=2)
+    if verify:
+        # Verifiserte tall erstatter tellerne, så neste kjøring starter riktig
+        for category, counts in counters.items():
+            stats.set_category(category, counts['files'], counts['folders'], counts['bytes'])
+    write_json(report_file, report, indent=2)
+    stats.save()
     
     # Skriv ut rapport
     print(f"📊 BACKUP-RAPPORT ({BACKUP_DATE}):")
@@ -727,22 +1770,88 @@ def generate_backup_report():
     
     return report
 
+def parse_args():
+    """Les kommandolinjeargumenter"""
+    parser = argparse.ArgumentParser(description="Strukturert Shopify backup")
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="Hent kun objekter endret siden forrige fullførte synk (updated_at_min fra analytics.sync_status)"
+    )
+    parser.add_argument(
+        '--bulk',
+        action='store_true',
+        help="Eksporter produkter og ordrer med GraphQL Bulk Operations i stedet for REST-paginering"
+    )
+    parser.add_argument(
+        '--format',
+        choices=['folders', 'archive'],
+        default=BACKUP_FORMAT,
+        help="folders: én JSON-fil per objekt med pekermapper; archive: komprimerte JSONL-shards med indeks (standard fra BACKUP_FORMAT)"
+    )
+    parser.add_argument(
+        '--verify-report',
+        action='store_true',
+        help="Tell filene på disk på nytt (os.scandir, parallelt per kategori) i stedet for å stole på tellerne"
+    )
+    return parser.parse_args()
+
+def build_sync_scheduler(args):
+    """
+    Sett opp synk-jobbene. Produkter avhenger av collections og kjøpernavn
+    av ordrer og kunder; resten kjører samtidig og deler RATE_LIMITER.
+    """
+    scheduler = SyncScheduler(max_workers=SYNC_WORKERS)
+    scheduler.add(
+        'collections',
+        lambda deps: fetch_and_organize_collections(incremental=args.incremental)
+    )
+    scheduler.add(
+        'products',
+        lambda deps: fetch_and_organize_products(deps['collections'], incremental=args.incremental, bulk=args.bulk),
+        depends_on=['collections']
+    )
+    # Shopify kjører kun én bulk-operasjon om gangen, så ordrene venter på produktene i bulk-modus
+    scheduler.add(
+        'orders',
+        lambda deps: fetch_and_organize_orders(incremental=args.incremental, bulk=args.bulk),
+        depends_on=['products'] if args.bulk else []
+    )
+    scheduler.add('customers', lambda deps: fetch_and_organize_customers(incremental=args.incremental))
+    # Kjøpernavn i royalty-ledgeren oppdateres først når både ordrer og kunder er lagret
+    scheduler.add(
+        'buyer_names',
+        lambda deps: refresh_royalty_buyer_names(),
+        depends_on=['orders', 'customers']
+    )
+    scheduler.add('shop_settings', lambda deps: fetch_shop_settings())
+    return scheduler
+
 def main():
     """Hovedfunksjon - kjør strukturert backup"""
+    args = parse_args()
     start_time = datetime.now()
     print(f"🚀 STARTER STRUKTURERT SHOPIFY BACKUP - {start_time}")
+    if args.incremental:
+        print("🔁 Modus: inkrementell")
+    if args.bulk:
+        print("🚚 Modus: GraphQL bulk-eksport")
     print(f"📁 Backup-mappe: {BACKUP_BASE_DIR}")
+    ensure_backup_dirs()
+    configure_archive(args.format)
     print("=" * 80)
     
     try:
-        # Hent og organiser alt
-        collections = fetch_and_organize_collections()
-        products = fetch_and_organize_products(collections)
-        orders = fetch_and_organize_orders()
-        settings = fetch_shop_settings()
+        # Hent og organiser alt, uavhengige ressurser samtidig
+        scheduler = build_sync_scheduler(args)
+        scheduler.run()
+        scheduler.print_summary()
+        finish_media_downloads()
+        finish_archive()
+        finish_backup_index()
         
         # Generer rapport
-        report = generate_backup_report()
+        report = generate_backup_report(scheduler.summary(), verify=args.verify_report)
         
         # Lag symbolsk lenke til siste backup
         latest_link = os.path.join(os.path.dirname(BACKUP_BASE_DIR), 'latest')
@@ -759,11 +1868,15 @@ def main():
         print(f"📁 Lokasjon: {BACKUP_BASE_DIR}")
         print(f"🔗 Latest: {latest_link}")
         print(f"💾 Total størrelse: {report['total_size_mb']:.1f} MB")
+        if scheduler.failed:
+            print(f"⚠️  Jobber som ikke ble fullført: {', '.join(scheduler.failed)}")
         
     except Exception as e:
         print(f"❌ KRITISK FEIL: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        close_pool()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
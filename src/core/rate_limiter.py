@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+RATE LIMITER FOR SHOPIFY API
+Leaky bucket som følger det faktiske API-budsjettet fra Shopify
+(X-Shopify-Shop-Api-Call-Limit for REST, extensions.cost for GraphQL)
+i stedet for faste pauser. Trådsikker, slik at flere synk-jobber kan
+dele samme budsjett.
+"""
+import threading
+import time
+
+class ShopifyRateLimiter:
+    """Delt leaky bucket for alle Shopify-kall"""
+
+    def __init__(self, capacity=40, leak_rate=None, safety_margin=2, graphql_capacity=1000.0, graphql_restore_rate=50.0):
+        # REST: bøtte på 40 kall som lekker 2 kall/s (Plus: 80 og 4/s)
+        self.capacity = capacity
+        self.leak_rate = leak_rate or capacity / 20.0
+        self.safety_margin = safety_margin
+        self._used = 0.0
+        self._updated = time.monotonic()
+
+        # GraphQL: kostnadspoeng som fylles opp med restore_rate per sekund
+        self.graphql_capacity = graphql_capacity
+        self.graphql_restore_rate = graphql_restore_rate
+        self._graphql_available = graphql_capacity
+        self._graphql_updated = time.monotonic()
+
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'throttled': 0,
+            'waited_seconds': 0.0
+        }
+
+    def _leak(self, now):
+        """Oppdater estimert fyllingsgrad ut fra tiden siden siste oppdatering"""
+        elapsed = now - self._updated
+        self._used = max(0.0, self._used - elapsed * self.leak_rate)
+        self._updated = now
+
+    def acquire(self):
+        """Vent til det er plass i bøtta, og reserver ett REST-kall"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._leak(now)
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    free = self.capacity - self.safety_margin - self._used
+                    if free >= 1:
+                        self._used += 1
+                        self.stats['requests'] += 1
+                        return
+                    wait = (1 - free) / self.leak_rate
+                self.stats['waited_seconds'] += wait
+            time.sleep(wait)
+
+    def update_from_response(self, response):
+        """Synkroniser bøtta med X-Shopify-Shop-Api-Call-Limit (f.eks. '32/40')"""
+        header = response.headers.get('X-Shopify-Shop-Api-Call-Limit')
+        if not header or '/' not in header:
+            return
+        try:
+            used, capacity = (int(part) for part in header.split('/', 1))
+        except ValueError:
+            return
+        with self._lock:
+            self._leak(time.monotonic())
+            if capacity != self.capacity:
+                self.capacity = capacity
+                self.leak_rate = capacity / 20.0
+            # Andre apper deler samme bøtte, så headeren kan vise mer enn vi har reservert.
+            # Våre egne reservasjoner for kall som ennå ikke er besvart holdes også med.
+            self._used = max(self._used, float(used))
+
+    def backoff(self, response, default_delay=2.0):
+        """Respekter Retry-After etter 429 og returner ventetiden"""
+        retry_after = response.headers.get('Retry-After')
+        try:
+            delay = float(retry_after) if retry_after else default_delay
+        except ValueError:
+            delay = default_delay
+        with self._lock:
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + delay)
+            self._used = float(self.capacity)
+            self._updated = now
+            self.stats['throttled'] += 1
+        return delay
+
+    def acquire_graphql(self, cost):
+        """Vent til GraphQL-budsjettet har plass til et kall med gitt kostnad"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                elapsed = now - self._graphql_updated
+                self._graphql_available = min(
+                    self.graphql_capacity,
+                    self._graphql_available + elapsed * self.graphql_restore_rate
+                )
+                self._graphql_updated = now
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self._graphql_available >= cost:
+                        self._graphql_available -= cost
+                        self.stats['requests'] += 1
+                        return
+                    wait = (cost - self._graphql_available) / self.graphql_restore_rate
+                self.stats['waited_seconds'] += wait
+            time.sleep(wait)
+
+    def update_from_graphql_cost(self, payload):
+        """Synkroniser GraphQL-budsjettet med extensions.cost.throttleStatus"""
+        cost = (payload or {}).get('extensions', {}).get('cost', {})
+        status = cost.get('throttleStatus')
+        if not status:
+            return
+        with self._lock:
+            self.graphql_capacity = float(status.get('maximumAvailable', self.graphql_capacity))
+            self.graphql_restore_rate = float(status.get('restoreRate', self.graphql_restore_rate))
+            self._graphql_available = float(status.get('currentlyAvailable', self._graphql_available))
+            self._graphql_updated = time.monotonic()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+SYNK-PLANLEGGER FOR SHOPIFY BACKUP
+Kjører synk-jobber (collections, produkter, ordrer, innstillinger ...)
+samtidig i en trådpool, men starter en jobb først når jobbene den avhenger
+av er ferdige. Alle jobber deler samme rate limiter via safe_request.
+En jobb som feiler stopper kun jobbene som avhenger av den.
+"""
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class SyncJob:
+    """Én synk-jobb med avhengigheter, resultat og tidtaking"""
+
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+        self.status = 'pending'
+        self.result = None
+        self.error = None
+        self.started = None
+        self.duration = None
+
+    def summary(self):
+        return {
+            'status': self.status,
+            'depends_on': self.depends_on,
+            'duration_seconds': round(self.duration, 2) if self.duration is not None else None,
+            'error': self.error
+        }
+
+class SyncScheduler:
+    """Avhengighetsstyrt kjøring av synk-jobber"""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.jobs = {}
+        self.duration = None
+
+    def add(self, name, func, depends_on=()):
+        """
+        Registrer en jobb. func kalles med et dict av resultatene til
+        jobbene den avhenger av. Avhengigheter må være lagt til først,
+        så jobbgrafen kan ikke få sykler.
+        """
+        for dependency in depends_on:
+            if dependency not in self.jobs:
+                raise ValueError(f"Ukjent avhengighet '{dependency}' for jobb '{name}'")
+        self.jobs[name] = SyncJob(name, func, depends_on)
+        return self.jobs[name]
+
+    def _run_job(self, job):
+        job.started = time.monotonic()
+        job.status = 'running'
+        print(f"▶️  Starter jobb: {job.name}")
+        try:
+            dependencies = {name: self.jobs[name].result for name in job.depends_on}
+            job.result = job.func(dependencies)
+            job.status = 'completed'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+            print(f"❌ Jobb {job.name} feilet: {e}")
+            traceback.print_exc()
+        finally:
+            job.duration = time.monotonic() - job.started
+        print(f"⏹️  Jobb {job.name}: {job.status} på {job.duration:.1f}s")
+        return job
+
+    def _ready_jobs(self):
+        """Finn jobber som kan startes; jobber med feilede avhengigheter hoppes over"""
+        ready = []
+        # Jobbene står i avhengighetsrekkefølge, så hopp over forplanter seg i én gjennomgang
+        for job in self.jobs.values():
+            if job.status != 'pending':
+                continue
+            states = [self.jobs[name].status for name in job.depends_on]
+            if any(state in ('failed', 'skipped') for state in states):
+                job.status = 'skipped'
+                job.error = 'avhengighet feilet: ' + ', '.join(
+                    name for name in job.depends_on if self.jobs[name].status in ('failed', 'skipped')
+                )
+                print(f"⏭️  Hopper over jobb {job.name} ({job.error})")
+                continue
+            if all(state == 'completed' for state in states):
+                ready.append(job)
+        return ready
+
+    def run(self):
+        """Kjør alle jobber og returner {navn: resultat} for fullførte jobber"""
+        started = time.monotonic()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sync') as executor:
+            while True:
+                for job in self._ready_jobs():
+                    job.status = 'queued'
+                    running[executor.submit(self._run_job, job)] = job
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+
+        self.duration = time.monotonic() - started
+        return {name: job.result for name, job in self.jobs.items() if job.status == 'completed'}
+
+    def summary(self):
+        """Status og varighet per jobb"""
+        return {name: job.summary() for name, job in self.jobs.items()}
+
+    def print_summary(self):
+        """Skriv ut tidtaking per jobb"""
+        print("\n⏱️  SYNK-JOBBER:")
+        for name, job in self.jobs.items():
+            duration = f"{job.duration:.1f}s" if job.duration is not None else "-"
+            print(f"   {name:15}: {job.status:10} {duration:>8}")
+        total = sum(job.duration or 0 for job in self.jobs.values())
+        print(f"   {'Veggtid':15}: {self.duration:.1f}s (sum av jobber {total:.1f}s)")
+
+    @property
+    def failed(self):
+        return [name for name, job in self.jobs.items() if job.status in ('failed', 'skipped')]
@@ -4,18 +4,45 @@ Regner ut 20% royalty av produktverdi eks. mva for alle ordrer i august 2025
 """ 
 
 import os
-import psycopg2
+import sys
 from dotenv import load_dotenv
 from datetime import datetime, date
 import json
 
+# Felles database-modul ligger sammen med backup-skriptet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+from database import get_db_connection, release_db_connection
+
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-POSTGRES_DB = os.getenv('POSTGRES_DB')
-POSTGRES_USER = os.getenv('POSTGRES_USER')
-POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD')
-POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-POSTGRES_PORT = os.getenv('POSTGRES_PORT', '5433')
+VENDOR_NAME = os.getenv('VENDOR_NAME', 'your-vendor-name').lower()
+
+def fetch_royalty_lines(cursor, start_date, end_date, vendor_name):
+    """
+    Hent ferdig beregnede royalty-linjer for vendor i perioden fra
+    analytics.royalty_ledger (vedlikeholdes ved lagring av ordrer).
+    """
+    cursor.execute("""
+        SELECT order_id, order_created_at, shipping_ex_vat, customer_name, customer_email,
+               product_name, price_ex_vat, royalty_percent, royalty_amount
+        FROM analytics.royalty_ledger
+        WHERE lower(vendor) = %s AND period_month >= %s AND period_month < %s
+        ORDER BY order_created_at, order_id, line_position
+    """, (vendor_name, start_date, end_date))
+    return cursor.fetchall()
+
+def fetch_shipping_total(cursor, start_date, end_date):
+    """Sum frakt eks. mva for alle ordrer i perioden"""
+    cursor.execute("""
+        SELECT COALESCE(SUM(COALESCE(
+            total_shipping_price,
+            (raw_data->'total_shipping_price_set'->'shop_money'->>'amount')::numeric,
+            0
+        )), 0) / 1.25
+        FROM orders
+        WHERE created_at >= %s AND created_at < %s
+    """, (start_date, end_date))
+    return float(cursor.fetchone()[0])
 
 # Finn inneværende måned (eller bruk ønsket måned via env/argument)
 today = date.today()
@@ -28,25 +55,21 @@ else:
     end_date = f"{year}-{month+1:02d}-01"
 json_filename = f"royalty_report_{year}-{month:02d}.json"
 
-conn = psycopg2.connect(
-    dbname=POSTGRES_DB,
-    user=POSTGRES_USER,
-    password=POSTGRES_PASSWORD,
-    host=POSTGRES_HOST,
-    port=POSTGRES_PORT
-)
+# Synk endrede ordrer for måneden fra Shopify før ledgeren leses (hopp over med --no-sync)
+if '--no-sync' not in sys.argv:
+    from organized_shopify_backup import sync_orders_for_period
+    if not sync_orders_for_period(date(year, month, 1), date.fromisoformat(end_date))['complete']:
+        print("⚠️  Synken ble ikke fullført, rapporten bygger på data fra forrige synk.")
+
+conn = get_db_connection()
+if conn is None:
+    sys.exit(1)
 cursor = conn.cursor()
 
 
-# Hent alle ordrer for valgt måned, kun for din spesifiserte vendor
+# Hent alle ordrelinjer for valgt måned, kun for din spesifiserte vendor
 # Konfigurer VENDOR_NAME i .env filen
-cursor.execute(
-    "SELECT o.id, o.created_at, o.subtotal_price, o.total_shipping_price, o.total_tax, o.raw_data, c.first_name, c.last_name, c.email "
-    "FROM orders o LEFT JOIN customers c ON o.customer_id = c.id "
-    f"WHERE o.created_at >= '{start_date}' AND o.created_at < '{end_date}' "
-    "ORDER BY o.created_at"
-)
-orders = cursor.fetchall()
+lines = fetch_royalty_lines(cursor, start_date, end_date, VENDOR_NAME)
 
 
 
@@ -65,7 +88,7 @@ json_rows = []
 
 
 royalty_total = 0.0
-frakt_total_eks = 0.0
+frakt_total_eks = fetch_shipping_total(cursor, start_date, end_date)
 utbetalt_total = 0.0
 order_count = 0
 
@@ -75,55 +98,36 @@ order_count = 0
 
 
 
-for order in orders:
-    order_id, created_at, subtotal_price, shipping, tax, raw_data, first_name, last_name, email = order
-    raw = raw_data if isinstance(raw_data, dict) else json.loads(raw_data)
-    kjøper = f"{first_name or ''} {last_name or ''}".strip()
+for line in lines:
+    order_id, created_at, frakt_eks, kjøper, epost, produktnavn, pris_eks_mva, royalty_percent, royalty = line
     tidspunkt = created_at.strftime("%Y-%m-%d %H:%M") if created_at else ""
-    frakt_inkl = float(shipping or 0)
-    frakt_eks = frakt_inkl / 1.25 if frakt_inkl else 0
-    frakt_total_eks += frakt_eks
-    epost = email or ''
-    # For hver line item i ordren
-    for li in raw.get("line_items", []):
-        # Sjekk vendor
-        vendor_name = os.getenv('VENDOR_NAME', 'your-vendor-name').lower()
-        if li.get("vendor", "").lower() != vendor_name:
-            continue
-        produktnavn = li.get("title", "")
-        pris = float(li.get("price", 0)) * int(li.get("quantity", 1))
-        # Hent royalty_percent fra products-tabellen
-        product_id = li.get("product_id")
-        royalty_percent = 20.0
-        if product_id:
-            cursor2 = conn.cursor()
-            cursor2.execute("SELECT royalty_percent FROM products WHERE id = %s", (product_id,))
-            res = cursor2.fetchone()
-            if res and res[0] is not None:
-                royalty_percent = float(res[0])
-            cursor2.close()
-        pris_eks_mva = pris / 1.25 if pris else 0
-        royalty = pris_eks_mva * (royalty_percent / 100.0)
-        utbetalt = pris_eks_mva - royalty
-        royalty_total += royalty
-        utbetalt_total += utbetalt
-        total_eks = pris_eks_mva + frakt_eks
-        print(f"{str(order_id):<10} {tidspunkt:<17} {pris_eks_mva:>10.2f} {frakt_eks:>10.2f} {royalty_percent:>9.2f} {royalty:>10.2f} {utbetalt:>10.2f} {total_eks:>10.2f} "
-              f"{kjøper:<25} {produktnavn:<30} {epost:<30}")
-        json_rows.append({
-            "order_id": order_id,
-            "created_at": tidspunkt,
-            "product_name": produktnavn,
-            "customer": kjøper,
-            "email": epost,
-            "price_ex_vat": round(pris_eks_mva,2),
-            "shipping_ex_vat": round(frakt_eks,2),
-            "royalty_percent": round(royalty_percent,2),
-            "royalty": round(royalty,2),
-            "fladby3d": round(utbetalt,2),
-            "total_ex_vat": round(total_eks,2)
-        })
-        order_count += 1
+    frakt_eks = float(frakt_eks or 0)
+    kjøper = kjøper or ""
+    epost = epost or ""
+    produktnavn = produktnavn or ""
+    pris_eks_mva = float(pris_eks_mva or 0)
+    royalty_percent = float(royalty_percent)
+    royalty = float(royalty or 0)
+    utbetalt = pris_eks_mva - royalty
+    royalty_total += royalty
+    utbetalt_total += utbetalt
+    total_eks = pris_eks_mva + frakt_eks
+    print(f"{str(order_id):<10} {tidspunkt:<17} {pris_eks_mva:>10.2f} {frakt_eks:>10.2f} {royalty_percent:>9.2f} {royalty:>10.2f} {utbetalt:>10.2f} {total_eks:>10.2f} "
+          f"{kjøper:<25} {produktnavn:<30} {epost:<30}")
+    json_rows.append({
+        "order_id": order_id,
+        "created_at": tidspunkt,
+        "product_name": produktnavn,
+        "customer": kjøper,
+        "email": epost,
+        "price_ex_vat": round(pris_eks_mva,2),
+        "shipping_ex_vat": round(frakt_eks,2),
+        "royalty_percent": round(royalty_percent,2),
+        "royalty": round(royalty,2),
+        "fladby3d": round(utbetalt,2),
+        "total_ex_vat": round(total_eks,2)
+    })
+    order_count += 1
 
 
 
@@ -138,4 +142,4 @@ with open(json_filename, "w", encoding="utf-8") as f:
 print(f"Skrev JSON-rapport: {json_filename}")
 
 cursor.close()
-conn.close()
+release_db_connection(conn)
@@ -1,16 +1,17 @@
 import os
-import psycopg2
-import json
+import sys
+import argparse
 from fpdf import FPDF
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date
+
+# Felles database-modul ligger sammen med backup-skriptet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+from database import pooled_connection
+from report_stream import iter_named_cursor, StreamingJSONWriter
+from report_upload import upload_reports, failed_uploads
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-DB_PORT = os.getenv('POSTGRES_PORT', '5432')
-DB_NAME = os.getenv('POSTGRES_DB', 'shopify')
-DB_USER = os.getenv('POSTGRES_USER', 'shopifyuser')
-DB_PASS = os.getenv('POSTGRES_PASSWORD', '')
 
 REPORT_DIR = os.path.join(os.path.dirname(__file__), 'rapporter')
 os.makedirs(REPORT_DIR, exist_ok=True)
@@ -30,9 +31,12 @@ class PDFReport(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Side {self.page_no()}', align='C')
 
-    def add_month_table(self, month, rows):
+    def add_month_header(self, month):
         self.set_font('Arial', 'B', 12)
         self.cell(0, 10, f'Måned: {month}', ln=True)
+        self.add_table_header()
+
+    def add_table_header(self):
         self.set_font('Arial', '', 10)
         self.cell(40, 8, 'OrdreID', 1)
         self.cell(40, 8, 'Vendor', 1)
@@ -40,75 +44,131 @@ class PDFReport(FPDF):
         self.cell(30, 8, 'Pris', 1)
         self.cell(20, 8, 'Antall', 1)
         self.ln()
+
+    def add_sales_row(self, row):
+        # Ny side med tabellhode når raden ikke får plass
+        if self.get_y() + 8 > self.page_break_trigger:
+            self.add_page(self.cur_orientation)
+            self.add_table_header()
+        self.cell(40, 8, str(row['order_id']), 1)
+        self.cell(40, 8, row['vendor'], 1)
+        self.cell(40, 8, row['title'][:18], 1)
+        self.cell(30, 8, f"{row['price']:.2f}", 1)
+        self.cell(20, 8, str(row['quantity']), 1)
+        self.ln()
+
+    def add_month_table(self, month, rows):
+        self.add_month_header(month)
         for row in rows:
-            self.cell(40, 8, str(row['order_id']), 1)
-            self.cell(40, 8, row['vendor'], 1)
-            self.cell(40, 8, row['title'][:18], 1)
-            self.cell(30, 8, f"{row['price']:.2f}", 1)
-            self.cell(20, 8, str(row['quantity']), 1)
-            self.ln()
+            self.add_sales_row(row)
         self.ln(5)
 
-def fetch_monthly_sales(conn, year):
-    sales = {m: [] for m in MONTHS}
-    with conn.cursor() as cur:
-        for month in MONTHS:
-            cur.execute('''
-                SELECT li.order_id, li.vendor, li.title, li.price, li.quantity, o.created_at
-                FROM line_items li
-                JOIN orders o ON li.order_id = o.id
-                WHERE EXTRACT(YEAR FROM o.created_at) = %s AND EXTRACT(MONTH FROM o.created_at) = %s
-                ORDER BY o.created_at ASC
-            ''', (year, int(month)))
-            for row in cur.fetchall():
-                sales[month].append({
-                    'order_id': row[0],
-                    'vendor': row[1] or '',
-                    'title': row[2] or '',
-                    'price': float(row[3]),
-                    'quantity': int(row[4]),
-                    'created_at': row[5].strftime('%Y-%m-%d')
-                })
-    return sales
-
-def save_json_report(sales, year):
-    for month, rows in sales.items():
-        filename = os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.json')
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(rows, f, ensure_ascii=False, indent=2)
-
-def save_pdf_report(sales, year):
-    for month, rows in sales.items():
-        pdf = PDFReport()
-        pdf.title = f'Salgsrapport {year}-{month}'
-        pdf.add_page()
-        pdf.add_month_table(month, rows)
-        filename = os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.pdf')
-        pdf.output(filename)
+SALES_QUERY = '''
+    SELECT li.order_id, li.vendor, li.title, li.price, li.quantity, o.created_at
+    FROM order_line_items li
+    JOIN orders o ON li.order_id = o.id
+    WHERE o.created_at >= %s AND o.created_at < %s
+    ORDER BY o.created_at ASC
+'''
+
+def sales_row(row):
+    return {
+        'order_id': row[0],
+        'vendor': row[1] or '',
+        'title': row[2] or '',
+        'price': float(row[3]),
+        'quantity': int(row[4]),
+        'created_at': row[5].strftime('%Y-%m-%d')
+    }
+
+class SalesMonthReport:
+    """JSON- og PDF-salgsrapport for én måned, skrevet samtidig rad for rad"""
+
+    def __init__(self, year, month):
+        self.month = month
+        self.pdf_path = os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.pdf')
+        self.json = StreamingJSONWriter(os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.json'))
+        self.pdf = PDFReport()
+        self.pdf.title = f'Salgsrapport {year}-{month}'
+        self.pdf.add_page()
+        self.pdf.add_month_header(month)
+
+    def add(self, row):
+        self.json.write_row(row)
+        self.pdf.add_sales_row(row)
+
+    def close(self):
+        self.json.close()
+        self.pdf.ln(5)
+        self.pdf.output(self.pdf_path)
+        return self.json.rows
+
+    def abort(self):
+        self.json.abort()
+
+def write_sales_reports(conn, year):
+    """
+    Strømmer årets salgslinjer fra en navngitt cursor (filtrert på
+    created_at, så idx_orders_created_at brukes) og skriver JSON og PDF per
+    måned etter hvert. Alle måneder får rapport, også de uten salg.
+    Returnerer {måned: antall linjer}.
+    """
+    counts = {}
+    report = None
+    try:
+        rows = iter_named_cursor(conn, 'sales_report_rows', SALES_QUERY, (date(year, 1, 1), date(year + 1, 1, 1)))
+        for row in rows:
+            month = row[5].strftime('%m')
+            if report is None or report.month != month:
+                if report is not None:
+                    counts[report.month] = report.close()
+                report = SalesMonthReport(year, month)
+            report.add(sales_row(row))
+        if report is not None:
+            counts[report.month] = report.close()
+            report = None
+    finally:
+        if report is not None:
+            report.abort()
+    
+    for month in MONTHS:
+        if month not in counts:
+            counts[month] = SalesMonthReport(year, month).close()
+    return counts
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Salgsrapporter per måned")
+    parser.add_argument('--no-sync', action='store_true', help="Ikke synk endrede ordrer fra Shopify først")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
     year = 2025
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
-    sales = fetch_monthly_sales(conn, year)
-    save_json_report(sales, year)
-    save_pdf_report(sales, year)
-    conn.close()
+
+    # Først synkroniser endrede ordrer for året fra Shopify
+    if not args.no_sync:
+        from organized_shopify_backup import sync_orders_for_period
+        print("Synkroniserer endrede ordrer fra Shopify...")
+        if not sync_orders_for_period(date(year, 1, 1), date(year + 1, 1, 1))['complete']:
+            print("⚠️  Synken ble ikke fullført, rapportene bygger på data fra forrige synk.")
+
+    with pooled_connection() as conn:
+        write_sales_reports(conn, year)
     print(f"Rapporter generert for {year} i mappen 'rapporter'.")
 
-    # Last opp rapporter til konfigurerbar cloud storage
+    # Last opp rapporter til konfigurerbar cloud storage, alle i én batch
     cloud_path = os.getenv('CLOUD_STORAGE_PATH', 'your-cloud-path/reports/')
-    for month in MONTHS:
-        json_file = os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.json')
-        pdf_file = os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.pdf')
-        os.system(f"rclone copy '{json_file}' '{cloud_path}'")
-        os.system(f"rclone copy '{pdf_file}' '{cloud_path}'")
+    files = [
+        os.path.join(REPORT_DIR, f'sales_report_{year}-{month}.{extension}')
+        for month in MONTHS
+        for extension in ('json', 'pdf')
+    ]
+    failed = failed_uploads(upload_reports(files, cloud_path))
+    if failed:
+        print(f"❌ {len(failed)} filer ble ikke lastet opp for {year}.")
+        return 1
     print(f"Rapporter for {year} er lastet opp til cloud storage under '{cloud_path}'.")
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
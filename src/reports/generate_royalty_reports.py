@@ -4,18 +4,20 @@ Genererer royalty-rapporter fra Shopify-data lagret i PostgreSQL.
 Rapportene matches med layoutet fra royalty_report_2025-09.pdf
 """
 import os
-import psycopg2
-import json
+import sys
+import argparse
 from fpdf import FPDF
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, date
+
+# Felles database-modul ligger sammen med backup-skriptet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+from database import pooled_connection
+from report_stream import iter_named_cursor, RunningTotals, StreamingJSONWriter
+from report_cache import ReportCache, fingerprint
+from report_upload import upload_reports, failed_uploads
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env'))
-DB_HOST = os.getenv('POSTGRES_HOST', 'localhost')
-DB_PORT = os.getenv('POSTGRES_PORT', '5432')
-DB_NAME = os.getenv('POSTGRES_DB', 'shopify')
-DB_USER = os.getenv('POSTGRES_USER', 'shopifyuser')
-DB_PASS = os.getenv('POSTGRES_PASSWORD', '')
 
 REPORT_DIR = os.path.join(os.path.dirname(__file__), 'royalty_rapporter')
 os.makedirs(REPORT_DIR, exist_ok=True)
@@ -24,6 +26,58 @@ MONTHS = [
     '01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12'
 ]
 
+# Økes når layout eller beregninger i rapportene endres, så cachen lager alt på nytt
+REPORT_TEMPLATE_VERSION = 1
+
+# Kolonner i royalty-tabellen (matcher layoutet i PDF-malen)
+ROYALTY_HEADERS = ['OrdreID', 'Kjøpsdato', 'Pris eks mva', 'Frakt eks', 'Royalty %', 'Royalty', 'Fradrag30', 'Total eks', 'Kjøper', 'Produktnavn', 'e-post']
+ROYALTY_WIDTHS = [18, 22, 18, 16, 14, 16, 16, 16, 25, 35, 30]
+
+# Summene nederst i rapporten: navn -> kolonne
+ROYALTY_TOTALS = {
+    'sum_frakt_eks': 'frakt_eks',
+    'sum_royalty': 'royalty',
+    'sum_fradrag30': 'fradrag30'
+}
+
+ROYALTY_QUERY = '''
+    SELECT 
+        order_id,
+        order_created_at::date as kjopsdato,
+        ROUND(price_ex_vat, 2) as pris_eks_mva,
+        ROUND(shipping_ex_vat, 2) as frakt_eks,
+        royalty_percent as royalty_pct,
+        ROUND(royalty_amount, 2) as royalty,
+        ROUND(price_ex_vat * 0.30, 2) as fradrag30,
+        ROUND(price_ex_vat - (price_ex_vat * 0.30), 2) as total_eks,
+        COALESCE(NULLIF(customer_name, ''), customer_email, 'Ukjent kunde') as kjoper,
+        COALESCE(product_name, '') as produktnavn,
+        COALESCE(customer_email, '') as epost
+    FROM analytics.royalty_ledger
+    WHERE period_month >= %s AND period_month < %s{vendor_filter}
+    ORDER BY order_created_at ASC, order_id, line_position
+'''
+
+# Hash av alt som påvirker en rapport, per (vendor, måned). Ordrens updated_at
+# fanger refusjoner og endringer som kommer etter at måneden er avsluttet.
+# Vendor grupperes uten store/små bokstaver; min(vendor) er visningsnavnet.
+ROYALTY_INPUT_QUERY = '''
+    SELECT
+        lower(l.vendor),
+        to_char(l.period_month, 'MM'),
+        COUNT(*),
+        md5(string_agg(
+            concat_ws('|', l.order_id, l.line_item_id, o.updated_at, l.royalty_percent, l.royalty_amount,
+                      l.price_ex_vat, l.shipping_ex_vat, l.customer_name, l.customer_email, l.product_name),
+            ',' ORDER BY l.order_id, l.line_item_id
+        )),
+        min(l.vendor)
+    FROM analytics.royalty_ledger l
+    LEFT JOIN shopify.orders o ON o.id = l.order_id
+    WHERE l.period_month >= %s AND l.period_month < %s{vendor_filter}
+    GROUP BY 1, 2
+'''
+
 class RoyaltyPDFReport(FPDF):
     def header(self):
         self.set_font('Arial', 'B', 12)
@@ -35,33 +89,36 @@ class RoyaltyPDFReport(FPDF):
         self.set_font('Arial', 'I', 8)
         self.cell(0, 10, f'Side {self.page_no()}', align='C')
 
-    def add_royalty_table(self, month, rows, totals):
+    def add_royalty_header(self):
         # Header tabellen som i PDF
         self.set_font('Arial', 'B', 8)
-        headers = ['OrdreID', 'Kjøpsdato', 'Pris eks mva', 'Frakt eks', 'Royalty %', 'Royalty', 'Fradrag30', 'Total eks', 'Kjøper', 'Produktnavn', 'e-post']
-        widths = [18, 22, 18, 16, 14, 16, 16, 16, 25, 35, 30]
-        
-        for i, header in enumerate(headers):
-            self.cell(widths[i], 8, header, 1, 0, 'C')
+        for header, width in zip(ROYALTY_HEADERS, ROYALTY_WIDTHS):
+            self.cell(width, 8, header, 1, 0, 'C')
         self.ln()
-        
-        # Data rader
         self.set_font('Arial', '', 7)
-        for row in rows:
-            self.cell(widths[0], 6, str(row['order_id']), 1)
-            self.cell(widths[1], 6, row['kjopsdato'], 1)
-            self.cell(widths[2], 6, f"{row['pris_eks_mva']:.2f}", 1)
-            self.cell(widths[3], 6, f"{row['frakt_eks']:.2f}", 1)
-            self.cell(widths[4], 6, f"{row['royalty_pct']:.0f}", 1)
-            self.cell(widths[5], 6, f"{row['royalty']:.2f}", 1)
-            self.cell(widths[6], 6, f"{row['fradrag30']:.2f}", 1)
-            self.cell(widths[7], 6, f"{row['total_eks']:.2f}", 1)
-            self.cell(widths[8], 6, row['kjoper'][:23], 1)
-            self.cell(widths[9], 6, row['produktnavn'][:33], 1)
-            self.cell(widths[10], 6, row['epost'][:28], 1)
-            self.ln()
-        
+
+    def add_royalty_row(self, row):
+        # Ny side med tabellhode når raden ikke får plass
+        if self.get_y() + 6 > self.page_break_trigger:
+            self.add_page(self.cur_orientation)
+            self.add_royalty_header()
+        widths = ROYALTY_WIDTHS
+        self.cell(widths[0], 6, str(row['order_id']), 1)
+        self.cell(widths[1], 6, row['kjopsdato'], 1)
+        self.cell(widths[2], 6, f"{row['pris_eks_mva']:.2f}", 1)
+        self.cell(widths[3], 6, f"{row['frakt_eks']:.2f}", 1)
+        self.cell(widths[4], 6, f"{row['royalty_pct']:.0f}", 1)
+        self.cell(widths[5], 6, f"{row['royalty']:.2f}", 1)
+        self.cell(widths[6], 6, f"{row['fradrag30']:.2f}", 1)
+        self.cell(widths[7], 6, f"{row['total_eks']:.2f}", 1)
+        self.cell(widths[8], 6, row['kjoper'][:23], 1)
+        self.cell(widths[9], 6, row['produktnavn'][:33], 1)
+        self.cell(widths[10], 6, row['epost'][:28], 1)
+        self.ln()
+
+    def add_royalty_totals(self, totals):
         # Summer nederst som i PDF
+        widths = ROYALTY_WIDTHS
         self.ln(2)
         self.set_font('Arial', 'B', 9)
         self.cell(widths[0] + widths[1], 8, f"SUM Frakt eks mva: {totals['sum_frakt_eks']:.2f}", 0)
@@ -69,125 +126,220 @@ class RoyaltyPDFReport(FPDF):
         self.cell(widths[5] + widths[6], 8, f"SUM Fradrag30: {totals['sum_fradrag30']:.2f}", 0)
         self.ln()
 
-def fetch_royalty_data(conn, year):
-    """Henter royalty-data fra database med alle nødvendige felter"""
-    royalty_data = {m: [] for m in MONTHS}
-    
-    with conn.cursor() as cur:
-        for month in MONTHS:
-            query = '''
-                SELECT 
-                    o.id as order_id,
-                    o.created_at::date as kjopsdato,
-                    li.price as pris_eks_mva,
-                    COALESCE(o.total_shipping_price, 0) as frakt_eks,
-                    20 as royalty_pct,
-                    ROUND(li.price * 0.20, 2) as royalty,
-                    ROUND(li.price * 0.30, 2) as fradrag30,
-                    ROUND(li.price - (li.price * 0.30), 2) as total_eks,
-                    COALESCE(o.customer_email, 'Ukjent kunde') as kjoper,
-                    li.title as produktnavn,
-                    COALESCE(o.customer_email, '') as epost
-                FROM line_items li
-                JOIN orders o ON li.order_id = o.id
-                WHERE EXTRACT(YEAR FROM o.created_at) = %s 
-                  AND EXTRACT(MONTH FROM o.created_at) = %s
-                ORDER BY o.created_at ASC
-            '''
-            cur.execute(query, (year, int(month)))
-            
-            for row in cur.fetchall():
-                royalty_data[month].append({
-                    'order_id': row[0],
-                    'kjopsdato': row[1].strftime('%Y-%m-%d'),
-                    'pris_eks_mva': float(row[2]),
-                    'frakt_eks': float(row[3]),
-                    'royalty_pct': row[4],
-                    'royalty': float(row[5]),
-                    'fradrag30': float(row[6]),
-                    'total_eks': float(row[7]),
-                    'kjoper': str(row[8]),
-                    'produktnavn': str(row[9]),
-                    'epost': str(row[10])
-                })
-    
-    return royalty_data
+    def add_royalty_table(self, month, rows, totals):
+        self.add_royalty_header()
+        for row in rows:
+            self.add_royalty_row(row)
+        self.add_royalty_totals(totals)
 
-def calculate_totals(rows):
-    """Beregner summer for rapport"""
+def royalty_row(row):
+    """Gjør en rad fra ROYALTY_QUERY om til rapportens feltnavn"""
     return {
-        'sum_frakt_eks': sum(row['frakt_eks'] for row in rows),
-        'sum_royalty': sum(row['royalty'] for row in rows),
-        'sum_fradrag30': sum(row['fradrag30'] for row in rows)
+        'order_id': row[0],
+        'kjopsdato': row[1].strftime('%Y-%m-%d'),
+        'pris_eks_mva': float(row[2]),
+        'frakt_eks': float(row[3]),
+        'royalty_pct': float(row[4]),
+        'royalty': float(row[5]),
+        'fradrag30': float(row[6]),
+        'total_eks': float(row[7]),
+        'kjoper': str(row[8]),
+        'produktnavn': str(row[9]),
+        'epost': str(row[10])
     }
 
-def save_royalty_json_report(royalty_data, year):
-    """Lagrer JSON-rapporter"""
-    for month, rows in royalty_data.items():
-        if rows:  # Kun hvis det er data
-            totals = calculate_totals(rows)
-            report_data = {
-                'year': year,
-                'month': month,
-                'data': rows,
-                'totals': totals
-            }
-            filename = os.path.join(REPORT_DIR, f'royalty_report_{year}-{month}.json')
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(report_data, f, ensure_ascii=False, indent=2)
-
-def save_royalty_pdf_report(royalty_data, year):
-    """Lagrer PDF-rapporter som matcher vedlagt layout"""
-    for month, rows in royalty_data.items():
-        if rows:  # Kun hvis det er data
-            totals = calculate_totals(rows)
-            pdf = RoyaltyPDFReport()
-            company_name = os.getenv('COMPANY_NAME', 'Your Company')
-            pdf.title = f'Royaltyrapport for {year}-{month} ({company_name})'
-            pdf.add_page('L')  # Landscape for bedre plass
-            pdf.add_royalty_table(month, rows, totals)
-            filename = os.path.join(REPORT_DIR, f'royalty_report_{year}-{month}.pdf')
-            pdf.output(filename)
-
-def upload_to_cloud_storage(year):
-    """Laster opp rapporter til konfigurerbar cloud storage"""
-    cloud_path = os.getenv('CLOUD_STORAGE_PATH', 'your-cloud-path/reports/')
-    for month in MONTHS:
-        json_file = os.path.join(REPORT_DIR, f'royalty_report_{year}-{month}.json')
-        pdf_file = os.path.join(REPORT_DIR, f'royalty_report_{year}-{month}.pdf')
-        
-        if os.path.exists(json_file):
-            os.system(f"rclone copy '{json_file}' '{cloud_path}'")
-        if os.path.exists(pdf_file):
-            os.system(f"rclone copy '{pdf_file}' '{cloud_path}'")
+def royalty_report_files(year, month, output_dir=None):
+    """Stiene til JSON- og PDF-rapporten for en måned"""
+    output_dir = output_dir or REPORT_DIR
+    return (
+        os.path.join(output_dir, f'royalty_report_{year}-{month}.json'),
+        os.path.join(output_dir, f'royalty_report_{year}-{month}.pdf')
+    )
+
+class RoyaltyMonthReport:
+    """JSON- og PDF-rapport for én måned, skrevet samtidig rad for rad"""
+
+    def __init__(self, year, month, output_dir=None, vendor=None):
+        self.year = year
+        self.month = month
+        json_path, self.pdf_path = royalty_report_files(year, month, output_dir)
+        self.json = StreamingJSONWriter(json_path, header={'year': year, 'month': month})
+        self.totals = RunningTotals(ROYALTY_TOTALS)
+        self.pdf = RoyaltyPDFReport()
+        company_name = os.getenv('COMPANY_NAME', 'Your Company')
+        if vendor:
+            self.pdf.title = f'Royaltyrapport {vendor} for {year}-{month} ({company_name})'
+        else:
+            self.pdf.title = f'Royaltyrapport for {year}-{month} ({company_name})'
+        self.pdf.add_page('L')  # Landscape for bedre plass
+        self.pdf.add_royalty_header()
+
+    def add(self, row):
+        self.json.write_row(row)
+        self.pdf.add_royalty_row(row)
+        self.totals.add(row)
+
+    def close(self):
+        """Skriv summene og lagre begge filene; returnerer summene"""
+        totals = self.totals.as_dict()
+        self.json.close(totals=totals)
+        self.pdf.add_royalty_totals(totals)
+        self.pdf.output(self.pdf_path)
+        return totals
+
+    def abort(self):
+        self.json.abort()
+
+def write_royalty_range(conn, start_date, end_date, vendor=None, output_dir=None):
+    """
+    Strømmer royalty-linjene for [start_date, end_date) fra en navngitt
+    cursor og skriver JSON og PDF per måned etter hvert. Radene kommer
+    sortert på kjøpstidspunkt, så kun én måned er åpen om gangen. Med vendor
+    tas kun den vendorens linjer med (idx_royalty_ledger_vendor_month).
+    Måneder uten data får ingen rapport. Returnerer {måned: summer}.
+    """
+    params = [start_date, end_date]
+    vendor_filter = ''
+    if vendor:
+        vendor_filter = ' AND lower(vendor) = %s'
+        params.append(vendor.lower())
+    query = ROYALTY_QUERY.format(vendor_filter=vendor_filter)
+    
+    summaries = {}
+    report = None
+    try:
+        for row in iter_named_cursor(conn, 'royalty_report_rows', query, params):
+            month = row[1].strftime('%m')
+            if report is None or report.month != month:
+                if report is not None:
+                    summaries[report.month] = report.close()
+                report = RoyaltyMonthReport(start_date.year, month, output_dir=output_dir, vendor=vendor)
+            report.add(royalty_row(row))
+        if report is not None:
+            summaries[report.month] = report.close()
+            report = None
+    finally:
+        if report is not None:
+            report.abort()
+    return summaries
+
+def write_royalty_reports(conn, year, vendor=None, output_dir=None):
+    """Royalty-rapporter for alle måneder i et år"""
+    return write_royalty_range(conn, date(year, 1, 1), date(year + 1, 1, 1), vendor, output_dir)
+
+def write_royalty_month(conn, year, month, vendor=None, output_dir=None):
+    """Royalty-rapport for én måned ('MM'); returnerer summene eller None uten data"""
+    start_date = date(year, int(month), 1)
+    end_date = date(year + 1, 1, 1) if start_date.month == 12 else date(year, start_date.month + 1, 1)
+    return write_royalty_range(conn, start_date, end_date, vendor, output_dir).get(f"{int(month):02d}")
+
+def fetch_royalty_inputs(conn, year, vendors=None):
+    """
+    Inndata-hash per (vendor, måned) med royalty-linjer i året:
+    [{'vendor_key', 'vendor', 'month', 'rows', 'input_hash'}], der vendor_key
+    er vendor med små bokstaver og vendor visningsnavnet. Billig sammenlignet
+    med å rendre rapportene, og grunnlaget for rapport-cachen.
+    """
+    params = [date(year, 1, 1), date(year + 1, 1, 1)]
+    vendor_filter = ''
+    if vendors:
+        vendor_filter = ' AND lower(l.vendor) = ANY(%s)'
+        params.append([vendor.lower() for vendor in vendors])
+    with conn.cursor() as cur:
+        cur.execute(ROYALTY_INPUT_QUERY.format(vendor_filter=vendor_filter), params)
+        return [
+            {'vendor_key': vendor_key, 'vendor': vendor, 'month': month, 'rows': rows, 'input_hash': input_hash}
+            for vendor_key, month, rows, input_hash, vendor in cur.fetchall()
+        ]
+
+def royalty_fingerprint(input_hash, vendor=None):
+    """Fingeravtrykk for én rapport: inndata, malversjon, firmanavn og vendor"""
+    return fingerprint(REPORT_TEMPLATE_VERSION, os.getenv('COMPANY_NAME', 'Your Company'), vendor or '*', input_hash)
+
+def monthly_royalty_fingerprints(inputs):
+    """Slå sammen vendor-hashene til ett fingeravtrykk per måned (rapporten for alle vendors)"""
+    by_month = {}
+    for item in sorted(inputs, key=lambda item: (item['month'], item['vendor_key'] or '')):
+        by_month.setdefault(item['month'], []).append(f"{item['vendor_key']}:{item['rows']}:{item['input_hash']}")
+    return {month: royalty_fingerprint(fingerprint(*parts)) for month, parts in by_month.items()}
+
+def presync_orders(year):
+    """
+    Synk ordrer i rapportåret som er endret siden forrige synk, i samme
+    prosess, før rapportene leser royalty-ledgeren. Backup-modulen
+    importeres først her, så arbeidsprosessene i royalty_batch slipper den.
+    """
+    from organized_shopify_backup import sync_orders_for_period
+    return sync_orders_for_period(date(year, 1, 1), date(year + 1, 1, 1))
+
+def upload_to_cloud_storage(year, months=None):
+    """Laster opp rapporter til konfigurerbar cloud storage som én batch (kun months hvis gitt)"""
+    files = [
+        path
+        for month in (MONTHS if months is None else months)
+        for path in royalty_report_files(year, month)
+        if os.path.exists(path)
+    ]
+    if not files:
+        return []
+    return upload_reports(files)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Royalty-rapporter per måned")
+    parser.add_argument('--year', type=int, default=2025)
+    parser.add_argument('--force', action='store_true', help="Lag alle måneder på nytt, uansett rapport-cache")
+    parser.add_argument('--no-sync', action='store_true', help="Ikke synk endrede ordrer fra Shopify først")
+    return parser.parse_args()
 
 def main():
-    # Først synkroniser data fra Shopify
-    print("Synkroniserer data fra Shopify...")
-    os.system("python3 shopify_to_postgres.py")
+    args = parse_args()
+    year = args.year
     
-    year = 2025
-    print(f"Genererer royalty-rapporter for {year}...")
+    # Først synkroniser endrede ordrer for året fra Shopify
+    synced = True
+    if not args.no_sync:
+        print("Synkroniserer endrede ordrer fra Shopify...")
+        synced = presync_orders(year)['complete']
+        if not synced:
+            print("⚠️  Synken ble ikke fullført, rapportene bygger på data fra forrige synk.")
     
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        port=DB_PORT,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS
-    )
+    print(f"Genererer royalty-rapporter for {year}...")
     
-    royalty_data = fetch_royalty_data(conn, year)
-    save_royalty_json_report(royalty_data, year)
-    save_royalty_pdf_report(royalty_data, year)
-    conn.close()
+    # Kun måneder der inndataene er endret siden forrige kjøring lages på nytt
+    cache = ReportCache(REPORT_DIR)
+    rendered, unchanged = {}, 0
+    with pooled_connection() as conn:
+        fingerprints = monthly_royalty_fingerprints(fetch_royalty_inputs(conn, year))
+        for month, report_fingerprint in sorted(fingerprints.items()):
+            key = ReportCache.key('royalty', year, month)
+            if not args.force and cache.is_fresh(key, report_fingerprint):
+                unchanged += 1
+                continue
+            totals = write_royalty_month(conn, year, month)
+            if totals is None:
+                continue
+            rendered[month] = (key, report_fingerprint)
+            print(f"  {year}-{month}: royalty {totals['sum_royalty']:.2f}")
     
-    print(f"Royalty-rapporter generert for {year} i mappen 'royalty_rapporter'.")
+    print(f"Royalty-rapporter generert for {year} i mappen 'royalty_rapporter' "
+          f"({len(rendered)} nye, {unchanged} uendret).")
     
-    # Last opp til cloud storage
+    # Last opp til cloud storage (uendrede måneder ligger der allerede)
     print("Laster opp rapporter til cloud storage...")
-    upload_to_cloud_storage(year)
+    failed = set(failed_uploads(upload_to_cloud_storage(year, list(rendered))))
+    
+    # Måneder som ikke kom opp noteres ikke i cachen, så de prøves igjen neste gang
+    for month, (key, report_fingerprint) in rendered.items():
+        files = royalty_report_files(year, month)
+        if not failed.intersection(os.path.abspath(path) for path in files):
+            cache.store(key, report_fingerprint, files)
+    cache.save()
+    
+    if failed:
+        print(f"❌ {len(failed)} filer ble ikke lastet opp for {year}.")
+        return 1
     print(f"Royalty-rapporter for {year} er lastet opp til Jottacloud under 'shopify_royalties/rapport'.")
+    return 0 if synced else 1
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Cache for ferdige rapporter, nøklet på et fingeravtrykk av inndataene.
+Er fingeravtrykket for en måned uendret siden forrige kjøring, og filene
+finnes fortsatt, hoppes både rendering og opplasting over. Oppføringer som
+ikke er brukt på REPORT_CACHE_RETENTION_DAYS dager fjernes.
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta
+
+CACHE_FILENAME = '.report_cache.json'
+
+def fingerprint(*parts):
+    """Stabil sha256 av inndata-delene (hash fra databasen, malversjon, vendor ...)"""
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+class ReportCache:
+    """Fingeravtrykk og filer per rapport, lagret i rapportmappen"""
+
+    def __init__(self, report_dir, retention_days=None):
+        self.report_dir = report_dir
+        self.path = os.path.join(report_dir, CACHE_FILENAME)
+        if retention_days is None:
+            retention_days = int(os.getenv('REPORT_CACHE_RETENTION_DAYS', '400'))
+        self.retention_days = retention_days
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get('entries', {})
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Kunne ikke lese rapport-cache {self.path}: {e}")
+
+    @staticmethod
+    def key(kind, year, month, vendor=None):
+        return f"{kind}:{vendor or '*'}:{year}-{month}"
+
+    def is_fresh(self, key, report_fingerprint):
+        """True når rapporten er laget fra de samme inndataene og filene finnes"""
+        entry = self.entries.get(key)
+        if not entry or entry['fingerprint'] != report_fingerprint:
+            return False
+        if not all(os.path.exists(os.path.join(self.report_dir, name)) for name in entry['files']):
+            return False
+        entry['last_used'] = datetime.now().isoformat()
+        return True
+
+    def store(self, key, report_fingerprint, files):
+        """Noter en nylaget rapport (filer som stier, lagres relativt til rapportmappen)"""
+        now = datetime.now().isoformat()
+        self.entries[key] = {
+            'fingerprint': report_fingerprint,
+            'files': [os.path.relpath(path, self.report_dir) for path in files],
+            'created_at': now,
+            'last_used': now
+        }
+
+    def prune(self):
+        """Fjern oppføringer som ikke er brukt innenfor oppbevaringstiden"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        expired = [key for key, entry in self.entries.items() if entry['last_used'] < cutoff]
+        for key in expired:
+            del self.entries[key]
+        return len(expired)
+
+    def save(self):
+        """Lagre cachen atomisk"""
+        self.prune()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'entries': self.entries}, f, indent=2)
+        os.replace(tmp_path, self.path)
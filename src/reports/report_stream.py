@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Strømmende rapportbygging: rader leses fra en server-side (navngitt)
+cursor i batcher og skrives direkte til JSON og PDF, med summer som
+løpende totaler. Minnebruken er uavhengig av antall linjer i måneden.
+"""
+import os
+import json
+import textwrap
+
+from database import batch_size
+
+def iter_named_cursor(conn, name, query, params=None, itersize=None):
+    """Gi rader fra en navngitt cursor; Postgres sender itersize rader om gangen"""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize or batch_size()
+        cur.execute(query, params)
+        for row in cur:
+            yield row
+
+class RunningTotals:
+    """Summer som oppdateres per rad i stedet for å regnes over en ferdig liste"""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.totals = {name: 0.0 for name in fields}
+        self.count = 0
+
+    def add(self, row):
+        for name, column in self.fields.items():
+            self.totals[name] += row[column]
+        self.count += 1
+
+    def as_dict(self):
+        return dict(self.totals)
+
+class StreamingJSONWriter:
+    """
+    Skriver en JSON-rapport rad for rad. Med header blir filen
+    {header..., "data": [rader], <trailer>}; uten header en ren liste.
+    Filen skrives til .tmp og flyttes på plass ved close().
+    """
+
+    def __init__(self, path, header=None):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.header = header
+        self.rows = 0
+        self._file = open(self.tmp_path, 'w', encoding='utf-8')
+        if header is None:
+            self._file.write('[')
+        else:
+            self._file.write('{\n')
+            for key, value in header.items():
+                self._file.write(f'  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n')
+            self._file.write('  "data": [')
+
+    def write_row(self, row):
+        indent = '  ' if self.header is None else '    '
+        text = textwrap.indent(json.dumps(row, ensure_ascii=False, indent=2, default=str), indent)
+        self._file.write((',\n' if self.rows else '\n') + text)
+        self.rows += 1
+
+    def close(self, **trailer):
+        """Avslutt listen, skriv trailer-feltene (f.eks. totals) og flytt filen på plass"""
+        closing = '\n' if self.rows else ''
+        if self.header is None:
+            self._file.write(f'{closing}]')
+        else:
+            self._file.write(f'{closing}  ]')
+            for key, value in trailer.items():
+                value_text = json.dumps(value, ensure_ascii=False, indent=2, default=str).replace('\n', '\n  ')
+                self._file.write(f',\n  {json.dumps(key)}: {value_text}')
+            self._file.write('\n}')
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Forkast en halvskrevet rapport"""
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Opplasting av ferdige rapporter som én samlet batch. Backend velges med
+REPORT_UPLOAD_BACKEND:
+
+- rclone: én rclone-kjøring for hele settet, med parallelle overføringer
+  (--transfers) og --checksum, så filer som allerede ligger der uendret
+  hoppes over. Status per fil leses fra rclone sin JSON-logg.
+- local: kopierer til en lokal mappe i tråder og hopper over filer med
+  samme sha256. Nyttig for testing og for monterte disker.
+
+Flere backends kan legges til i BACKENDS.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_TRANSFERS = 4
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class RcloneBackend:
+    """Én rclone copy for alle filene (--files-from-raw)"""
+
+    def __init__(self, transfers):
+        self.transfers = transfers
+
+    def upload(self, source_root, names, destination):
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as f:
+            f.write('\n'.join(names) + '\n')
+            files_from = f.name
+        command = [
+            'rclone', 'copy', source_root, destination,
+            '--files-from-raw', files_from,
+            '--checksum',
+            '--transfers', str(self.transfers),
+            '--use-json-log', '--log-level', 'INFO', '--stats', '0'
+        ]
+        try:
+            completed = subprocess.run(command, capture_output=True, text=True)
+        except OSError as e:
+            return {name: {'status': 'failed', 'error': f"rclone kunne ikke startes: {e}"} for name in names}
+        finally:
+            os.remove(files_from)
+
+        statuses = self.parse_log(completed.stderr)
+        results = {}
+        for name in names:
+            status = statuses.get(name)
+            if status is None:
+                # rclone logger ikke filer som hoppes over på INFO-nivå
+                if completed.returncode == 0:
+                    status = {'status': 'skipped'}
+                else:
+                    status = {'status': 'failed', 'error': f"rclone avsluttet med kode {completed.returncode}"}
+            results[name] = status
+        return results
+
+    @staticmethod
+    def parse_log(output):
+        """Status per fil fra rclone sin JSON-logg"""
+        statuses = {}
+        for line in output.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            name = entry.get('object')
+            if not name:
+                continue
+            message = entry.get('msg', '')
+            if entry.get('level') == 'error':
+                statuses[name] = {'status': 'failed', 'error': message}
+            elif message.startswith('Copied'):
+                statuses.setdefault(name, {'status': 'uploaded'})
+        return statuses
+
+class LocalDirBackend:
+    """Kopierer til en lokal mappe, i parallell, og hopper over like filer"""
+
+    def __init__(self, transfers):
+        self.transfers = transfers
+
+    def upload(self, source_root, names, destination):
+        with ThreadPoolExecutor(max_workers=self.transfers, thread_name_prefix='upload') as executor:
+            results = executor.map(lambda name: self.copy(source_root, name, destination), names)
+            return dict(zip(names, results))
+
+    @staticmethod
+    def copy(source_root, name, destination):
+        source = os.path.join(source_root, name)
+        target = os.path.join(destination, name)
+        try:
+            if os.path.exists(target) and os.path.getsize(target) == os.path.getsize(source) \
+                    and file_sha256(target) == file_sha256(source):
+                return {'status': 'skipped'}
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f"{target}.tmp"
+            shutil.copyfile(source, tmp_path)
+            os.replace(tmp_path, target)
+            return {'status': 'uploaded'}
+        except OSError as e:
+            return {'status': 'failed', 'error': str(e)}
+
+BACKENDS = {
+    'rclone': RcloneBackend,
+    'local': LocalDirBackend
+}
+
+def get_backend(name=None, transfers=None):
+    name = name or os.getenv('REPORT_UPLOAD_BACKEND', 'rclone')
+    if name not in BACKENDS:
+        raise ValueError(f"Ukjent REPORT_UPLOAD_BACKEND '{name}' (gyldige: {', '.join(BACKENDS)})")
+    transfers = transfers or int(os.getenv('REPORT_UPLOAD_TRANSFERS', DEFAULT_TRANSFERS))
+    return BACKENDS[name](max(transfers, 1))
+
+def upload_reports(paths, destination=None, backend=None, transfers=None):
+    """
+    Last opp rapportfilene som én batch. backend er et navn fra BACKENDS
+    eller et objekt med upload(). Stier under samme mappe beholder
+    sin relative plassering (f.eks. <vendor>/fil.pdf). Returnerer
+    [{'file', 'status': uploaded|skipped|failed, 'error'}] og skriver ut
+    status per fil.
+    """
+    destination = destination or os.getenv('CLOUD_STORAGE_PATH', 'your-cloud-path/reports/')
+    paths = [os.path.abspath(path) for path in paths]
+    results = [
+        {'file': path, 'status': 'failed', 'error': 'filen finnes ikke'}
+        for path in paths if not os.path.exists(path)
+    ]
+    paths = [path for path in paths if os.path.exists(path)]
+
+    if paths:
+        source_root = os.path.commonpath([os.path.dirname(path) for path in paths])
+        names = [os.path.relpath(path, source_root) for path in paths]
+        if backend is None or isinstance(backend, str):
+            backend = get_backend(backend, transfers)
+        statuses = backend.upload(source_root, names, destination)
+        for path, name in zip(paths, names):
+            results.append(dict(statuses[name], file=path))
+
+    for result in results:
+        name = os.path.basename(result['file'])
+        if result['status'] == 'uploaded':
+            print(f"  ⬆️  {name}")
+        elif result['status'] == 'skipped':
+            print(f"  ⏭️  {name} (uendret)")
+        else:
+            print(f"  ❌ {name}: {result.get('error')}")
+
+    counts = {status: sum(1 for r in results if r['status'] == status) for status in ('uploaded', 'skipped', 'failed')}
+    print(f"☁️  Opplasting til {destination}: {counts['uploaded']} lastet opp, "
+          f"{counts['skipped']} uendret, {counts['failed']} feilet")
+    return results
+
+def failed_uploads(results):
+    return [result['file'] for result in results if result['status'] == 'failed']
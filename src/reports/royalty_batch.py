@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Kjører royalty-rapporter for mange (vendor, måned)-jobber parallelt i en
+prosesspool. FPDF-layout er CPU-bundet, så hver jobb får sin egen prosess
+med egen database-tilkobling og egen utfil under
+royalty_rapporter/<vendor>/. En oppsummering med tid per jobb skrives til
+royalty_rapporter/batch_summary_<år>.json. Jobber der inndataene er
+uendret siden forrige kjøring (se report_cache.py) hoppes over.
+
+Eksempler:
+    python3 royalty_batch.py --year 2025
+    python3 royalty_batch.py --year 2025 --vendor "Forlag X" --month 08 --workers 4
+    python3 royalty_batch.py --year 2025 --force
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Felles database-modul ligger sammen med backup-skriptet
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core'))
+from database import pooled_connection, close_pool
+
+import generate_royalty_reports as royalty
+from report_cache import ReportCache
+
+def vendor_dirname(vendor):
+    """Mappenavn for en vendor (ingen skråstreker eller mellomrom)"""
+    return re.sub(r'[^\w.-]+', '_', vendor).strip('_') or 'ukjent_vendor'
+
+def fetch_royalty_jobs(conn, year, vendors=None, months=None):
+    """
+    Finn (vendor, måned)-par med royalty-linjer i året, med antall linjer og
+    fingeravtrykk av inndataene. Uten vendors tas alle vendors med.
+    vendor_key (små bokstaver) er cache-nøkkelen; vendor er navnet slik det
+    står på produktene, og brukes i rapporttittelen og mappenavnet.
+    """
+    jobs = [
+        {
+            'vendor_key': item['vendor_key'],
+            'vendor': item['vendor'],
+            'year': year,
+            'month': item['month'],
+            'rows': item['rows'],
+            'fingerprint': royalty.royalty_fingerprint(item['input_hash'], item['vendor'])
+        }
+        for item in royalty.fetch_royalty_inputs(conn, year, vendors)
+        if item['vendor_key'] and (not months or item['month'] in months)
+    ]
+    # Største jobber først gir jevnere fordeling på prosessene
+    jobs.sort(key=lambda job: job['rows'], reverse=True)
+    return jobs
+
+def job_cache_key(job):
+    return ReportCache.key('royalty', job['year'], job['month'], job['vendor_key'])
+
+def job_output_dir(job, output_root):
+    return os.path.join(output_root, vendor_dirname(job['vendor']))
+
+def split_fresh_jobs(jobs, cache):
+    """Del jobbene i (må lages, uendret siden forrige kjøring)"""
+    stale, fresh = [], []
+    for job in jobs:
+        if cache.is_fresh(job_cache_key(job), job['fingerprint']):
+            fresh.append(dict(job, status='skipped', duration_seconds=0.0))
+        else:
+            stale.append(job)
+    return stale, fresh
+
+def store_results(results, cache, output_root):
+    """Noter fullførte rapporter i cachen (gjøres i hovedprosessen)"""
+    for result in results:
+        if result['status'] == 'completed' and result['totals'] is not None:
+            files = royalty.royalty_report_files(result['year'], result['month'], result['output_dir'])
+            cache.store(job_cache_key(result), result['fingerprint'], files)
+    cache.save()
+
+def init_worker():
+    """Hver prosess får sin egen lille pool"""
+    os.environ.setdefault('DB_POOL_MIN', '1')
+    os.environ.setdefault('DB_POOL_MAX', '2')
+
+def run_report_job(job, output_root):
+    """Lag rapporten for én (vendor, måned) i en arbeidsprosess"""
+    started = time.monotonic()
+    output_dir = job_output_dir(job, output_root)
+    os.makedirs(output_dir, exist_ok=True)
+    result = dict(job, output_dir=output_dir)
+    try:
+        with pooled_connection() as conn:
+            totals = royalty.write_royalty_month(conn, job['year'], job['month'], job['vendor'], output_dir)
+        result.update(status='completed', totals=totals)
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    result['duration_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+def run_report_jobs(jobs, workers=None, output_root=None):
+    """
+    Fordel jobbene på en prosesspool (standard: én prosess per kjerne).
+    Returnerer resultatene i samme rekkefølge som jobbene.
+    """
+    output_root = output_root or royalty.REPORT_DIR
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    context = multiprocessing.get_context('spawn')
+    results = [None] * len(jobs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker) as executor:
+        futures = {executor.submit(run_report_job, job, output_root): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            status = '✅' if result['status'] == 'completed' else '❌'
+            print(f"{status} {result['vendor']} {result['year']}-{result['month']}: "
+                  f"{result['rows']} linjer på {result['duration_seconds']:.1f}s")
+    return results
+
+def write_batch_summary(results, year, wall_seconds, workers, output_root=None):
+    """Lagre og skriv ut tidtaking for batchen"""
+    output_root = output_root or royalty.REPORT_DIR
+    job_seconds = sum(result['duration_seconds'] for result in results)
+    summary = {
+        'year': year,
+        'workers': workers,
+        'wall_seconds': round(wall_seconds, 2),
+        'job_seconds': round(job_seconds, 2),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'failed': [f"{r['vendor']} {r['year']}-{r['month']}" for r in results if r['status'] == 'failed'],
+        'jobs': results
+    }
+    path = os.path.join(output_root, f'batch_summary_{year}.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2, default=str)
+    print(f"⏱️  {len(results)} jobber på {wall_seconds:.1f}s veggtid (sum av jobber {job_seconds:.1f}s, {workers} prosesser)")
+    print(f"Oppsummering lagret: {path}")
+    return summary
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Royalty-rapporter for mange vendors og måneder i parallell")
+    parser.add_argument('--year', type=int, default=date.today().year)
+    parser.add_argument('--vendor', action='append', help="Kun denne vendoren (kan gjentas); standard er alle")
+    parser.add_argument('--month', action='append', help="Kun denne måneden, MM (kan gjentas)")
+    parser.add_argument('--workers', type=int, help="Antall prosesser (standard: antall kjerner)")
+    parser.add_argument('--force', action='store_true', help="Lag alle rapporter på nytt, uansett rapport-cache")
+    parser.add_argument('--no-sync', action='store_true', help="Ikke synk endrede ordrer fra Shopify først")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    months = [f"{int(month):02d}" for month in args.month] if args.month else None
+
+    synced = True
+    if not args.no_sync:
+        synced = royalty.presync_orders(args.year)['complete']
+        if not synced:
+            print("⚠️  Synken ble ikke fullført, rapportene bygger på data fra forrige synk.")
+
+    with pooled_connection() as conn:
+        jobs = fetch_royalty_jobs(conn, args.year, args.vendor, months)
+    close_pool()
+    if not jobs:
+        print(f"Ingen royalty-linjer funnet for {args.year}.")
+        return 0
+
+    cache = ReportCache(royalty.REPORT_DIR)
+    if args.force:
+        stale, fresh = jobs, []
+    else:
+        stale, fresh = split_fresh_jobs(jobs, cache)
+    if fresh:
+        print(f"⏭️  {len(fresh)} rapporter er uendret siden forrige kjøring")
+
+    workers = min(args.workers or os.cpu_count() or 1, max(len(stale), 1))
+    print(f"Genererer {len(stale)} royalty-rapporter for {args.year} med {workers} prosesser...")
+    started = time.monotonic()
+    results = run_report_jobs(stale, workers) if stale else []
+    store_results(results, cache, royalty.REPORT_DIR)
+    summary = write_batch_summary(results + fresh, args.year, time.monotonic() - started, workers)
+    return 1 if summary['failed'] or not synced else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
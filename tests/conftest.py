@@ -0,0 +1,15 @@
+"""
+Felles oppsett for testene. Modulene i src/core og src/reports importerer
+hverandre med flate importer (som når skriptene kjøres fra sin egen mappe),
+så begge mappene legges på sys.path.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('core', 'reports'):
+    path = os.path.join(ROOT, 'src', folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
@@ -0,0 +1,54 @@
+"""Arkivformatet: shards, indeks og oppslag med offset"""
+import os
+import gzip
+import json
+
+from archive_writer import ArchiveWriter, read_records
+
+def read_index(resource_dir):
+    with gzip.open(os.path.join(resource_dir, 'index.jsonl.gz'), 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_entries_point_at_records(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), compression='gzip', shard_records=3)
+    records = [{'id': i, 'title': f'Ordre æøå {i}', 'lines': list(range(i))} for i in range(7)]
+    entries = [writer.write('orders', record, vendor='Forlag X') for record in records]
+    manifest = writer.close()
+
+    assert manifest['resources']['orders']['records'] == 7
+    assert manifest['resources']['orders']['shards'] == [
+        'orders-00000.jsonl.gz', 'orders-00001.jsonl.gz', 'orders-00002.jsonl.gz'
+    ]
+    assert entries[3]['shard'] == 'orders-00001.jsonl.gz' and entries[3]['line'] == 0
+    assert read_index(os.path.join(str(tmp_path), 'orders')) == entries
+
+    # Les poster i vilkårlig rekkefølge fra én shard
+    shard = os.path.join(str(tmp_path), 'orders', 'orders-00001.jsonl.gz')
+    wanted = [(entries[5]['offset'], entries[5]['length']), (entries[3]['offset'], entries[3]['length'])]
+    found = list(read_records(shard, wanted))
+    assert found == [(entries[3]['offset'], records[3]), (entries[5]['offset'], records[5])]
+
+def test_unfinished_shard_is_discarded_on_resume(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), compression='gzip', shard_records=100)
+    writer.write('customers', {'id': 1})
+    writer.checkpoint('customers')
+    writer.write('customers', {'id': 2})
+    # Avbrudd: shard nr. 2 har ingen indeks ennå
+
+    resumed = ArchiveWriter(str(tmp_path), compression='gzip', shard_records=100)
+    entry = resumed.write('customers', {'id': 3})
+    resumed.close()
+
+    assert entry['shard'] == 'customers-00001.jsonl.gz'
+    assert [e['id'] for e in read_index(os.path.join(str(tmp_path), 'customers'))] == [1, 3]
+
+def test_reset_removes_previous_shards(tmp_path):
+    writer = ArchiveWriter(str(tmp_path), compression='gzip')
+    writer.write('products', {'id': 1})
+    writer.checkpoint('products')
+    writer.reset('products')
+    writer.write('products', {'id': 2})
+    manifest = writer.close()
+
+    assert manifest['resources']['products']['records'] == 1
+    assert [e['id'] for e in read_index(os.path.join(str(tmp_path), 'products'))] == [2]
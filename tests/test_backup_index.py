@@ -0,0 +1,43 @@
+"""Backup-indeksen: oppslag og avvisning av inkrementelle backuper"""
+import os
+
+import backup_index
+from backup_index import BackupIndex
+
+def build_backup(root, date, since=None):
+    backup_dir = os.path.join(str(root), date)
+    index = BackupIndex(backup_dir)
+    index.reset('orders')
+    index.set_coverage('orders', since)
+    index.add('orders', 1, 'orders/1.json', created_at='2025-03-02', title='#1001', vendor='Forlag X', month='2025-03')
+    index.add('orders', 2, 'orders/2.json', created_at='2025-03-09', title='#1002', vendor='Forlag Y', month='2025-03')
+    index.close()
+    return backup_dir
+
+def test_query_filters_on_dimensions(tmp_path):
+    index = BackupIndex(build_backup(tmp_path, '2025-03-10'), readonly=True)
+    assert [entry['id'] for entry in index.query('orders', vendor='forlag x')] == [1]
+    assert [entry['id'] for entry in index.query('orders', month='2025-03', since='2025-03-05')] == [2]
+    assert index.values('orders', 'vendor') == [('Forlag X', 1), ('Forlag Y', 1)]
+
+def test_incremental_coverage_keeps_full_and_earliest_since(tmp_path):
+    index = BackupIndex(str(tmp_path / 'b'))
+    index.set_coverage('orders', '2025-03-10T00:00:00+00:00')
+    index.set_coverage('orders', '2025-03-11T00:00:00+00:00')
+    assert index.coverage('orders') == {'mode': 'incremental', 'since': '2025-03-10T00:00:00+00:00'}
+
+    index.set_coverage('products')
+    index.set_coverage('products', '2025-03-11T00:00:00+00:00')
+    assert index.coverage('products') == {'mode': 'full', 'since': None}
+    assert index.coverage('customers') is None
+
+def test_cli_refuses_incremental_backup_and_points_to_full(tmp_path, capsys):
+    full_dir = build_backup(tmp_path, '2025-03-09')
+    incremental_dir = build_backup(tmp_path, '2025-03-10', since='2025-03-09T02:00:00+00:00')
+
+    assert backup_index.main(['--backup', incremental_dir, 'query', 'orders', '--vendor', 'Forlag X']) == 2
+    assert f"--backup {full_dir}" in capsys.readouterr().err
+
+    assert backup_index.main(['--backup', incremental_dir, '--partial', 'query', 'orders']) == 0
+    assert backup_index.main(['--backup', full_dir, 'values', 'orders', 'vendor']) == 0
+    assert backup_index.main(['--backup', full_dir, 'query', 'customers']) == 2
@@ -0,0 +1,47 @@
+"""Backup-tellerne: telling per kategori og samtidig lagring"""
+import json
+import threading
+
+from backup_stats import BackupStats
+
+def make_stats(tmp_path):
+    (tmp_path / 'orders').mkdir(exist_ok=True)
+    (tmp_path / '_metadata').mkdir(exist_ok=True)
+    return BackupStats(
+        {'orders': str(tmp_path / 'orders'), 'metadata': str(tmp_path / '_metadata')},
+        str(tmp_path / '_metadata' / 'backup_stats.json')
+    )
+
+def test_counts_files_folders_and_overwrites(tmp_path):
+    stats = make_stats(tmp_path)
+    stats.make_dirs(str(tmp_path / 'orders' / 'by_year' / '2025'))
+    path = str(tmp_path / 'orders' / 'by_year' / '2025' / 'order_1.json')
+    stats.write_json(path, {'id': 1})
+    stats.write_json(path, {'id': 1, 'note': 'endret'})
+
+    size = (tmp_path / 'orders' / 'by_year' / '2025' / 'order_1.json').stat().st_size
+    assert stats.snapshot()['orders'] == {'files': 1, 'folders': 2, 'bytes': size}
+
+    stats.save()
+    assert make_stats(tmp_path).snapshot()['orders'] == stats.snapshot()['orders']
+
+def test_concurrent_saves(tmp_path):
+    stats = make_stats(tmp_path)
+    errors = []
+
+    def save_many():
+        try:
+            for _ in range(200):
+                stats.save()
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(tmp_path / '_metadata' / 'backup_stats.json', encoding='utf-8') as f:
+        assert 'orders' in json.load(f)['categories']
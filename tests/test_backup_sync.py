@@ -0,0 +1,178 @@
+"""Synk-fasene i backupen mot en falsk Shopify og en falsk database"""
+import json
+import os
+from datetime import date
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('psycopg2')
+
+import database
+import organized_shopify_backup as backup
+
+class FakeConnection:
+    """Tilkobling som kun teller commits og rollbacks"""
+
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+def fake_pages(pages):
+    """Erstatning for iter_shopify_pages: noterer posisjonen i sjekkpunktet før siden gis videre"""
+    def iter_pages(endpoint, resource_key, params=None, checkpoint=None):
+        for page_count, items in enumerate(pages, start=1):
+            next_cursor = f"cursor-{page_count + 1}" if page_count < len(pages) else None
+            if checkpoint:
+                checkpoint.advance(page_count, next_cursor)
+            yield page_count, items
+    return iter_pages
+
+@pytest.fixture
+def synced(tmp_path, monkeypatch):
+    """Backup-modulen med backup-mappe i tmp_path, commit per side og registrerte synk-statuser"""
+    base_dir = str(tmp_path / 'backup')
+    monkeypatch.setattr(backup, 'BACKUP_BASE_DIR', base_dir)
+    for category in backup.STRUCTURE:
+        monkeypatch.setitem(backup.STRUCTURE, category, os.path.join(base_dir, category))
+    monkeypatch.setattr(backup, 'ARCHIVE_DIR', os.path.join(base_dir, 'archive'))
+    monkeypatch.setattr(backup, '_backup_stats', None)
+    monkeypatch.setattr(backup, '_backup_index', None)
+    monkeypatch.setattr(backup, '_archive_writer', None)
+    backup.ensure_backup_dirs()
+
+    conn = FakeConnection()
+    monkeypatch.setattr(database, 'get_db_connection', lambda: conn)
+    monkeypatch.setattr(database, 'release_db_connection', lambda conn: None)
+    monkeypatch.setattr(database, 'commit_interval', lambda: 1)
+    monkeypatch.setattr(backup, 'get_sync_watermark', lambda resource: None)
+
+    statuses = []
+    monkeypatch.setattr(
+        backup, 'record_sync_status',
+        lambda resource, status, started_at, records, watermark=None, error=None:
+            statuses.append((resource, status, records, watermark))
+    )
+    yield statuses
+    backup.finish_backup_index()
+
+def read_checkpoint(resource):
+    with open(os.path.join(backup.STRUCTURE['metadata'], 'checkpoints', f'{resource}.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+def customer(customer_id, updated_at):
+    return {'id': customer_id, 'email': f'kunde{customer_id}@example.com', 'updated_at': updated_at}
+
+def test_failed_page_degrades_to_disk_only(synced, monkeypatch):
+    pages = [
+        [customer(1, '2025-03-01T10:00:00Z')],
+        [customer(2, '2025-03-02T10:00:00Z')],
+        [customer(3, '2025-03-03T10:00:00Z')]
+    ]
+    monkeypatch.setattr(backup, 'iter_shopify_pages', fake_pages(pages))
+    stored = []
+
+    def store_customers(customers, conn=None):
+        if customers[0]['id'] == 2:
+            return None
+        stored.append(customers[0]['id'])
+        return {'changed_ids': []}
+
+    monkeypatch.setattr(backup, 'store_customers_to_db', store_customers)
+
+    assert backup.fetch_and_organize_customers() == 3
+
+    # Alle sidene er skrevet til disk, men databasen fikk kun siden før feilen
+    customers_dir = os.path.join(backup.STRUCTURE['customers'], 'all_customers')
+    assert sorted(os.listdir(customers_dir)) == ['customer_1.json', 'customer_2.json', 'customer_3.json']
+    assert stored == [1]
+
+    # Sjekkpunktet peker fortsatt på side 2, og synken er ikke fullført
+    assert read_checkpoint('customers')['cursor'] == 'cursor-2'
+    assert [status[:3] for status in synced] == [('customers', 'failed', 3)]
+
+def order(order_id, updated_at):
+    return {'id': order_id, 'created_at': '2025-03-01T10:00:00+01:00', 'updated_at': updated_at, 'line_items': []}
+
+PERIOD = 'orders_period:2025-01-01:2026-01-01'
+
+def test_period_sync_starts_from_the_newest_watermark(synced, monkeypatch):
+    watermarks = {'orders': '2025-03-01T00:00:00+00:00', PERIOD: '2025-03-10T00:00:00+00:00'}
+    monkeypatch.setattr(backup, 'get_sync_watermark', watermarks.get)
+    pages = [[order(1, '2025-03-11T10:00:00+00:00'), order(2, '2025-03-12T10:00:00+00:00')],
+             [order(3, '2025-03-11T12:00:00+00:00')]]
+    requested = []
+
+    def iter_pages(endpoint, resource_key, params=None, checkpoint=None):
+        requested.append(params)
+        yield from fake_pages(pages)(endpoint, resource_key, params, checkpoint)
+
+    stored = []
+    monkeypatch.setattr(backup, 'iter_shopify_pages', iter_pages)
+    monkeypatch.setattr(backup, 'store_orders_to_db', lambda orders, conn=None: stored.extend(o['id'] for o in orders) or {})
+
+    result = backup.sync_orders_for_period(date(2025, 1, 1), date(2026, 1, 1))
+
+    assert result == {'orders': 3, 'since': '2025-03-10T00:00:00+00:00',
+                      'watermark': '2025-03-12T10:00:00+00:00', 'complete': True}
+    assert requested == [{'status': 'any', 'limit': 250, 'created_at_min': '2024-12-31', 'created_at_max': '2026-01-02',
+                          'updated_at_min': '2025-03-10T00:00:00+00:00'}]
+    assert stored == [1, 2, 3]
+    assert synced == [(PERIOD, 'completed', 3, '2025-03-12T10:00:00+00:00')]
+    # Kun databasen oppdateres, ingen backup-filer skrives
+    assert os.listdir(backup.STRUCTURE['orders']) == []
+
+def test_period_sync_without_watermark_fetches_the_whole_period(synced, monkeypatch):
+    requested = []
+
+    def iter_pages(endpoint, resource_key, params=None, checkpoint=None):
+        requested.append(params)
+        return iter(())
+
+    monkeypatch.setattr(backup, 'iter_shopify_pages', iter_pages)
+
+    result = backup.sync_orders_for_period(date(2025, 3, 1), date(2025, 4, 1))
+
+    assert 'updated_at_min' not in requested[0]
+    assert result == {'orders': 0, 'since': None, 'watermark': None, 'complete': True}
+    assert synced == [('orders_period:2025-03-01:2025-04-01', 'completed', 0, None)]
+
+def test_period_sync_stops_at_a_page_that_fails_to_store(synced, monkeypatch):
+    pages = [[order(1, '2025-03-11T10:00:00+00:00')], [order(2, '2025-03-12T10:00:00+00:00')],
+             [order(3, '2025-03-13T10:00:00+00:00')]]
+    stored = []
+
+    def store_orders(orders, conn=None):
+        if orders[0]['id'] == 2:
+            return None
+        stored.append(orders[0]['id'])
+        return {}
+
+    monkeypatch.setattr(backup, 'iter_shopify_pages', fake_pages(pages))
+    monkeypatch.setattr(backup, 'store_orders_to_db', store_orders)
+
+    result = backup.sync_orders_for_period(date(2025, 1, 1), date(2026, 1, 1))
+
+    assert stored == [1]
+    assert result['complete'] is False
+    # Synken registreres som feilet, så watermarken brukes ikke neste gang
+    assert [status[:3] for status in synced] == [(PERIOD, 'failed', 1)]
+
+def test_period_sync_reports_a_fetch_error_as_incomplete(synced, monkeypatch):
+    def iter_pages(endpoint, resource_key, params=None, checkpoint=None):
+        yield 1, [order(1, '2025-03-11T10:00:00+00:00')]
+        raise backup.ShopifyFetchError('Kunne ikke hente side 2 av orders.json')
+
+    monkeypatch.setattr(backup, 'iter_shopify_pages', iter_pages)
+    monkeypatch.setattr(backup, 'store_orders_to_db', lambda orders, conn=None: {})
+
+    result = backup.sync_orders_for_period(date(2025, 1, 1), date(2026, 1, 1))
+
+    assert (result['orders'], result['complete']) == (1, False)
+    assert [status[:3] for status in synced] == [(PERIOD, 'failed', 1)]
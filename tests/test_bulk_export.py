@@ -0,0 +1,127 @@
+"""Bulk-JSONL settes sammen og gjøres om til samme REST-format som resten av backupen"""
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+
+from bulk_export import iter_bulk_records, order_from_bulk, product_from_bulk, build_bulk_query
+
+from tests.conftest import DATA_DIR
+
+def read_lines(name):
+    with open(os.path.join(DATA_DIR, name), 'r', encoding='utf-8') as f:
+        return [line for line in f if line.strip()]
+
+def test_iter_bulk_records_groups_children_under_parent():
+    records = list(iter_bulk_records(read_lines('bulk_orders.jsonl')))
+
+    assert [record['id'] for record in records] == ['gid://shopify/Order/1001', 'gid://shopify/Order/1002']
+    assert [item['id'] for item in records[0]['_children']['LineItem']] == [
+        'gid://shopify/LineItem/9001', 'gid://shopify/LineItem/9002'
+    ]
+    assert len(records[1]['_children']['LineItem']) == 1
+    assert all('__parentId' not in item for item in records[0]['_children']['LineItem'])
+    # Barn uten id grupperes på __typename
+    assert sorted(records[0]['_children']) == [
+        'DiscountCodeApplication', 'LineItem', 'ManualDiscountApplication', 'ShippingLine'
+    ]
+    assert '__typename' not in records[0]['_children']['ShippingLine'][0]
+
+def test_iter_bulk_records_ignores_orphan_children():
+    lines = [
+        '{"id":"gid://shopify/LineItem/1","__parentId":"gid://shopify/Order/404"}',
+        '{"id":"gid://shopify/Order/1"}'
+    ]
+    records = list(iter_bulk_records(lines))
+    assert records == [{'id': 'gid://shopify/Order/1', '_children': {}}]
+
+def test_order_from_bulk_matches_rest_shape():
+    first, second = [order_from_bulk(record) for record in iter_bulk_records(read_lines('bulk_orders.jsonl'))]
+
+    assert first['id'] == 1001
+    assert first['order_number'] == 1001
+    assert first['financial_status'] == 'partially_refunded'
+    assert first['fulfillment_status'] is None
+    assert first['total_price'] == '448.00'
+    # Ledgeren leser total_shipping_price_set->'shop_money'->>'amount'
+    assert first['total_shipping_price_set'] == {'shop_money': {'amount': '49.00', 'currency_code': 'NOK'}}
+    assert first['customer']['id'] == 501
+    assert (first['customer']['first_name'], first['customer']['email'], first['customer']['tags']) == ('Kari', 'kari@example.com', 'fast')
+    assert [item['id'] for item in first['line_items']] == [9001, 9002]
+    assert first['line_items'][0]['price'] == '149.50'
+    assert first['line_items'][0]['product_id'] == 301
+    assert first['line_items'][1]['product_id'] is None
+    assert 'refunds' not in first
+
+    assert second['total_shipping_price_set'] is None
+    assert second['customer'] is None
+    assert second['fulfillment_status'] == 'fulfilled'
+
+def test_order_from_bulk_keeps_addresses_taxes_discounts_and_fulfillments():
+    first, second = [order_from_bulk(record) for record in iter_bulk_records(read_lines('bulk_orders.jsonl'))]
+
+    assert first['billing_address']['address1'] == 'Storgata 1'
+    assert first['shipping_address']['country_code'] == 'NO'
+    assert first['tags'] == 'vip, bokklubb'
+    assert first['note_attributes'] == [{'name': 'gave', 'value': 'ja'}]
+    assert (first['taxes_included'], first['total_weight']) == (True, 850)
+    assert first['tax_lines'] == [{
+        'title': 'MVA', 'rate': 0.25, 'price': '89.60',
+        'price_set': {'shop_money': {'amount': '89.60', 'currency_code': 'NOK'}}
+    }]
+    assert first['discount_codes'] == [{'code': 'VAR10'}]
+    # Sortert på index, uavhengig av rekkefølgen i JSONL
+    assert [(a['type'], a.get('code') or a.get('title'), a['value'], a['value_type']) for a in first['discount_applications']] == [
+        ('discount_code', 'VAR10', '10.00', 'fixed_amount'),
+        ('manual', 'Kulance', 5.0, 'percentage')
+    ]
+    assert [(line['id'], line['price'], line['tax_lines'][0]['price']) for line in first['shipping_lines']] == [(851, '49.00', '9.80')]
+    fulfillment, = first['fulfillments']
+    assert (fulfillment['id'], fulfillment['order_id'], fulfillment['status'], fulfillment['location_id']) == (801, 1001, 'success', 11)
+    assert fulfillment['tracking_numbers'] == ['70712345'] and fulfillment['tracking_company'] == 'Posten'
+
+    item = first['line_items'][0]
+    assert (item['name'], item['requires_shipping'], item['gift_card'], item['fulfillable_quantity']) == ('Bok A - Heftet', True, False, 2)
+    assert item['fulfillment_status'] is None
+    assert item['properties'] == [{'name': 'signert', 'value': 'ja'}]
+    assert item['total_discount'] == '10.00'
+    assert item['discount_allocations'][0]['amount'] == '10.00'
+    assert item['discount_allocations'][0]['discount_application_index'] == 0
+    assert item['tax_lines'][0]['price'] == '57.80'
+    assert item['product_exists'] is True and first['line_items'][1]['product_exists'] is False
+
+    assert second['billing_address'] is None
+    assert second['shipping_lines'] == [] and second['discount_applications'] == []
+    assert second['total_weight'] is None
+    assert second['line_items'][0]['fulfillment_status'] == 'fulfilled'
+
+def test_product_from_bulk_matches_rest_shape():
+    first, second = [product_from_bulk(record) for record in iter_bulk_records(read_lines('bulk_products.jsonl'))]
+
+    assert first['id'] == 301
+    assert first['status'] == 'active'
+    assert first['tags'] == 'roman, nyhet'
+    assert first['options'][0]['values'] == ['Heftet', 'Innbundet']
+    assert first['image']['src'] == 'https://cdn.example.com/a.jpg'
+    assert first['images'][0]['position'] == 1
+    assert [variant['id'] for variant in first['variants']] == [401, 402]
+    assert first['variants'][0]['option1'] == 'Heftet'
+    assert first['variants'][0]['image_id'] == 701
+    assert first['variants'][1]['inventory_policy'] == 'continue'
+    assert first['variants'][1]['image_id'] is None
+    # Vekt, lager og frakt fra REST-varianten
+    assert [(v['weight'], v['weight_unit'], v['grams']) for v in first['variants']] == [(350.0, 'g', 350), (0.7, 'kg', 700)]
+    assert [v['inventory_item_id'] for v in first['variants']] == [501, 502]
+    assert [v['inventory_management'] for v in first['variants']] == ['shopify', None]
+    assert first['variants'][0]['requires_shipping'] is True
+    assert first['variants'][0]['taxable'] is True
+    assert first['variants'][0]['fulfillment_service'] == 'manual'
+
+    assert second['status'] == 'draft'
+    assert second['images'] == [] and second['image'] is None
+    assert second['variants'] == []
+
+def test_build_bulk_query_filters_on_updated_at():
+    assert "updated_at:>='2025-01-01T00:00:00+00:00'" in build_bulk_query('orders', '2025-01-01T00:00:00+00:00')
+    assert 'query:' not in build_bulk_query('products')
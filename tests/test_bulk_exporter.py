@@ -0,0 +1,141 @@
+"""BulkExporter mot en lokal stub-server: start, venting og nedlasting av JSONL"""
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+
+from bulk_export import BulkExporter, BulkExportError, iter_bulk_pages
+from rate_limiter import ShopifyRateLimiter
+
+from tests.conftest import DATA_DIR
+
+class StubShopify(BaseHTTPRequestHandler):
+    """
+    GraphQL-endepunkt og nedlastings-URL for én bulk-operasjon.
+    server.statuses er statusene currentBulkOperation gir etter tur;
+    server.responses kan legge inn svar (status, headere, body) før de vanlige.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, headers=None):
+        payload = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        server.requests.append({'token': self.headers.get('X-Shopify-Access-Token'), **request})
+        if server.responses:
+            self.send(*server.responses.pop(0))
+            return
+
+        if 'bulkOperationRunQuery' in request['query']:
+            self.send(200, {'data': {'bulkOperationRunQuery': {
+                'bulkOperation': {'id': 'gid://shopify/BulkOperation/1', 'status': 'CREATED'},
+                'userErrors': server.user_errors
+            }}})
+            return
+
+        status = server.statuses.pop(0) if len(server.statuses) > 1 else server.statuses[0]
+        url = f"http://127.0.0.1:{server.server_port}/result.jsonl" if server.has_result else None
+        self.send(200, {'data': {'currentBulkOperation': {
+            'id': 'gid://shopify/BulkOperation/1',
+            'status': status,
+            'errorCode': 'INTERNAL_SERVER_ERROR' if status == 'FAILED' else None,
+            'objectCount': '5',
+            'url': url if status == 'COMPLETED' else None,
+            'partialDataUrl': None
+        }}})
+
+    def do_GET(self):
+        self.server.downloads.append({'path': self.path, 'token': self.headers.get('X-Shopify-Access-Token')})
+        with open(os.path.join(DATA_DIR, 'bulk_orders.jsonl'), 'rb') as f:
+            self.send(200, f.read())
+
+@pytest.fixture
+def shopify():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubShopify)
+    server.requests = []
+    server.downloads = []
+    server.responses = []
+    server.user_errors = []
+    server.statuses = ['CREATED', 'RUNNING', 'COMPLETED']
+    server.has_result = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def make_exporter(server, **options):
+    return BulkExporter(
+        f"http://127.0.0.1:{server.server_port}/admin/api/2023-10/graphql.json",
+        {'Content-Type': 'application/json', 'X-Shopify-Access-Token': 'shpat_test'},
+        poll_interval=0,
+        **options
+    )
+
+def test_export_starts_polls_and_downloads(shopify):
+    pages = list(iter_bulk_pages(make_exporter(shopify), 'orders', '2025-03-01T00:00:00+00:00', page_size=1))
+
+    assert [(page_count, [order['id'] for order in orders]) for page_count, orders in pages] == [(1, [1001]), (2, [1002])]
+    assert [len(orders[0]['line_items']) for _, orders in pages] == [2, 1]
+
+    mutation, *polls = shopify.requests
+    assert "updated_at:>='2025-03-01T00:00:00+00:00'" in mutation['variables']['query']
+    assert len(polls) == 3 and all('currentBulkOperation' in poll['query'] for poll in polls)
+    assert all(request['token'] == 'shpat_test' for request in shopify.requests)
+    # Den signerte nedlastings-URL-en får ikke Shopify-tokenet
+    assert shopify.downloads == [{'path': '/result.jsonl', 'token': None}]
+
+def test_empty_export_yields_nothing(shopify):
+    shopify.has_result = False
+    shopify.statuses = ['COMPLETED']
+    assert list(iter_bulk_pages(make_exporter(shopify), 'products')) == []
+    assert shopify.downloads == []
+
+def test_failed_operation_raises(shopify):
+    shopify.statuses = ['RUNNING', 'FAILED']
+    with pytest.raises(BulkExportError, match='FAILED: INTERNAL_SERVER_ERROR'):
+        list(make_exporter(shopify).export('{ orders { edges { node { id } } } }'))
+    assert shopify.downloads == []
+
+def test_user_errors_stop_the_export(shopify):
+    shopify.user_errors = [{'field': None, 'message': 'A bulk query operation for this app and shop is already in progress'}]
+    with pytest.raises(BulkExportError, match='already in progress'):
+        list(make_exporter(shopify).export('{ orders { edges { node { id } } } }'))
+    assert len(shopify.requests) == 1
+
+RATE_LIMITED = (429, {'errors': 'Exceeded 2 calls per second for api client.'}, {'Retry-After': '0'})
+THROTTLED = (200, {
+    'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+    'extensions': {'cost': {'throttleStatus': {'maximumAvailable': 1000.0, 'currentlyAvailable': 1000.0, 'restoreRate': 50.0}}}
+})
+
+def test_rate_limited_requests_are_retried(shopify):
+    shopify.responses = [RATE_LIMITED, THROTTLED]
+    limiter = ShopifyRateLimiter()
+    shopify.statuses = ['COMPLETED']
+    shopify.has_result = False
+
+    assert list(make_exporter(shopify, rate_limiter=limiter).export('{ orders { edges { node { id } } } }')) == []
+    # To avviste forsøk av mutasjonen, deretter mutasjonen og én polling
+    assert len(shopify.requests) == 4
+    assert limiter.stats['throttled'] == 1
+
+def test_rate_limit_retries_are_bounded(shopify):
+    shopify.responses = [RATE_LIMITED] * 5
+    with pytest.raises(BulkExportError, match='rate limit etter 3 forsøk'):
+        make_exporter(shopify).graphql('{ shop { id } }')
+    assert len(shopify.requests) == 3
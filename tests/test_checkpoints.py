@@ -0,0 +1,46 @@
+"""Sjekkpunkter for paginert henting: lagring, gjenopptak og nullstilling"""
+import os
+
+from checkpoints import SyncCheckpoint
+
+PARAMS = {'status': 'any', 'limit': 250}
+
+def test_resume_from_saved_cursor(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    checkpoint = SyncCheckpoint(path, 'orders', PARAMS)
+    assert not checkpoint.resuming
+
+    checkpoint.advance(1, 'cursor-2')
+    checkpoint.save(order_count=250)
+    checkpoint.advance(2, 'cursor-3')
+    # Ikke lagret: side 2 er ikke committet
+
+    resumed = SyncCheckpoint(path, 'orders', PARAMS)
+    assert resumed.resuming
+    assert resumed.cursor == 'cursor-2'
+    assert resumed.page_count == 1
+    assert resumed.state == {'order_count': 250}
+
+def test_other_params_start_over(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    checkpoint = SyncCheckpoint(path, 'orders', PARAMS)
+    checkpoint.advance(1, 'cursor-2')
+    checkpoint.save()
+
+    other = SyncCheckpoint(path, 'orders', dict(PARAMS, updated_at_min='2025-01-01'))
+    assert not other.resuming
+
+def test_last_page_and_reset_remove_file(tmp_path):
+    path = str(tmp_path / 'orders.json')
+    checkpoint = SyncCheckpoint(path, 'orders', PARAMS)
+    checkpoint.advance(1, 'cursor-2')
+    checkpoint.save()
+    checkpoint.advance(2, None)
+    checkpoint.save()
+    assert not os.path.exists(path)
+
+    checkpoint.advance(1, 'cursor-2')
+    checkpoint.save(order_count=1)
+    checkpoint.reset()
+    assert not os.path.exists(path)
+    assert checkpoint.state == {} and not checkpoint.resuming
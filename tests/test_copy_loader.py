@@ -0,0 +1,49 @@
+"""CSV-kodingen som COPY-lasteren sender til Postgres"""
+import csv
+import io
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('psycopg2')
+
+from psycopg2.extras import Json
+
+from organized_shopify_backup import copy_value, copy_upsert
+
+class CopyCursor:
+    """Fanger COPY-strømmen i stedet for å sende den til databasen"""
+
+    def __init__(self):
+        self.copied = []
+        self.statements = []
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+    def copy_expert(self, sql, buffer):
+        self.copied.append(buffer.read())
+
+    def fetchall(self):
+        return []
+
+def test_copy_value():
+    assert copy_value(None) == '\\N'
+    assert copy_value(Json({'a': [1, 'ø']})) == '{"a": [1, "\\u00f8"]}'
+    assert copy_value('tekst') == 'tekst'
+    assert copy_value(12.5) == 12.5
+
+def test_copy_upsert_round_trips_awkward_text():
+    records = [
+        (1, 'Komma, "sitat" og\nlinjeskift', None, Json({'note': 'a,b'})),
+        (2, '', 'æøå', Json([]))
+    ]
+    cursor = CopyCursor()
+    copy_upsert(cursor, 'orders', ['id', 'note', 'email', 'raw_data'], records, ['note'])
+
+    rows = list(csv.reader(io.StringIO(''.join(cursor.copied))))
+    assert rows == [
+        ['1', 'Komma, "sitat" og\nlinjeskift', '\\N', '{"note": "a,b"}'],
+        ['2', '', 'æøå', '[]']
+    ]
+    assert 'COPY' not in cursor.statements[-1] and 'ON CONFLICT' in cursor.statements[-1]
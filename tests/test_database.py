@@ -0,0 +1,106 @@
+"""Tilkoblingspoolen: uten database, full pool og tilkoblingsfeil"""
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+from psycopg2.pool import PoolError
+
+import database
+from database import PhaseTransaction, close_pool, get_db_connection, release_db_connection
+
+class FakeConnection:
+    closed = 0
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class FakePool:
+    """Stand-in for ThreadedConnectionPool som ikke begrenser antall tilkoblinger selv"""
+    created = 0
+    unreachable = False
+    getconn_error = None
+
+    def __init__(self, minconn, maxconn, **connection):
+        FakePool.created += 1
+        if FakePool.unreachable:
+            raise psycopg2.OperationalError('could not connect to server: Connection refused')
+
+    def getconn(self):
+        if FakePool.getconn_error:
+            raise FakePool.getconn_error
+        return FakeConnection()
+
+    def putconn(self, conn, close=False):
+        pass
+
+    def closeall(self):
+        pass
+
+@pytest.fixture(autouse=True)
+def fake_pool(monkeypatch):
+    monkeypatch.setattr(FakePool, 'created', 0)
+    monkeypatch.setattr(FakePool, 'unreachable', False)
+    monkeypatch.setattr(FakePool, 'getconn_error', None)
+    monkeypatch.setattr(database, 'ThreadedConnectionPool', FakePool)
+    monkeypatch.setattr(database, '_settings', {
+        'connection': {},
+        'pool': {'min_connections': 1, 'max_connections': 2, 'connection_timeout': 0.2, 'idle_timeout': 300},
+        'performance': {'batch_size': 1000, 'commit_interval': 1}
+    })
+    close_pool()
+    yield
+    close_pool()
+
+def test_unreachable_database_means_disk_only():
+    FakePool.unreachable = True
+    assert get_db_connection() is None
+    assert get_db_connection() is None
+    # Feilen huskes, så hver fase venter ikke på connect_timeout på nytt
+    assert FakePool.created == 1
+
+    commits = []
+    with PhaseTransaction(on_commit=lambda: commits.append(1)) as phase:
+        phase.step()
+        phase.step()
+    assert commits == [1, 1]
+
+def test_full_pool_waits_for_a_free_connection():
+    first = get_db_connection()
+    second = get_db_connection()
+    borrowed = []
+    waiting = threading.Thread(target=lambda: borrowed.append(get_db_connection()))
+    waiting.start()
+
+    release_db_connection(first)
+    waiting.join(timeout=1)
+    assert borrowed and borrowed[0] is not None
+
+    release_db_connection(second)
+    release_db_connection(borrowed[0])
+
+def test_full_pool_raises_after_connection_timeout():
+    held = [get_db_connection(), get_db_connection()]
+    with pytest.raises(PoolError, match='alle 2 er i bruk'):
+        get_db_connection()
+    for conn in held:
+        release_db_connection(conn)
+    release_db_connection(get_db_connection())
+
+def test_connection_failure_never_commits_the_phase():
+    get_db_connection()  # Poolen finnes, databasen svarer ikke lenger
+    FakePool.getconn_error = psycopg2.OperationalError('server closed the connection unexpectedly')
+    commits = []
+
+    with pytest.raises(psycopg2.OperationalError):
+        with PhaseTransaction(on_commit=lambda: commits.append(1)) as phase:
+            phase.step()
+    assert commits == []
+
+    # Plassen i poolen er gitt tilbake etter feilen
+    FakePool.getconn_error = None
+    assert get_db_connection() is not None
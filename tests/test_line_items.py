@@ -0,0 +1,71 @@
+"""Normalisering av ordrelinjer og refusjoner før de lagres i order_line_items"""
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('psycopg2')
+
+import organized_shopify_backup as backup
+from organized_shopify_backup import LINE_ITEM_COLUMNS, line_item_records, refunded_by_line_item
+
+ORDER = {
+    'id': 1001,
+    'line_items': [
+        {'id': 9001, 'product_id': 11, 'title': 'Bok A', 'quantity': 3, 'price': '199.00', 'vendor': 'Forlag X'},
+        {'title': 'Tips uten id', 'quantity': 1, 'price': '20.00'},
+        {'id': 9002, 'product_id': 12, 'title': 'Bok B', 'quantity': 1, 'price': '50.00', 'vendor': 'Forlag Y'}
+    ],
+    'refunds': [
+        {'refund_line_items': [{'line_item_id': 9001, 'quantity': 1, 'subtotal': '199.00'}]},
+        {'refund_line_items': [
+            {'line_item_id': 9001, 'quantity': 1, 'subtotal': 199.0},
+            {'line_item_id': 9002, 'quantity': 1, 'subtotal': '50.00'}
+        ]},
+        {'refund_line_items': None}
+    ]
+}
+
+def as_rows(order):
+    return [dict(zip(LINE_ITEM_COLUMNS, record)) for record in line_item_records(order)]
+
+def test_refunds_are_summed_per_line_item():
+    assert refunded_by_line_item(ORDER) == {9001: (2, 398.0), 9002: (1, 50.0)}
+    assert refunded_by_line_item({'id': 1}) == {}
+
+def test_line_item_records_carry_position_and_refunds():
+    rows = as_rows(ORDER)
+
+    assert [(row['id'], row['order_id'], row['position']) for row in rows] == [(9001, 1001, 1), (9002, 1001, 3)]
+    first, second = rows
+    assert (first['quantity'], first['price'], first['refunded_quantity'], first['refunded_amount']) == (3, 199.0, 2, 398.0)
+    assert (second['quantity'], second['refunded_quantity'], second['refunded_amount']) == (1, 1, 50.0)
+    assert first['raw_data'].adapted['title'] == 'Bok A'
+
+def test_lines_without_refunds():
+    rows = as_rows({'id': 7, 'line_items': [{'id': 1, 'quantity': 2, 'price': None}]})
+    assert [(row['quantity'], row['price'], row['refunded_quantity'], row['refunded_amount']) for row in rows] == [(2, 0, 0, 0.0)]
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+def test_bulk_orders_get_refunds_from_rest(monkeypatch):
+    requested = []
+
+    def fake_request(url, params=None, max_retries=3):
+        requested.append(url)
+        return FakeResponse({'refunds': [{'refund_line_items': [{'line_item_id': 9001, 'quantity': 1, 'subtotal': '149.50'}]}]})
+
+    monkeypatch.setattr(backup, 'safe_request', fake_request)
+    pages = [(1, [
+        {'id': 1001, 'financial_status': 'partially_refunded', 'line_items': [{'id': 9001, 'quantity': 2, 'price': '149.50'}]},
+        {'id': 1002, 'financial_status': 'paid', 'line_items': [{'id': 9003, 'quantity': 1, 'price': '199.00'}]}
+    ])]
+
+    (page_count, orders), = backup.with_bulk_refunds(pages)
+
+    # Kun den refunderte ordren koster et ekstra REST-kall
+    assert [url.rsplit('/', 2)[-2] for url in requested] == ['1001']
+    assert [row['refunded_quantity'] for order in orders for row in as_rows(order)] == [1, 0]
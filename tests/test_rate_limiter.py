@@ -0,0 +1,104 @@
+"""ShopifyRateLimiter med falsk klokke: REST-header, Retry-After og GraphQL-budsjett"""
+import pytest
+
+import rate_limiter
+from rate_limiter import ShopifyRateLimiter
+
+class FakeClock:
+    """Erstatter time-modulen i rate_limiter; sleep flytter klokka i stedet for å vente"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+class FakeResponse:
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+def throttle_status(available, maximum=1000.0, restore_rate=50.0):
+    return {'data': {}, 'extensions': {'cost': {
+        'requestedQueryCost': 10,
+        'actualQueryCost': 10,
+        'throttleStatus': {'maximumAvailable': maximum, 'currentlyAvailable': available, 'restoreRate': restore_rate}
+    }}}
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, 'time', clock)
+    return clock
+
+def test_call_limit_header_fills_the_bucket(clock):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_response(FakeResponse({'X-Shopify-Shop-Api-Call-Limit': '37/40'}))
+
+    # 37 brukt + 2 i sikkerhetsmargin: ett kall er ledig, det neste må vente på lekkasjen (2 kall/s)
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == [0.5]
+    assert limiter.stats['requests'] == 2
+
+def test_call_limit_header_updates_capacity(clock):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_response(FakeResponse({'X-Shopify-Shop-Api-Call-Limit': '10/80'}))
+    assert (limiter.capacity, limiter.leak_rate) == (80, 4.0)
+
+    # Headeren viser aldri mindre enn det vi selv har reservert
+    limiter.acquire()
+    limiter.update_from_response(FakeResponse({'X-Shopify-Shop-Api-Call-Limit': '1/80'}))
+    assert limiter._used == 11
+
+@pytest.mark.parametrize('header', [None, '', 'ukjent', 'a/b'])
+def test_missing_or_invalid_call_limit_header_is_ignored(clock, header):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_response(FakeResponse({'X-Shopify-Shop-Api-Call-Limit': header} if header is not None else {}))
+    assert (limiter.capacity, limiter._used) == (40, 0.0)
+
+def test_retry_after_blocks_the_next_call(clock):
+    limiter = ShopifyRateLimiter()
+    assert limiter.backoff(FakeResponse({'Retry-After': '3.5'})) == 3.5
+    assert limiter.stats['throttled'] == 1
+
+    limiter.acquire()
+    # Bøtta regnes som full, men har lekket nok mens Retry-After ble ventet ut
+    assert clock.sleeps == [3.5]
+    assert limiter.stats['requests'] == 1
+
+@pytest.mark.parametrize('headers', [{}, {'Retry-After': 'snart'}])
+def test_retry_after_falls_back_to_default_delay(clock, headers):
+    limiter = ShopifyRateLimiter()
+    assert limiter.backoff(FakeResponse(headers)) == 2.0
+    limiter.acquire_graphql(1)
+    assert clock.sleeps == [2.0]
+
+def test_graphql_throttle_status_sets_the_budget(clock):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_graphql_cost(throttle_status(available=100.0, maximum=2000.0, restore_rate=100.0))
+    assert (limiter.graphql_capacity, limiter.graphql_restore_rate) == (2000.0, 100.0)
+
+    limiter.acquire_graphql(100)
+    assert clock.sleeps == []
+    # Budsjettet er tomt: 250 poeng med 100 poeng/s
+    limiter.acquire_graphql(250)
+    assert clock.sleeps == [2.5]
+
+def test_graphql_budget_refills_up_to_capacity(clock):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_graphql_cost(throttle_status(available=0.0))
+    clock.now += 60
+    limiter.acquire_graphql(1000)
+    assert clock.sleeps == []
+    assert limiter._graphql_available == 0.0
+
+def test_payload_without_cost_leaves_the_budget(clock):
+    limiter = ShopifyRateLimiter()
+    limiter.update_from_graphql_cost({'data': {}})
+    limiter.update_from_graphql_cost(None)
+    assert limiter._graphql_available == 1000.0
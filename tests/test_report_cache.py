@@ -0,0 +1,123 @@
+"""Rapport-cachen: treff, bom og ugyldiggjøring når inndataene endres"""
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('fpdf')
+pytest.importorskip('dotenv')
+
+import generate_royalty_reports as royalty
+from report_cache import CACHE_FILENAME, ReportCache
+
+class LedgerConnection:
+    """
+    Svarer på ROYALTY_INPUT_QUERY fra ledger-rader i minnet, med samme gruppering
+    og de samme feltene i hashen som spørringen bruker i PostgreSQL
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params):
+        assert 'l.royalty_percent' in query
+
+    def fetchall(self):
+        groups = {}
+        for row in sorted(self.rows, key=lambda row: (row['order_id'], row['line_item_id'])):
+            groups.setdefault((row['vendor'].lower(), row['month']), []).append(row)
+        return [
+            (vendor_key, month, len(rows), hashlib.md5(','.join(
+                '|'.join(str(row[field]) for field in ('order_id', 'line_item_id', 'updated_at', 'royalty_percent', 'royalty_amount'))
+                for row in rows
+            ).encode('utf-8')).hexdigest(), min(row['vendor'] for row in rows))
+            for (vendor_key, month), rows in groups.items()
+        ]
+
+def ledger_row(order_id, vendor, month, royalty_percent=20):
+    price_ex_vat = 200.0
+    return {
+        'order_id': order_id, 'line_item_id': order_id * 10, 'vendor': vendor, 'month': month,
+        'updated_at': '2025-03-05T10:00:00+00:00', 'royalty_percent': royalty_percent,
+        'royalty_amount': price_ex_vat * royalty_percent / 100
+    }
+
+@pytest.fixture
+def report_dir(tmp_path):
+    return str(tmp_path)
+
+def write_report(report_dir, name='royalty_report_2025-03.pdf'):
+    path = os.path.join(report_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('rapport')
+    return path
+
+def test_same_fingerprint_is_a_hit_after_reload(report_dir):
+    cache = ReportCache(report_dir)
+    key = ReportCache.key('royalty', 2025, '03')
+    assert not cache.is_fresh(key, 'abc')
+
+    cache.store(key, 'abc', [write_report(report_dir)])
+    cache.save()
+
+    reloaded = ReportCache(report_dir)
+    assert reloaded.entries[key]['files'] == ['royalty_report_2025-03.pdf']
+    assert reloaded.is_fresh(key, 'abc')
+
+def test_changed_fingerprint_or_missing_file_is_a_miss(report_dir):
+    cache = ReportCache(report_dir)
+    key = ReportCache.key('royalty', 2025, '03', 'forfatter')
+    path = write_report(report_dir)
+    cache.store(key, 'abc', [path])
+
+    assert not cache.is_fresh(key, 'def')
+    assert not cache.is_fresh(ReportCache.key('royalty', 2025, '04', 'forfatter'), 'abc')
+    os.remove(path)
+    assert not cache.is_fresh(key, 'abc')
+
+def test_unused_entries_are_pruned(report_dir):
+    cache = ReportCache(report_dir, retention_days=30)
+    cache.store('royalty:*:2024-01', 'old', [])
+    cache.store('royalty:*:2025-03', 'new', [])
+    cache.entries['royalty:*:2024-01']['last_used'] = (datetime.now() - timedelta(days=31)).isoformat()
+
+    cache.save()
+    assert list(ReportCache(report_dir).entries) == ['royalty:*:2025-03']
+
+def test_unreadable_cache_starts_empty(report_dir):
+    with open(os.path.join(report_dir, CACHE_FILENAME), 'w', encoding='utf-8') as f:
+        f.write('{ikke json')
+    assert ReportCache(report_dir).entries == {}
+
+def test_royalty_percent_change_invalidates_the_month(report_dir):
+    rows = [ledger_row(1001, 'Forfatter', '03'), ledger_row(1002, 'Annen', '03'), ledger_row(1003, 'Forfatter', '04')]
+    conn = LedgerConnection(rows)
+    cache = ReportCache(report_dir)
+
+    fingerprints = royalty.monthly_royalty_fingerprints(royalty.fetch_royalty_inputs(conn, 2025))
+    for month, report_fingerprint in fingerprints.items():
+        cache.store(ReportCache.key('royalty', 2025, month), report_fingerprint, [])
+
+    # Prosenten endres på produktet, og triggeren bygger ledgeren på nytt for ordrene
+    rows[0].update(ledger_row(1001, 'Forfatter', '03', royalty_percent=25))
+    fingerprints = royalty.monthly_royalty_fingerprints(royalty.fetch_royalty_inputs(conn, 2025))
+
+    assert not cache.is_fresh(ReportCache.key('royalty', 2025, '03'), fingerprints['03'])
+    assert cache.is_fresh(ReportCache.key('royalty', 2025, '04'), fingerprints['04'])
+
+def test_vendor_fingerprint_covers_template_version_and_vendor(monkeypatch):
+    base = royalty.royalty_fingerprint('hash', 'Forfatter')
+    assert royalty.royalty_fingerprint('hash', 'Forfatter') == base
+    assert royalty.royalty_fingerprint('hash', 'Annen') != base
+    monkeypatch.setattr(royalty, 'REPORT_TEMPLATE_VERSION', royalty.REPORT_TEMPLATE_VERSION + 1)
+    assert royalty.royalty_fingerprint('hash', 'Forfatter') != base
@@ -0,0 +1,38 @@
+"""Opplasting av rapporter: rclone-loggen og lokal mappe"""
+import json
+import os
+
+from report_upload import RcloneBackend, LocalDirBackend, upload_reports, failed_uploads
+
+def test_rclone_parse_log():
+    output = '\n'.join([
+        json.dumps({'level': 'info', 'msg': 'Copied (new)', 'object': 'a.json'}),
+        json.dumps({'level': 'info', 'msg': 'Copied (replaced existing)', 'object': 'vendor/b.pdf'}),
+        json.dumps({'level': 'error', 'msg': 'Failed to copy: quota', 'object': 'c.pdf'}),
+        json.dumps({'level': 'error', 'msg': 'Attempt 1/3 failed with 1 errors'}),
+        'ikke json'
+    ])
+    assert RcloneBackend.parse_log(output) == {
+        'a.json': {'status': 'uploaded'},
+        'vendor/b.pdf': {'status': 'uploaded'},
+        'c.pdf': {'status': 'failed', 'error': 'Failed to copy: quota'}
+    }
+
+def test_local_backend_skips_unchanged_files(tmp_path):
+    source = tmp_path / 'src'
+    destination = tmp_path / 'dst'
+    (source / 'vendor').mkdir(parents=True)
+    (source / 'a.json').write_text('a')
+    (source / 'vendor' / 'b.pdf').write_text('b')
+    files = [str(source / 'a.json'), str(source / 'vendor' / 'b.pdf'), str(source / 'mangler.pdf')]
+
+    first = upload_reports(files, str(destination), backend='local', transfers=2)
+    assert [r['status'] for r in first] == ['failed', 'uploaded', 'uploaded']
+    assert failed_uploads(first) == [str(source / 'mangler.pdf')]
+    assert (destination / 'vendor' / 'b.pdf').read_text() == 'b'
+
+    (source / 'a.json').write_text('endret')
+    second = upload_reports(files[:2], str(destination), backend=LocalDirBackend(2))
+    assert [r['status'] for r in second] == ['uploaded', 'skipped']
+    assert (destination / 'a.json').read_text() == 'endret'
+    assert not any(name.endswith('.tmp') for name in os.listdir(destination))
@@ -0,0 +1,89 @@
+"""SyncScheduler: avhengighetsrekkefølge og hopp over etter feil"""
+import threading
+
+import pytest
+
+from sync_scheduler import SyncScheduler
+
+class Recorder:
+    """Jobbfunksjoner som noterer start og slutt, og hvilke resultater de fikk"""
+
+    def __init__(self):
+        self.events = []
+        self.received = {}
+        self.lock = threading.Lock()
+
+    def job(self, name, result=None, error=None):
+        def run(dependencies):
+            with self.lock:
+                self.events.append(('start', name))
+                self.received[name] = dependencies
+            if error:
+                raise RuntimeError(error)
+            with self.lock:
+                self.events.append(('end', name))
+            return result if result is not None else name.upper()
+        return run
+
+    def index(self, event, name):
+        return self.events.index((event, name))
+
+def test_jobs_start_after_their_dependencies():
+    recorder = Recorder()
+    scheduler = SyncScheduler(max_workers=4)
+    scheduler.add('collections', recorder.job('collections'))
+    scheduler.add('products', recorder.job('products'), depends_on=['collections'])
+    scheduler.add('customers', recorder.job('customers'))
+    scheduler.add('orders', recorder.job('orders'), depends_on=['products'])
+    scheduler.add('buyer_names', recorder.job('buyer_names'), depends_on=['orders', 'customers'])
+
+    results = scheduler.run()
+
+    assert results == {name: name.upper() for name in ('collections', 'products', 'customers', 'orders', 'buyer_names')}
+    for job, dependency in [('products', 'collections'), ('orders', 'products'),
+                            ('buyer_names', 'orders'), ('buyer_names', 'customers')]:
+        assert recorder.index('end', dependency) < recorder.index('start', job)
+    # Jobben får kun resultatene til sine egne avhengigheter
+    assert recorder.received['buyer_names'] == {'orders': 'ORDERS', 'customers': 'CUSTOMERS'}
+    assert recorder.received['collections'] == {}
+    assert scheduler.failed == []
+
+def test_independent_jobs_run_at_the_same_time():
+    both_started = threading.Barrier(2, timeout=5)
+
+    def job(dependencies):
+        both_started.wait()
+        return True
+
+    scheduler = SyncScheduler(max_workers=2)
+    scheduler.add('products', job)
+    scheduler.add('customers', job)
+    assert scheduler.run() == {'products': True, 'customers': True}
+
+def test_failed_job_skips_its_dependents_only():
+    recorder = Recorder()
+    scheduler = SyncScheduler()
+    scheduler.add('products', recorder.job('products', error='HTTP 500'))
+    scheduler.add('customers', recorder.job('customers'))
+    scheduler.add('orders', recorder.job('orders'), depends_on=['products'])
+    scheduler.add('buyer_names', recorder.job('buyer_names'), depends_on=['orders', 'customers'])
+
+    results = scheduler.run()
+
+    assert results == {'customers': 'CUSTOMERS'}
+    assert ('start', 'orders') not in recorder.events
+    assert ('start', 'buyer_names') not in recorder.events
+    assert scheduler.failed == ['products', 'orders', 'buyer_names']
+
+    summary = scheduler.summary()
+    assert summary['products']['status'] == 'failed'
+    assert summary['products']['error'] == 'HTTP 500'
+    assert summary['orders'] == {'status': 'skipped', 'depends_on': ['products'], 'duration_seconds': None,
+                                 'error': 'avhengighet feilet: products'}
+    assert summary['buyer_names']['error'] == 'avhengighet feilet: orders'
+    assert summary['customers']['status'] == 'completed'
+
+def test_unknown_dependency_is_rejected():
+    scheduler = SyncScheduler()
+    with pytest.raises(ValueError, match="Ukjent avhengighet 'products'"):
+        scheduler.add('orders', lambda dependencies: None, depends_on=['products'])